@@ -1,9 +1,154 @@
-from scraper import ANMATScraper
+"""ANMAT vademecum scraper.
 
+    python . [crawl] [options]          today's snapshot (the default command)
+    python . resume [options]           continue today's interrupted crawl after its last completed lab
+    python . work QUEUE [options]       scrape the labs of a `crawl --coordinator QUEUE`
+    python . export [DATA_PATH] [--out PATH] [--force]
+    python . diff [DATA_PATH] [--out PATH] [--all]
+    python . validate [DATA_PATH] [--all] [--threshold NAME=VALUE ...]
+    python . query {gtin,certificado,lab,ifa,price,lab-changes} ...
+    python . snapshot {import,rebuild} ...
+    python . publish                    push the data commits that are not pushed yet and show the publication status
 
-def main():
-    scrape_anmat = ANMATScraper()
-    scrape_anmat.run()
+`python . COMMAND -h` shows the options of each command. Only the crawl commands import the navigation (requests and
+the ZK parsers) and only the parquet export and the diff import pyarrow.
+"""
+import sys
+import argparse
+import importlib
+
+
+CRAWL_COMMANDS = ('crawl', 'resume', 'work')
+DATA_COMMANDS = {
+    'export': 'columnar_export', 'diff': 'diff_report', 'validate': 'data_quality', 'query': 'meds_query',
+    'publish': 'data_publisher', 'snapshot': 'snapshot_store'
+}
+
+
+def crawl_parser(command, scraper, data_quality) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog=f'python . {command}', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    if command == 'work':
+        parser.add_argument('queue', metavar='QUEUE', help='labs queue of the coordinator')
+    parser.add_argument('--workers', type=int, default=scraper.WORKERS, help='parallel navigation sessions')
+    parser.add_argument('--max-rps', type=float, default=scraper.MAX_REQUESTS_PER_SECOND,
+                        help='global cap of requests per second for all the sessions')
+    parser.add_argument('--adaptive-rate', action='store_true',
+                        help='adapt the requests per second to the server (AIMD, from 2 up to --max-rps) instead of '
+                             'sending them as fast as --max-rps allows')
+    parser.add_argument('--full', action='store_true',
+                        help='crawl every lab, even the ones unchanged since the last snapshot')
+    parser.add_argument('--no-drugs-cache', action='store_true',
+                        help='open every drugs popup instead of using the drugs of the generic labels already seen')
+    parser.add_argument('--prefetch', type=int, default=scraper.PREFETCH_MEDS_PAGES, metavar='PAGES',
+                        help='meds pages of a lab fetched ahead while the current one is parsed (0 disables it)')
+    parser.add_argument('--record', metavar='PATH',
+                        help='save every request/response pair to a json lines file (see benchmarks/bench_offline.py)')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='json lines metrics file (default .cache/metrics/<date>_<time>.jsonl)')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='save a cProfile dump of the run (main thread only), see `python -m pstats PATH`')
+    if command == 'crawl':
+        parser.add_argument('--resume', action='store_true', help=argparse.SUPPRESS)
+    if command != 'work':
+        parser.add_argument('--no-publish', action='store_true',
+                            help='crawl into data/ without committing nor pushing to the data branch')
+        parser.add_argument('--threshold', type=data_quality.threshold, action='append', default=[],
+                            metavar='NAME=VALUE', help='replace a data quality threshold, see `python . validate -h`')
+        parser.add_argument('--no-quality-gate', action='store_true',
+                            help='publish the data without validating it')
+        parser.add_argument('--coordinator', metavar='QUEUE',
+                            help='queue the labs in a sqlite file shared with `work QUEUE` processes and merge their '
+                                 'rows (--workers sessions also work in this process, 0 to only coordinate)')
+    parser.add_argument('--lease', type=float, default=scraper.LABS_QUEUE_LEASE_SECONDS,
+                        help='seconds a worker holds a lab before it is queued again (renewed while scraping)')
+    return parser
+
+
+def crawl(command, argv):
+    import scraper
+    import data_quality
+    args = crawl_parser(command, scraper, data_quality).parse_args(argv)
+    recording = None
+    if args.record:
+        from http_fixtures import Recording
+        recording = Recording(args.record)
+    labs_queue_path = args.queue if command == 'work' else args.coordinator
+    labs_queue = None
+    if labs_queue_path:
+        from labs_queue import LabsQueue
+        labs_queue = LabsQueue(labs_queue_path, lease_seconds=args.lease)
+    publisher = None
+    publisher_error = None
+    if command != 'work' and not args.no_publish:
+        from data_publisher import DataPublisher
+        publisher = DataPublisher(scraper.dir_abs_path_of_file(scraper.__file__))
+        if not publisher.prepare():
+            publisher_error, publisher = publisher.status['error'], None
+    quality_gate = command != 'work' and scraper.QUALITY_GATE and not args.no_quality_gate
+    scrape_anmat = scraper.ANMATScraper(
+        workers=args.workers,
+        max_requests_per_second=args.max_rps,
+        adaptive_rate=scraper.ADAPTIVE_RATE or args.adaptive_rate,
+        incremental=scraper.INCREMENTAL and not args.full,
+        drugs_cache=scraper.DRUGS_CACHE and not args.no_drugs_cache,
+        prefetch_pages=args.prefetch,
+        quality_gate=quality_gate,
+        quality_thresholds=data_quality.thresholds_of(args.threshold) if quality_gate else None,
+        session_factory=recording.session if recording else None,
+        data_path=publisher.data_path if publisher else None,
+        metrics_path=args.metrics
+    )
+    if publisher_error:
+        scrape_anmat.progress.show('::: NO DATA BRANCH WORKTREE ({}), CRAWLING INTO {} WITHOUT PUBLISHING :::'.format(
+            publisher_error, scrape_anmat.data_path
+        ))
+    if publisher and publisher.fetch_error:
+        scrape_anmat.progress.show('::: DATA BRANCH NOT FETCHED ({}) :::'.format(publisher.fetch_error))
+    if publisher and publisher.backup_ref:
+        scrape_anmat.progress.show('::: UNPUBLISHED DATA CONFLICTED WITH THE DATA BRANCH, KEPT IN {} :::'.format(
+            publisher.backup_ref
+        ))
+    if command == 'work':
+        run, kwargs = scrape_anmat.run_worker, {'labs_queue': labs_queue}
+    else:
+        run, kwargs = scrape_anmat.run, {
+            'resume': command == 'resume' or args.resume, 'labs_queue': labs_queue, 'publisher': publisher
+        }
+    try:
+        if args.profile:
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                profiler.runcall(run, **kwargs)
+            finally:
+                profiler.dump_stats(args.profile)
+        else:
+            run(**kwargs)
+    finally:
+        if recording:
+            recording.close()
+    if publisher:
+        status = publisher.wait()
+        scrape_anmat.progress.show('::: PUBLICATION {}: {} :::'.format(status.get('state', '').upper(), ', '.join(
+            '{} {}'.format(name.upper(), value) for name, value in status.items() if name != 'state'
+        )))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    # Without a command (or with only options, as the scheduled runs do) it crawls
+    command = argv[0] if argv and not argv[0].startswith('-') else 'crawl'
+    argv = argv[1:] if argv and argv[0] == command else argv
+    if command in DATA_COMMANDS:
+        importlib.import_module(DATA_COMMANDS[command]).main(argv, prog=f'python . {command}')
+    elif command in CRAWL_COMMANDS:
+        crawl(command, argv)
+    else:
+        argparse.ArgumentParser(prog='python .').error(
+            'unknown command {!r}, choose from {}'.format(command, ', '.join(CRAWL_COMMANDS + tuple(DATA_COMMANDS)))
+        )
 
 
 if __name__ == '__main__':
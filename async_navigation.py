@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+import time
+import asyncio
+
+from typing import List, NamedTuple
+
+import requests
+
+from scraper import (
+    ANMATVademecumNavigation, SHOW_NAVIGATION, DRUGS_POPUPS_PER_REQUEST, NAVIGATION_MAX_RETRIES, ZKRequest, add_time
+)
+from metrics import Metrics
+from utils.utils import PrintControl
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncResponse(NamedTuple):
+    status: int
+    text: str
+    cookies: dict
+
+
+def pooled_connector(limit=100, keepalive_timeout=30):
+    """Connector with keep-alive to share between many navigation sessions (each one keeps its own cookies)."""
+    if aiohttp is None:
+        raise ImportError('The async navigation needs aiohttp: pip install aiohttp')
+    return aiohttp.TCPConnector(limit=limit, keepalive_timeout=keepalive_timeout)
+
+
+class AsyncANMATVademecumNavigation:
+    """Async version of ANMATVademecumNavigation: the same zkau requests, retries and recovery, sent with aiohttp.
+
+    Calls of the same session are serialized with a lock, since the ZK desktop state is sequential. Many sessions can
+    be in flight at the same time over one pooled connector.
+
+    The aiohttp session (and the connector, if none is given) is created in the event loop by the first request or by
+    `async with`, which also closes it.
+    """
+
+    MAIN_URL = ANMATVademecumNavigation.MAIN_URL
+    URL = ANMATVademecumNavigation.URL
+    URL_SKU = ANMATVademecumNavigation.URL_SKU
+    STATE_METHODS = ANMATVademecumNavigation.STATE_METHODS
+    CONNECTION_ERRORS = (aiohttp.ClientConnectionError,) if aiohttp else ()
+    # ZK error responses and parse errors are requests exceptions, as in the sync navigation
+    RETRIED_ERRORS = (
+        (aiohttp.ClientError, asyncio.TimeoutError, requests.exceptions.RequestException) if aiohttp else ()
+    )
+
+    class Control:
+        @classmethod
+        def navigation(cls, capture_navigation=True):
+            def request_exception_error_handler(method: callable):
+                async def handler(self: 'AsyncANMATVademecumNavigation', *args, **kwargs):
+                    async with self.lock:
+                        needs_recovery = False
+                        start = time.perf_counter()
+                        errors = 0
+                        for attempt in range(self.max_retries + 1):
+                            try:
+                                if needs_recovery:
+                                    await self.reset_connection_and_recover_last_state()
+                                self.current_call = method.__name__
+                                response = await method(self, *args, **kwargs)
+                                self.check_response(response)
+                                break
+                            except self.RETRIED_ERRORS as e:
+                                errors += 1
+                                needs_recovery = self.on_request_error(e) or needs_recovery
+                                if attempt == self.max_retries:
+                                    raise
+                            await asyncio.sleep(self.retry_delay(attempt))
+                        self.metrics.record_call(method.__name__, time.perf_counter() - start, attempt + 1, errors)
+                        if capture_navigation:
+                            self.capture_navigation(method, args, kwargs)
+                        return response
+                return handler
+            return request_exception_error_handler
+
+    def __init__(self, connector: 'aiohttp.BaseConnector' = None, rate_limiter=None,
+                 max_retries=NAVIGATION_MAX_RETRIES, metrics: Metrics = None):
+        if aiohttp is None:
+            raise ImportError('The async navigation needs aiohttp: pip install aiohttp')
+        self.connector = connector
+        self.connector_owner = connector is None
+        self.session = None  # type: aiohttp.ClientSession
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.metrics = metrics or Metrics()
+        self.current_call = None
+        self.recovery_stats = {
+            'errors': 0, 'connection_errors': 0, 'recoveries': 0, 'replayed_calls': 0,
+            'backoff_seconds': 0., 'recovery_seconds': 0.
+        }
+        self.lock = asyncio.Lock()
+        self.dt_id = None
+        self.session_id = None
+        self.lab_item_name_in_selector = None
+        self.labs_selector_page = None
+        self.labs_selector_page_num = None
+        self.capture_navigation_off = False
+        self.print = PrintControl(flush=True, on=SHOW_NAVIGATION, color=PrintControl.GREEN, formatter_function=add_time)
+        self.history_methods = []
+        self.history_params = []
+
+    async def new_session(self):
+        self.labs_selector_page_num = None
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        if self.connector is None:
+            self.connector = pooled_connector()
+        self.session = aiohttp.ClientSession(connector=self.connector, connector_owner=False)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+        if self.connector_owner and self.connector is not None:
+            await self.connector.close()
+            self.connector = None
+
+    async def __aenter__(self):
+        if self.session is None:
+            await self.new_session()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def request(self, method, url, **kwargs) -> AsyncResponse:
+        if self.rate_limiter:
+            await asyncio.get_running_loop().run_in_executor(None, self.rate_limiter.wait)
+        if self.session is None:
+            await self.new_session()
+        start = time.perf_counter()
+        async with self.session.request(method, url, **kwargs) as response:
+            async_response = AsyncResponse(
+                status=response.status,
+                text=await response.text(),
+                cookies={name: morsel.value for name, morsel in response.cookies.items()}
+            )
+        seconds = time.perf_counter() - start
+        self.metrics.record_request(self.current_call, seconds, len(async_response.text))
+        if self.rate_limiter:
+            self.rate_limiter.on_response(seconds)
+        return async_response
+
+    async def send(self, request: ZKRequest) -> AsyncResponse:
+        return await self.request(request.method, request.url, data=request.data)
+
+    check_response = staticmethod(ANMATVademecumNavigation.check_response)
+    on_request_error = ANMATVademecumNavigation.on_request_error
+    retry_delay = ANMATVademecumNavigation.retry_delay
+    capture_navigation = ANMATVademecumNavigation.capture_navigation
+    recovery_plan = ANMATVademecumNavigation.recovery_plan
+    start_recovery = ANMATVademecumNavigation.start_recovery
+    end_recovery = ANMATVademecumNavigation.end_recovery
+    load_session_ids = ANMATVademecumNavigation.load_session_ids
+    load_labs_pos_and_item_names_in_selector = ANMATVademecumNavigation.load_labs_pos_and_item_names_in_selector
+    main_page_request = ANMATVademecumNavigation.main_page_request
+    labs_selector_open_request = ANMATVademecumNavigation.labs_selector_open_request
+    labs_selector_page_request = ANMATVademecumNavigation.labs_selector_page_request
+    labs_selector_close_request = ANMATVademecumNavigation.labs_selector_close_request
+    select_lab_request = ANMATVademecumNavigation.select_lab_request
+    search_request = ANMATVademecumNavigation.search_request
+    meds_list_page_request = ANMATVademecumNavigation.meds_list_page_request
+    meds_drugs_request = ANMATVademecumNavigation.meds_drugs_request
+
+    async def reset_connection_and_recover_last_state(self):
+        start = self.start_recovery()
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    await self.new_session()
+                    for method, params in self.recovery_plan():
+                        await self.replay_call(method, *params)
+                    return
+                except self.RETRIED_ERRORS as e:
+                    self.on_request_error(e)
+                    if attempt == self.max_retries:
+                        raise
+                await asyncio.sleep(self.retry_delay(attempt))
+        finally:
+            self.end_recovery(start)
+
+    async def replay_call(self, method, args, kwargs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.recovery_stats['replayed_calls'] += 1
+                self.check_response(await method(self, *args, **kwargs))
+                return
+            except self.CONNECTION_ERRORS as e:
+                self.on_request_error(e)
+                if attempt == self.max_retries:
+                    raise
+            await asyncio.sleep(self.retry_delay(attempt))
+
+    @Control.navigation()
+    async def page__open_and_load_session_ids(self):
+        self.print.show('[NAVIGATION] --- LOAD MAIN ---')
+        self.load_session_ids(await self.send(self.main_page_request()))
+
+    @Control.navigation()
+    async def labs_selector__open_page(self, page=None):
+        self.print.show('[NAVIGATION] --- OPEN LABS SELECTOR ---')
+        response = await self.send(self.labs_selector_open_request())
+        if page:
+            self.print.show('[NAVIGATION] --- LABS SELECTOR, SELECT PAGE: {} ---'.format(page))
+            response = await self.send(self.labs_selector_page_request(page))
+        self.load_labs_pos_and_item_names_in_selector(response, page)
+        return response
+
+    @Control.navigation()
+    async def labs_selector__close(self):
+        self.print.show('[NAVIGATION] --- CLOSE LABS SELECTOR ---')
+        await self.send(self.labs_selector_close_request())
+
+    @Control.navigation()
+    async def select_lab_on_selector(self, lab_pos_in_sel):
+        self.print.show('[NAVIGATION] --- SELECT LAB {} ON SELECTOR ---'.format(lab_pos_in_sel))
+        await self.send(self.select_lab_request(lab_pos_in_sel))
+
+    @Control.navigation()
+    async def search(self):
+        self.print.show('[NAVIGATION] --- PRESS SEARCH BUTTON ---')
+        return await self.send(self.search_request())
+
+    @Control.navigation()
+    async def select_meds_list_page(self, page):
+        return await self.send(self.meds_list_page_request(page))
+
+    @Control.navigation(capture_navigation=False)
+    async def open_med_drugs(self, item_name):
+        return await self.send(self.meds_drugs_request([item_name]))
+
+    @Control.navigation(capture_navigation=False)
+    async def open_meds_drugs_in_one_request(self, item_names):
+        return await self.send(self.meds_drugs_request(item_names))
+
+    async def open_meds_drugs(self, item_names, popups_per_request=DRUGS_POPUPS_PER_REQUEST) -> List[str]:
+        popups = []
+        for ini_pos in range(0, len(item_names), popups_per_request):
+            batch = item_names[ini_pos:ini_pos + popups_per_request]
+            if len(batch) > 1:
+                response = await self.open_meds_drugs_in_one_request(batch)
+                batch_popups = ANMATVademecumNavigation.MED_DRUGS_POPUP_RE.split(response.text)[1:]
+                if len(batch_popups) == len(batch):
+                    popups.extend(batch_popups)
+                    continue
+            for item_name in batch:
+                popups.append((await self.open_med_drugs(item_name)).text)
+        return popups
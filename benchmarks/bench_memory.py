@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Memory of the meds rows a run keeps: the last snapshot held for reuse and the rows of the labs in flight.
+
+    python benchmarks/bench_memory.py [CSV_PATH]
+
+Builds both from a daily csv (by default the last one in data/), as the previous plain representation (csv lists,
+rows with the drugs table repr) and as the compact one (interned tuples, MedRow with ingredient triples). Each one is
+measured in its own process: the bytes traced by tracemalloc and the growth of the peak RSS.
+"""
+import os
+import ast
+import sys
+import argparse
+import resource
+import subprocess
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from meds_csv import (  # noqa: E402
+    INGREDIENTS_COLUMN, LAB_COLUMN, MEDS_HEADER, compact_row, med_row, read_meds_csv, snapshot_paths
+)
+
+
+def legacy_last_meds_by_lab(csv_path):
+    last_meds_by_lab = {}
+    for med in read_meds_csv(csv_path):
+        if len(med) == len(MEDS_HEADER):
+            last_meds_by_lab.setdefault(med[LAB_COLUMN], []).append(med)
+    return last_meds_by_lab
+
+
+def compact_last_meds_by_lab(csv_path):
+    last_meds_by_lab = {}
+    for med in read_meds_csv(csv_path):
+        if len(med) == len(MEDS_HEADER):
+            last_meds_by_lab.setdefault(med[LAB_COLUMN], []).append(compact_row(med))
+    return last_meds_by_lab
+
+
+def crawled_meds(csv_path):
+    """(14 page cells, generic label, drugs table) of each row, as the navigation parses them."""
+    for med in read_meds_csv(csv_path):
+        if len(med) == len(MEDS_HEADER):
+            yield tuple(med[:INGREDIENTS_COLUMN - 1]), med[INGREDIENTS_COLUMN - 1], \
+                ast.literal_eval(med[INGREDIENTS_COLUMN] or '[]')
+
+
+def legacy_meds_in_flight(csv_path):
+    return [cells + (generic_label, str(drugs_table)) for cells, generic_label, drugs_table in crawled_meds(csv_path)]
+
+
+def compact_meds_in_flight(csv_path):
+    return [med_row(cells, generic_label, drugs_table) for cells, generic_label, drugs_table in crawled_meds(csv_path)]
+
+
+VARIANTS = {
+    'last snapshot, legacy': legacy_last_meds_by_lab,
+    'last snapshot, compact': compact_last_meds_by_lab,
+    'in flight, legacy': legacy_meds_in_flight,
+    'in flight, compact': compact_meds_in_flight,
+}
+
+
+def measure(variant, csv_path):
+    """Prints rows, traced bytes and peak RSS growth (KB) of a variant, run in this process."""
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    meds = VARIANTS[variant](csv_path)
+    traced = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    rows = sum(map(len, meds.values())) if isinstance(meds, dict) else len(meds)
+    print(rows, traced, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('csv_path', nargs='?')
+    parser.add_argument('--variant', choices=VARIANTS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    csv_path = args.csv_path or snapshot_paths(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data'))[-1]
+    if args.variant:
+        measure(args.variant, csv_path)
+        return
+    print(csv_path)
+    print('{:<24} {:>8} {:>10} {:>14} {:>12}'.format('rows held', 'rows', 'traced MB', 'bytes per row', 'peak RSS MB'))
+    for variant in VARIANTS:
+        rows, traced, rss_kb = map(int, subprocess.run(
+            (sys.executable, __file__, csv_path, '--variant', variant), check=True, stdout=subprocess.PIPE,
+            universal_newlines=True
+        ).stdout.split())
+        print('{:<24} {:>8} {:>10.1f} {:>14.0f} {:>12.1f}'.format(
+            variant, rows, traced / 1e6, traced / max(rows, 1), rss_kb / 1e3
+        ))
+
+
+if __name__ == '__main__':
+    main()
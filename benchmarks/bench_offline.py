@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""End-to-end crawl benchmark without hitting servicios.pami.org.ar.
+
+    python benchmarks/bench_offline.py [--recording PATH] [--latency SECONDS] [--error-rate RATE] [--backoff SECONDS]
+                                       [--workers 1 4 ...]
+
+The crawl is replayed from a recording made with `python . --record PATH`. Without one, a synthetic vademecum
+(`--labs`, `--pages`, `--rows`) is crawled once to record it. Reports labs/min, requests per lab, CPU per meds page and
+the retried calls, failed requests and session recoveries of the injected errors.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scraper  # noqa: E402
+from http_fixtures import Recording, Replay, SyntheticZKSession  # noqa: E402
+
+
+MEDS_PAGE_REQUESTS = {('POST', 'onAnchorPos', 'zk_comp_56'), ('POST', 'onPaging', 'zk_comp_99')}
+
+
+def crawl(session_factory, workers, data_path, adaptive_rate=False, prefetch_pages=scraper.PREFETCH_MEDS_PAGES):
+    anmat_scraper = scraper.ANMATScraper(
+        workers=workers, adaptive_rate=adaptive_rate, incremental=False, drugs_cache=False,
+        prefetch_pages=prefetch_pages, data_path=data_path, cache_path=os.path.join(data_path, 'cache/'),
+        session_factory=session_factory
+    )
+    anmat_scraper.progress.off()
+    anmat_scraper.crawl()
+    return anmat_scraper
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--recording', help='json lines recording made with `python . --record PATH`')
+    parser.add_argument('--labs', type=int, default=40)
+    parser.add_argument('--pages', type=int, default=3)
+    parser.add_argument('--rows', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0., help='seconds added to every replayed request')
+    parser.add_argument('--error-rate', type=float, default=0., help='share of replayed requests that fail')
+    parser.add_argument('--backoff', type=float, default=scraper.NAVIGATION_BACKOFF_SECONDS,
+                        help='seconds before the first retry of a failed call (doubled in each one)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1])
+    parser.add_argument('--adaptive-rate', action='store_true', help='replay with the adaptive rate limiter')
+    parser.add_argument('--prefetch', type=int, default=scraper.PREFETCH_MEDS_PAGES,
+                        help='meds pages fetched ahead while the current one is parsed (0 disables it)')
+    args = parser.parse_args()
+    scraper.NAVIGATION_BACKOFF_SECONDS = args.backoff
+    with tempfile.TemporaryDirectory() as tmp_path:
+        recording_path = args.recording
+        if not recording_path:
+            recording_path = os.path.join(tmp_path, 'recording.jsonl')
+            with Recording(recording_path) as recording:
+                crawl(
+                    lambda: recording.session(SyntheticZKSession(args.labs, args.pages, args.rows)),
+                    1, os.path.join(tmp_path, 'record/')
+                )
+        print('{:>8} {:>10} {:>10} {:>14} {:>14} {:>8} {:>8} {:>10}'.format(
+            'workers', 'labs', 'labs/min', 'requests/lab', 'CPU ms/page', 'retries', 'errors', 'recoveries'
+        ))
+        for workers in args.workers:
+            replay = Replay(recording_path, latency=args.latency, error_rate=args.error_rate, seed=0)
+            start, start_cpu = time.perf_counter(), time.process_time()
+            anmat_scraper = crawl(
+                replay.session, workers, os.path.join(tmp_path, f'replay_{workers}/'), args.adaptive_rate,
+                args.prefetch
+            )
+            seconds, cpu_seconds = time.perf_counter() - start, time.process_time() - start_cpu
+            labs = len(anmat_scraper.labs)
+            pages = sum(count for kind, count in replay.requests.items() if kind in MEDS_PAGE_REQUESTS)
+            recovery_stats = anmat_scraper.recovery_stats()
+            print('{:>8} {:>10} {:>10.1f} {:>14.1f} {:>14.2f} {:>8} {:>8} {:>10}'.format(
+                workers, labs, labs / seconds * 60, sum(replay.requests.values()) / max(labs, 1),
+                cpu_seconds / max(pages, 1) * 1000,
+                sum(call_metrics.retries for call_metrics in anmat_scraper.metrics.by_name.values()),
+                recovery_stats['errors'] + recovery_stats['connection_errors'], recovery_stats['recoveries']
+            ))
+
+
+if __name__ == '__main__':
+    main()
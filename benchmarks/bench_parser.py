@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Parser micro-benchmark: the previous per-field regex passes against the single pass of zk_parser.
+
+    python benchmarks/bench_parser.py [FIXTURES_DIR] [--number N]
+
+FIXTURES_DIR holds zkau response texts named meds_page*.txt, labs_selector_page*.txt and drugs_popup*.txt. The ones
+shipped in benchmarks/fixtures are synthetic (built to the shape the scraper regexes expect); recorded responses give
+more realistic numbers.
+"""
+import os
+import re
+import sys
+import glob
+import timeit
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import zk_parser  # noqa: E402
+
+
+def legacy_parse_meds_page(text):
+    pages_re = re.findall(r'"pageCount",([0-9]+)]', text)
+    total_size = re.findall(r'"totalSize",([0-9]+)]', text)
+    meds_cells = re.findall(
+        r"',{(visible:false,)?\$\$0onSwipe:true,\$\$0onAfterSize:true(?:(?:,value:')([^\']+)')?}",
+        text
+    )
+    new_meds_data = [meds_cells[pos:pos + 14] for pos in range(0, len(meds_cells), 14)]
+    meds_drugs_cell = re.findall(
+        r"\['zul.wgt.Label','([^']+)',{\$\$0onSwipe:true,\$onClick:true,\$\$0onAfterSize:true,"
+        r"style:'cursor:pointer',value:'([^']+)'},\[]]]],",
+        text
+    )
+    rows = [
+        tuple(
+            tuple_data[1] if tuple_data[0] == '' else str(1 if tuple_data[0] == 'visible:true,' else 0)
+            for tuple_data in med_data
+        )
+        for med_data in new_meds_data
+    ]
+    return pages_re, total_size, rows, meds_drugs_cell
+
+
+def legacy_parse_labs_selector_page(text):
+    item_names = re.findall(
+        r"\['zul.sel.Listitem','([^\']+)',{\$\$0onSwipe:true,\$\$0onAfterSize:true,_loaded:true,_index:", text
+    )
+    labels = re.findall(r'label:\'([^\']+)\'', text)
+    page_count = re.findall(r'"pageCount",([0-9]+)]', text)
+    total_size = re.findall(r'"totalSize",([0-9]+)]', text)
+    return item_names, labels, page_count, total_size
+
+
+def legacy_parse_drugs_table(text):
+    drugs_cells = re.findall(r"',{\$\$0onSwipe:true,\$\$0onAfterSize:true,value:'([^']+)", text)
+    return [drugs_cells[pos:pos + 3] for pos in range(0, len(drugs_cells), 3)]
+
+
+PARSERS = (
+    ('meds_page', legacy_parse_meds_page, zk_parser.parse_meds_page),
+    ('labs_selector_page', legacy_parse_labs_selector_page, zk_parser.parse_labs_selector_page),
+    ('drugs_popup', legacy_parse_drugs_table, zk_parser.parse_drugs_table),
+)
+
+
+def peak_allocated_bytes(parse, texts):
+    tracemalloc.start()
+    for text in texts:
+        parse(text)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('fixtures', nargs='?', default=os.path.join(os.path.dirname(__file__), 'fixtures'))
+    parser.add_argument('--number', type=int, default=2000, help='parses of each fixture per measure')
+    args = parser.parse_args()
+    print('{:<20} {:>8} {:>14} {:>14} {:>12} {:>12}'.format(
+        'response', 'files', 'legacy us/pg', 'single us/pg', 'legacy peak', 'single peak'
+    ))
+    for name, legacy_parse, parse in PARSERS:
+        texts = []
+        for path in sorted(glob.glob(os.path.join(args.fixtures, name + '*.txt'))):
+            with open(path) as fixture__file:
+                texts.append(fixture__file.read())
+        if not texts:
+            continue
+        times = []
+        for parse_function in (legacy_parse, parse):
+            seconds = min(timeit.repeat(lambda: [parse_function(text) for text in texts], number=args.number, repeat=3))
+            times.append(seconds / args.number / len(texts) * 1e6)
+        print('{:<20} {:>8} {:>14.1f} {:>14.1f} {:>12} {:>12}'.format(
+            name, len(texts), times[0], times[1],
+            peak_allocated_bytes(legacy_parse, texts), peak_allocated_bytes(parse, texts)
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""Typed Parquet copies of the daily meds snapshots (needs pyarrow).
+
+    python columnar_export.py [DATA_PATH] [--out PATH] [--force]
+
+Exports every daily csv of DATA_PATH (default the crawl data, in the data branch worktree or else data/) missing in PATH
+(default DATA_PATH/parquet/). Each row keeps the csv columns with the price as a decimal, the flags as booleans and the
+ingredients of `Genérico[IFA,Cantidad,Unidad]` as a list of (ifa, cantidad, unidad) structs, plus the snapshot day.
+"""
+import os
+import ast
+import sys
+import glob
+import argparse
+
+from decimal import Decimal
+from datetime import datetime
+from importlib.util import find_spec
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from data_publisher import default_data_path
+from meds_csv import COLUMN_NAMES, INGREDIENTS_COLUMN, MEDS_HEADER, read_meds_csv, snapshot_date, snapshot_paths
+
+# Imported by import_pyarrow() when it is first needed, it takes longer than anything else the csv commands use
+pyarrow = None
+
+
+PRICE_COLUMN = MEDS_HEADER.index('Precio Venta al Público')
+FLAG_COLUMNS = tuple(range(PRICE_COLUMN + 1, MEDS_HEADER.index('GTIN')))
+
+
+def pyarrow_installed() -> bool:
+    return pyarrow is not None or find_spec('pyarrow') is not None
+
+
+def import_pyarrow():
+    """The pyarrow module, with its parquet and compute modules loaded."""
+    global pyarrow
+    if pyarrow is None:
+        if not pyarrow_installed():
+            raise ImportError('The columnar export needs pyarrow: pip install pyarrow')
+        import pyarrow.compute
+        import pyarrow.parquet
+    return pyarrow
+
+
+def meds_schema():
+    import_pyarrow()
+    types = {
+        'laboratorio': pyarrow.dictionary(pyarrow.int32(), pyarrow.string()),
+        'forma_farmaceutica': pyarrow.dictionary(pyarrow.int32(), pyarrow.string()),
+        'precio': pyarrow.decimal128(12, 2),
+        'ingredientes': pyarrow.list_(pyarrow.struct([
+            ('ifa', pyarrow.string()), ('cantidad', pyarrow.float64()), ('unidad', pyarrow.string())
+        ])),
+    }
+    types.update({COLUMN_NAMES[column]: pyarrow.bool_() for column in FLAG_COLUMNS})
+    return pyarrow.schema(
+        [('dia', pyarrow.date32())] + [(name, types.get(name, pyarrow.string())) for name in COLUMN_NAMES]
+    )
+
+
+def parse_price(text) -> Optional[Decimal]:
+    """'$1,325.49' -> Decimal('1325.49'), None if there is no price."""
+    return Decimal(text.lstrip('$').replace(',', '')) if text else None
+
+
+def parse_flag(text) -> bool:
+    """The csvs have the flag text (old exports) or '0' (hidden flag) and '' when the flag is not set."""
+    return text not in ('', '0')
+
+
+def parse_ingredient(ifa, cantidad, unidad) -> Tuple[str, Optional[float], str]:
+    """A cantidad that is not a number (e.g. '1,5' or 'c.s.p.') is kept before the unidad, with a null cantidad."""
+    try:
+        return ifa, float(cantidad) if cantidad else None, unidad
+    except ValueError:
+        return ifa, None, f'{cantidad} {unidad}'.strip()
+
+
+def parse_ingredients(text) -> List[Tuple[str, Optional[float], Optional[str]]]:
+    """"[['IBUPROFENO', '400', 'MG']]" -> [('IBUPROFENO', 400.0, 'MG')].
+
+    A cell that is not a list of (IFA, Cantidad, Unidad) texts is kept as one ingredient with the raw text as its ifa
+    and a null cantidad and unidad.
+    """
+    if not text:
+        return []
+    try:
+        ingredients = ast.literal_eval(text)
+        if not all(len(ingredient) == 3 and all(isinstance(value, str) for value in ingredient)
+                   for ingredient in ingredients):
+            raise ValueError('not a list of (IFA, Cantidad, Unidad) texts')
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        return [(text, None, None)]
+    return [parse_ingredient(*ingredient) for ingredient in ingredients]
+
+
+def meds_table(day, rows: Iterable[Sequence[str]]):
+    """Typed table of the rows of a day, skipping the ones without every column."""
+    columns = [[] for _ in COLUMN_NAMES]
+    ingredients_by_text = {}
+    for row in rows:
+        if len(row) != len(MEDS_HEADER):
+            continue
+        for column, value in enumerate(row):
+            columns[column].append(value)
+    columns[PRICE_COLUMN] = [parse_price(text) for text in columns[PRICE_COLUMN]]
+    for column in FLAG_COLUMNS:
+        columns[column] = [parse_flag(text) for text in columns[column]]
+    for pos, text in enumerate(columns[INGREDIENTS_COLUMN]):
+        if text not in ingredients_by_text:
+            ingredients_by_text[text] = parse_ingredients(text)
+        columns[INGREDIENTS_COLUMN][pos] = ingredients_by_text[text]
+    schema = meds_schema()
+    day = datetime.strptime(day, '%Y%m%d').date()
+    arrays = [pyarrow.array([day] * len(columns[0]), pyarrow.date32())]
+    for column, values in enumerate(columns):
+        field_type = schema.field(COLUMN_NAMES[column]).type
+        if pyarrow.types.is_dictionary(field_type):
+            arrays.append(pyarrow.array(values, pyarrow.string()).dictionary_encode())
+        else:
+            arrays.append(pyarrow.array(values, field_type))
+    return pyarrow.Table.from_arrays(arrays, schema=schema)
+
+
+def ingredients_table(meds):
+    """One row per ingredient of each med (the ingredients column exploded), with the med certificado and GTIN."""
+    import_pyarrow()
+    exploded = meds.select(['dia', 'certificado', 'gtin', 'ingredientes']).to_pydict()
+    ingredients = {'dia': [], 'certificado': [], 'gtin': [], 'ifa': [], 'cantidad': [], 'unidad': []}
+    for pos, med_ingredients in enumerate(exploded['ingredientes']):
+        for ingredient in med_ingredients:
+            for name in ('dia', 'certificado', 'gtin'):
+                ingredients[name].append(exploded[name][pos])
+            for name in ('ifa', 'cantidad', 'unidad'):
+                ingredients[name].append(ingredient[name])
+    return pyarrow.table(ingredients)
+
+
+def parquet_path(out_path, day) -> str:
+    return os.path.join(out_path, day + '.parquet')
+
+
+def export_rows(day, rows: Iterable[Sequence[str]], out_path) -> str:
+    import_pyarrow()
+    os.makedirs(out_path, exist_ok=True)
+    path = parquet_path(out_path, day)
+    pyarrow.parquet.write_table(meds_table(day, rows), path + '.tmp', compression='zstd')
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def export_snapshot(csv_path, out_path) -> str:
+    return export_rows(snapshot_date(csv_path), read_meds_csv(csv_path), out_path)
+
+
+def export_history(data_path, out_path=None, force=False) -> List[str]:
+    """Exports the daily csvs without an up to date parquet, returns the written paths."""
+    out_path = out_path or os.path.join(data_path, 'parquet/')
+    written_paths = []
+    for csv_path in snapshot_paths(data_path):
+        path = parquet_path(out_path, snapshot_date(csv_path))
+        if force or not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(csv_path):
+            written_paths.append(export_snapshot(csv_path, out_path))
+    return written_paths
+
+
+def load_history(out_path, first_day=None, last_day=None, columns=None):
+    """One table with the exported days in [first_day, last_day] (YYYYMMDD, both optional)."""
+    import_pyarrow()
+    paths = [
+        path for path in sorted(glob.glob(os.path.join(out_path, '[0-9]' * 8 + '.parquet')))
+        if (first_day or '') <= os.path.basename(path)[:8] <= (last_day or '99999999')
+    ]
+    return pyarrow.concat_tables([pyarrow.parquet.read_table(path, columns=columns) for path in paths])
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog, description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('data_path', nargs='?', default=default_data_path())
+    parser.add_argument('--out', help='parquet directory (default DATA_PATH/parquet/)')
+    parser.add_argument('--force', action='store_true', help='export again the days already exported')
+    args = parser.parse_args(argv)
+    for path in export_history(args.data_path, args.out, args.force):
+        print(path, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""Publication of the crawled data to the data branch, from a git worktree of it.
+
+    python data_publisher.py [--repo PATH]
+
+Pushes the data commits that are not pushed yet (e.g. after a failed push) and prints the publication status.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+
+from datetime import datetime
+from typing import Optional, Sequence
+
+from utils.utils import backoff_delay, dir_abs_path_of_file
+
+
+DATA_BRANCH = 'data'
+REMOTE = 'origin'
+PUSH_MAX_RETRIES = 5
+REPO_PATH = dir_abs_path_of_file(__file__)
+
+
+def git(*args, cwd) -> str:
+    return subprocess.run(
+        ('git',) + args, cwd=cwd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
+    ).stdout.strip()
+
+
+def git_error(e: subprocess.CalledProcessError) -> str:
+    return '{}: {}'.format(' '.join(e.cmd), (e.stderr or '').strip() or 'exit status {}'.format(e.returncode))
+
+
+def default_data_path(repo_path=None) -> str:
+    """Data path of the last crawls: the data branch worktree one once it exists, else data/ of the repo."""
+    repo_path = repo_path or REPO_PATH
+    data_path = DataPublisher(repo_path).data_path
+    return data_path if os.path.isdir(data_path) else os.path.join(repo_path, 'data', '')
+
+
+class DataPublisher:
+    """Commits the data of each crawl on a worktree of the data branch and pushes it in a background thread.
+
+    The crawl writes to the worktree data directory, so the working tree of the repo stays on its branch. A failed
+    push is retried with backoff (rebasing on the remote branch if it moved) and the commit is kept for the next
+    publication; the last outcome is saved in .cache/publish_status.json.
+    """
+
+    def __init__(
+            self, repo_path, branch=DATA_BRANCH, remote=REMOTE, worktree_path=None, max_retries=PUSH_MAX_RETRIES
+    ):
+        self.repo_path = repo_path
+        self.branch = branch
+        self.remote = remote
+        self.upstream = f'{remote}/{branch}'
+        self.worktree_path = worktree_path or os.path.join(repo_path, '.cache', 'data_worktree', '')
+        self.data_path = os.path.join(self.worktree_path, 'data', '')
+        self.status_path = os.path.join(repo_path, '.cache', 'publish_status.json')
+        self.max_retries = max_retries
+        self.thread = None  # type: Optional[threading.Thread]
+        self.fetch_error = None  # type: Optional[str]
+        self.backup_ref = None  # type: Optional[str]
+        self.status = {}
+        if os.path.exists(self.status_path):
+            with open(self.status_path) as status__file:
+                self.status = json.load(status__file)
+
+    def set_status(self, state, **status):
+        self.status = dict(status, state=state, time=datetime.now().isoformat(timespec='seconds'))
+        os.makedirs(os.path.dirname(self.status_path), exist_ok=True)
+        with open(self.status_path + '.tmp', 'w') as status__file:
+            json.dump(self.status, status__file, indent=1)
+        os.replace(self.status_path + '.tmp', self.status_path)
+
+    def prepare(self) -> bool:
+        """Fetches the data branch and moves the worktree to it, keeping the commits not pushed yet and the files of an
+        interrupted crawl. Without the remote (fetch_error) the crawl goes on from the last fetched data branch, or from
+        the local one. Returns False (with the error in the status) if there is no data branch to crawl into."""
+        try:
+            git('fetch', '--quiet', self.remote, self.branch, cwd=self.repo_path)
+            self.fetch_error = None
+        except subprocess.CalledProcessError as e:
+            self.fetch_error = git_error(e)
+        try:
+            if not os.path.exists(os.path.join(self.worktree_path, '.git')):
+                git('worktree', 'prune', cwd=self.repo_path)
+                git('worktree', 'add', '--detach', self.worktree_path, self.start_point(), cwd=self.repo_path)
+            else:
+                self.rebase()
+        except subprocess.CalledProcessError as e:
+            self.set_status('failed', error=git_error(e))
+            return False
+        os.makedirs(self.data_path, exist_ok=True)
+        return True
+
+    def start_point(self) -> str:
+        """The fetched data branch or, if it was never fetched, the local one."""
+        for ref in (self.upstream, self.branch):
+            if not subprocess.run(
+                    ('git', 'rev-parse', '--verify', '--quiet', ref + '^{commit}'), cwd=self.repo_path,
+                    stdout=subprocess.DEVNULL
+            ).returncode:
+                return ref
+        return self.upstream
+
+    def rebase(self):
+        """Puts the commits not pushed yet on top of the fetched data branch. If they conflict with it (another run
+        published the same files) they are kept on a backup ref (backup_ref) and the worktree is reset to the branch."""
+        if os.path.exists(os.path.join(
+                self.worktree_path, git('rev-parse', '--git-path', 'rebase-merge', cwd=self.worktree_path)
+        )):
+            # Left by an interrupted rebase
+            git('rebase', '--abort', cwd=self.worktree_path)
+        try:
+            git('rebase', '--autostash', self.upstream, cwd=self.worktree_path)
+        except subprocess.CalledProcessError as e:
+            error = git_error(e)
+            subprocess.run(('git', 'rebase', '--abort'), cwd=self.worktree_path, stderr=subprocess.DEVNULL)
+            self.backup_ref = 'refs/data-backup/' + datetime.now().strftime('%Y%m%d_%H%M%S')
+            git('update-ref', self.backup_ref, 'HEAD', cwd=self.worktree_path)
+            git('reset', '--quiet', '--hard', self.upstream, cwd=self.worktree_path)
+            self.set_status('reset', backup=self.backup_ref, error=error)
+
+    def pending_commits(self) -> int:
+        return int(git('rev-list', '--count', f'{self.upstream}..HEAD', cwd=self.worktree_path))
+
+    def publish(self, paths: Sequence[str], message):
+        """Commits the paths (inside the worktree) and pushes them in the background, see wait()."""
+        self.wait()
+        self.thread = threading.Thread(target=self.commit_and_push, args=(list(paths), message))
+        self.thread.start()
+
+    def wait(self, timeout=None) -> dict:
+        """Status of the last publication, after it ends (or the timeout expires)."""
+        if self.thread:
+            self.thread.join(timeout)
+        return self.status
+
+    def commit_and_push(self, paths: Sequence[str], message):
+        try:
+            git('add', '--all', '--', *paths, cwd=self.worktree_path)
+            if subprocess.run(('git', 'diff', '--cached', '--quiet'), cwd=self.worktree_path).returncode:
+                git('commit', '--quiet', '-m', message, cwd=self.worktree_path)
+            elif not self.pending_commits():
+                self.set_status('unchanged')
+                return
+            self.set_status('committed', commit=git('rev-parse', 'HEAD', cwd=self.worktree_path))
+        except subprocess.CalledProcessError as e:
+            self.set_status('failed', error=git_error(e))
+            return
+        self.push()
+
+    def push(self) -> bool:
+        """Pushes the worktree commits, retrying with backoff, returns whether they were pushed."""
+        commit = git('rev-parse', 'HEAD', cwd=self.worktree_path)
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.set_status('retrying', commit=commit, attempts=attempt, error=error)
+                time.sleep(backoff_delay(attempt - 1))
+            try:
+                git('push', '--quiet', self.remote, f'HEAD:{self.branch}', cwd=self.worktree_path)
+                git('fetch', '--quiet', self.remote, self.branch, cwd=self.repo_path)
+                self.set_status('pushed', commit=commit, attempts=attempt + 1)
+                return True
+            except subprocess.CalledProcessError as e:
+                error = git_error(e)
+            try:
+                # Another run may have pushed meanwhile, our commits go on top of it
+                git('pull', '--quiet', '--rebase', self.remote, self.branch, cwd=self.worktree_path)
+                commit = git('rev-parse', 'HEAD', cwd=self.worktree_path)
+            except subprocess.CalledProcessError:
+                subprocess.run(('git', 'rebase', '--abort'), cwd=self.worktree_path, stderr=subprocess.DEVNULL)
+        self.set_status('failed', commit=commit, attempts=self.max_retries + 1, error=error)
+        return False
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog, description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--repo', default=REPO_PATH, help='repository path')
+    args = parser.parse_args(argv)
+    publisher = DataPublisher(args.repo)
+    if os.path.exists(os.path.join(publisher.worktree_path, '.git')) and publisher.pending_commits():
+        publisher.push()
+    json.dump(publisher.status, sys.stdout, indent=1)
+    print()
+    if publisher.status.get('state') == 'failed':
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""Data quality of a daily snapshot, checked in one streaming pass before it is published.
+
+    python data_quality.py [DATA_PATH] [--all] [--out PATH] [--threshold NAME=VALUE ...]
+
+Validates the last daily csv of DATA_PATH (default the crawl data, in the data branch worktree or else data/) against
+the previous one, or every consecutive pair with --all, writes <day>.json to PATH (default DATA_PATH/reports/quality/)
+and exits with status 1 if the last day crosses a threshold. The thresholds are the most anomalies a snapshot can have
+and still be published: bad_rows and blank_generics (shares of its rows), size_mismatches, dropped_labs and shrunk_labs
+(labs) and catalog_shrink (share of the last snapshot rows).
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from columnar_export import FLAG_COLUMNS, PRICE_COLUMN
+from data_publisher import default_data_path
+from meds_csv import LAB_COLUMN, MEDS_HEADER, read_meds_csv, snapshot_date, snapshot_paths
+
+
+CERTIFICADO_COLUMN = MEDS_HEADER.index('N° Certificado')
+GTIN_COLUMN = MEDS_HEADER.index('GTIN')
+GENERIC_COLUMN = MEDS_HEADER.index('Genérico')
+CERTIFICADO_RE = re.compile(r'[0-9]+')
+PRICE_RE = re.compile(r'(\$[0-9]{1,3}(,[0-9]{3})*\.[0-9]{2})?')
+GTIN_RE = re.compile(r'[0-9]*')
+# Row anomalies: the first four mean the cells are misaligned, like a row with a wrong column count
+COLUMNS, CERTIFICADO, PRICE, FLAGS, GTIN, BLANK_GENERIC = 'columns', 'certificado', 'price', 'flags', 'gtin', 'generic'
+LAB_SHRINK = .5  # a lab shrunk if it has less than this share of its last snapshot rows
+EXAMPLES_PER_ANOMALY = 5
+
+
+class QualityThresholds(NamedTuple):
+    """Most anomalies a snapshot can have and still be published."""
+    bad_rows: float = .001
+    blank_generics: float = .005
+    size_mismatches: int = 2
+    dropped_labs: int = 2
+    shrunk_labs: int = 2
+    catalog_shrink: float = .05
+
+
+def row_anomaly(row: Sequence[str]) -> Optional[str]:
+    """First anomaly of a csv row, None if it looks right."""
+    if len(row) != len(MEDS_HEADER):
+        return COLUMNS
+    if not CERTIFICADO_RE.fullmatch(row[CERTIFICADO_COLUMN]):
+        return CERTIFICADO
+    if not PRICE_RE.fullmatch(row[PRICE_COLUMN]):
+        return PRICE
+    # Each flag cell is empty, '0' (hidden) or the flag text, which is also its header
+    if any(row[column] not in ('', '0', MEDS_HEADER[column]) for column in FLAG_COLUMNS):
+        return FLAGS
+    if not GTIN_RE.fullmatch(row[GTIN_COLUMN]):
+        return GTIN
+    if not row[GENERIC_COLUMN]:
+        return BLANK_GENERIC
+    return None
+
+
+def meds_by_lab(rows: Iterable[Sequence[str]]) -> Counter:
+    return Counter(row[LAB_COLUMN] for row in rows if len(row) == len(MEDS_HEADER))
+
+
+class QualityReport:
+    """Anomalies of a snapshot: its rows by anomaly (with the first row numbers of each one) and the labs whose rows
+    differ from the totalSize of their catalog or from the last snapshot.
+
+    Only counters by anomaly and by lab are kept, so it takes the same memory for any number of rows.
+    """
+
+    def __init__(self, thresholds: QualityThresholds = QualityThresholds()):
+        self.thresholds = thresholds
+        self.rows = 0
+        self.anomalies = Counter()
+        self.examples = {}  # type: Dict[str, List[int]]
+        self.meds_by_lab = Counter()
+        self.last_rows = None  # type: Optional[int]
+        self.size_mismatches = {}  # type: Dict[str, Tuple[int, int]]
+        self.dropped_labs = []  # type: List[str]
+        self.shrunk_labs = {}  # type: Dict[str, Tuple[int, int]]
+
+    def add_rows(self, rows: Iterable[Sequence[str]]):
+        for row in rows:
+            self.rows += 1
+            anomaly = row_anomaly(row)
+            if anomaly:
+                self.anomalies[anomaly] += 1
+                examples = self.examples.setdefault(anomaly, [])
+                if len(examples) < EXAMPLES_PER_ANOMALY:
+                    examples.append(self.rows)
+            if len(row) == len(MEDS_HEADER):
+                self.meds_by_lab[row[LAB_COLUMN]] += 1
+
+    def compare(self, expected_meds_by_lab: Dict[str, int] = None, last_meds_by_lab: Dict[str, int] = None):
+        """Checks the rows of each lab against the totalSize of its catalog and its rows in the last snapshot."""
+        for lab, expected_meds in (expected_meds_by_lab or {}).items():
+            if self.meds_by_lab[lab] != expected_meds:
+                self.size_mismatches[lab] = expected_meds, self.meds_by_lab[lab]
+        if last_meds_by_lab is None:
+            return
+        self.last_rows = sum(last_meds_by_lab.values())
+        for lab, last_meds in last_meds_by_lab.items():
+            if not self.meds_by_lab[lab]:
+                self.dropped_labs.append(lab)
+            elif self.meds_by_lab[lab] < last_meds * LAB_SHRINK:
+                self.shrunk_labs[lab] = last_meds, self.meds_by_lab[lab]
+
+    def totals(self) -> Dict[str, float]:
+        """Values of the thresholds."""
+        bad_rows = sum(count for anomaly, count in self.anomalies.items() if anomaly != BLANK_GENERIC)
+        return {
+            'bad_rows': bad_rows / max(self.rows, 1),
+            'blank_generics': self.anomalies[BLANK_GENERIC] / max(self.rows, 1),
+            'size_mismatches': len(self.size_mismatches),
+            'dropped_labs': len(self.dropped_labs),
+            'shrunk_labs': len(self.shrunk_labs),
+            'catalog_shrink': 1 - self.rows / self.last_rows if self.last_rows else 0.,
+        }
+
+    def exceeded(self) -> Dict[str, Tuple[float, float]]:
+        """(value, threshold) of the thresholds the snapshot crosses."""
+        return {
+            name: (value, getattr(self.thresholds, name))
+            for name, value in self.totals().items() if value > getattr(self.thresholds, name)
+        }
+
+    @property
+    def passed(self) -> bool:
+        return not self.exceeded()
+
+    def summary(self) -> str:
+        exceeded = self.exceeded()
+        return ', '.join('{} {}{}'.format(
+            name.upper(), round(value, 4), ' > {}'.format(exceeded[name][1]) if name in exceeded else ''
+        ) for name, value in self.totals().items())
+
+    def as_dict(self) -> dict:
+        return {
+            'passed': self.passed, 'rows': self.rows, 'last_rows': self.last_rows, 'totals': self.totals(),
+            'thresholds': self.thresholds._asdict(), 'anomalies': dict(self.anomalies), 'examples': self.examples,
+            'size_mismatches': self.size_mismatches, 'dropped_labs': self.dropped_labs,
+            'shrunk_labs': self.shrunk_labs,
+        }
+
+
+def validate_snapshot(
+        rows: Iterable[Sequence[str]], expected_meds_by_lab: Dict[str, int] = None,
+        last_rows: Iterable[Sequence[str]] = None, thresholds: QualityThresholds = QualityThresholds()
+) -> QualityReport:
+    """Report of the rows of a snapshot (the totalSize of each lab catalog and the last snapshot are optional)."""
+    report = QualityReport(thresholds)
+    report.add_rows(rows)
+    report.compare(expected_meds_by_lab, None if last_rows is None else meds_by_lab(last_rows))
+    return report
+
+
+def write_quality_report(report: QualityReport, out_path, day, last_day=None) -> str:
+    os.makedirs(out_path, exist_ok=True)
+    json_path = os.path.join(out_path, day + '.json')
+    with open(json_path, 'w') as report_json__file:
+        json.dump(dict(report.as_dict(), dia=day, dia_anterior=last_day), report_json__file, indent=1,
+                  ensure_ascii=False)
+    return json_path
+
+
+def threshold(text) -> Tuple[str, float]:
+    """argparse type of a NAME=VALUE threshold."""
+    name, _, value = text.partition('=')
+    if name not in QualityThresholds._fields:
+        raise argparse.ArgumentTypeError('unknown threshold {!r}, choose from {}'.format(
+            name, ', '.join(QualityThresholds._fields)
+        ))
+    try:
+        return name, type(QualityThresholds._field_defaults[name])(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid value of the {name} threshold: {value!r}')
+
+
+def thresholds_of(items: Iterable[Tuple[str, float]] = ()) -> QualityThresholds:
+    """Default thresholds with the NAME=VALUE ones replaced."""
+    return QualityThresholds()._replace(**dict(items))
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog, description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('data_path', nargs='?', default=default_data_path())
+    parser.add_argument('--out', help='reports directory (default DATA_PATH/reports/quality/)')
+    parser.add_argument('--all', action='store_true', help='validate every day against the one before')
+    parser.add_argument('--threshold', type=threshold, action='append', default=[], metavar='NAME=VALUE',
+                        help='replace a default threshold ({})'.format(', '.join(
+                            f'{name}={value}' for name, value in QualityThresholds._field_defaults.items()
+                        )))
+    args = parser.parse_args(argv)
+    thresholds = thresholds_of(args.threshold)
+    csv_paths = snapshot_paths(args.data_path)
+    pairs = list(zip([None] + csv_paths, csv_paths))
+    report = None
+    for last_csv_path, csv_path in pairs if args.all else pairs[-1:]:
+        start = time.perf_counter()
+        report = validate_snapshot(
+            read_meds_csv(csv_path), last_rows=read_meds_csv(last_csv_path) if last_csv_path else None,
+            thresholds=thresholds
+        )
+        seconds = time.perf_counter() - start
+        write_quality_report(
+            report, args.out or os.path.join(args.data_path, 'reports', 'quality', ''), snapshot_date(csv_path),
+            snapshot_date(last_csv_path) if last_csv_path else None
+        )
+        print(snapshot_date(csv_path), 'PASSED' if report.passed else 'BLOCKED', report.summary(), f'{seconds:.3f} s',
+              file=sys.stderr)
+    if report and not report.passed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""Day over day changes of the meds catalog: products that appeared, disappeared or changed their price.
+
+    python diff_report.py [DATA_PATH] [--out PATH] [--all]
+
+Compares the last two daily csvs of DATA_PATH (default the crawl data, in the data branch worktree or else data/), or
+every consecutive pair with --all, and writes <day>.csv (one row per change) and <day>.json (totals) to PATH (default
+DATA_PATH/reports/).
+"""
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+
+from decimal import Decimal
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from columnar_export import COLUMN_NAMES, PRICE_COLUMN, import_pyarrow, parse_price, pyarrow_installed
+from data_publisher import default_data_path
+from meds_csv import MEDS_HEADER, read_meds_csv, snapshot_date, snapshot_paths
+from snapshot_store import meds_keys
+
+
+KEY_NAMES = ('certificado', 'gtin', 'presentacion', 'ocurrencia')
+INFO_NAMES = ('laboratorio', 'nombre_comercial')
+REPORT_HEADER = ('cambio',) + KEY_NAMES + INFO_NAMES + ('precio_anterior', 'precio', 'diferencia', 'variacion')
+APPEARED, DISAPPEARED, PRICE_CHANGED = 'alta', 'baja', 'precio'
+
+
+def full_rows(rows: Sequence[Sequence[str]]) -> List[Sequence[str]]:
+    return [row for row in rows if len(row) == len(MEDS_HEADER)]
+
+
+def price_change(last_price: Optional[Decimal], price: Optional[Decimal]) -> Tuple[Optional[Decimal], Optional[float]]:
+    if last_price is None or price is None:
+        return None, None
+    return price - last_price, float((price - last_price) / last_price) if last_price else None
+
+
+def diff_rows(last_rows: Sequence[Sequence[str]], rows: Sequence[Sequence[str]]) -> List[tuple]:
+    """Report rows (REPORT_HEADER), joining the two snapshots on (certificado, GTIN, presentación, occurrence)."""
+    if pyarrow_installed():
+        return diff_tables(snapshot_table(last_rows), snapshot_table(rows))
+    columns = {name: COLUMN_NAMES.index(name) for name in KEY_NAMES[:-1] + INFO_NAMES}
+    last_rows, rows = full_rows(last_rows), full_rows(rows)
+    last_by_key = {key[:-1] + (int(key[-1]),): last_row for key, last_row in zip(meds_keys(last_rows), last_rows)}
+    report = []
+    for key, row in zip(meds_keys(rows), rows):
+        key = key[:-1] + (int(key[-1]),)
+        last_row = last_by_key.pop(key, None)
+        info = tuple(row[columns[name]] for name in INFO_NAMES)
+        price = parse_price(row[PRICE_COLUMN])
+        if last_row is None:
+            report.append((APPEARED,) + key + info + (None, price, None, None))
+            continue
+        last_price = parse_price(last_row[PRICE_COLUMN])
+        if price != last_price:
+            report.append((PRICE_CHANGED,) + key + info + (last_price, price) + price_change(last_price, price))
+    for key, last_row in last_by_key.items():
+        info = tuple(last_row[columns[name]] for name in INFO_NAMES)
+        report.append((DISAPPEARED,) + key + info + (parse_price(last_row[PRICE_COLUMN]), None, None, None))
+    return sorted(report, key=lambda report_row: report_row[:5])
+
+
+def snapshot_table(rows: Sequence[Sequence[str]]):
+    """Key, info and price columns of a snapshot, with the prices ('$1,325.49') parsed as decimals."""
+    pyarrow = import_pyarrow()
+    rows = full_rows(rows)
+    columns = list(zip(*rows)) or [()] * len(MEDS_HEADER)
+    table = pyarrow.table({
+        name: pyarrow.array(columns[COLUMN_NAMES.index(name)], pyarrow.string())
+        for name in KEY_NAMES[:-1] + INFO_NAMES
+    })
+    prices = pyarrow.compute.replace_substring(
+        pyarrow.compute.utf8_ltrim(pyarrow.array(columns[PRICE_COLUMN], pyarrow.string()), characters='$'), ',', ''
+    )
+    prices = pyarrow.compute.if_else(pyarrow.compute.equal(prices, ''), None, prices)
+    return table.append_column('precio', prices.cast(pyarrow.decimal128(12, 2))).append_column(
+        'ocurrencia', pyarrow.array([int(key[-1]) for key in meds_keys(rows)], pyarrow.int64())
+    )
+
+
+def diff_tables(last_table, table) -> List[tuple]:
+    pyarrow = import_pyarrow()
+    compute = pyarrow.compute
+    joined = table.append_column('hoy', pyarrow.array([True] * table.num_rows, pyarrow.bool_())).join(
+        last_table.append_column('ayer', pyarrow.array([True] * last_table.num_rows, pyarrow.bool_())),
+        keys=list(KEY_NAMES), join_type='full outer', right_suffix='_anterior', coalesce_keys=True
+    )
+    today, yesterday = compute.is_valid(joined['hoy']), compute.is_valid(joined['ayer'])
+    last_price, price = joined['precio_anterior'], joined['precio']
+    price_changed = compute.and_(compute.and_(today, yesterday), compute.or_(
+        compute.fill_null(compute.not_equal(last_price, price), False),
+        compute.xor(compute.is_null(last_price), compute.is_null(price))
+    ))
+    kind = compute.if_else(
+        compute.invert(yesterday), APPEARED, compute.if_else(compute.invert(today), DISAPPEARED, PRICE_CHANGED)
+    )
+    changes = joined.append_column('cambio', kind).filter(
+        compute.or_(compute.invert(compute.and_(today, yesterday)), price_changed)
+    )
+    difference = compute.subtract(changes['precio'], changes['precio_anterior'])
+    variation = compute.divide(
+        difference.cast(pyarrow.float64()),
+        compute.if_else(
+            compute.equal(changes['precio_anterior'], 0), None, changes['precio_anterior'].cast(pyarrow.float64())
+        )
+    )
+    changes = changes.append_column('diferencia', difference).append_column('variacion', variation)
+    info = {name: compute.coalesce(changes[name], changes[name + '_anterior']) for name in INFO_NAMES}
+    report = pyarrow.table({name: info[name] if name in info else changes[name] for name in REPORT_HEADER})
+    report = report.sort_by([(name, 'ascending') for name in REPORT_HEADER[:5]])
+    return list(zip(*(report[name].to_pylist() for name in REPORT_HEADER)))
+
+
+def report_totals(report: Sequence[tuple]) -> Dict[str, object]:
+    kinds = [report_row[0] for report_row in report]
+    variations = [
+        report_row[-1] for report_row in report if report_row[0] == PRICE_CHANGED and report_row[-1] is not None
+    ]
+    return {
+        'altas': kinds.count(APPEARED),
+        'bajas': kinds.count(DISAPPEARED),
+        'cambios_de_precio': kinds.count(PRICE_CHANGED),
+        'aumentos': sum(variation > 0 for variation in variations),
+        'bajas_de_precio': sum(variation < 0 for variation in variations),
+        'variacion_media': sum(variations) / len(variations) if variations else None,
+    }
+
+
+def write_report(report: Sequence[tuple], out_path, day, last_day) -> str:
+    """Writes <day>.csv and <day>.json, returns the csv path."""
+    os.makedirs(out_path, exist_ok=True)
+    csv_path = os.path.join(out_path, day + '.csv')
+    with open(csv_path, 'w', newline='') as report_csv__file:
+        writer = csv.writer(report_csv__file, delimiter='|', lineterminator='\n')
+        writer.writerow(REPORT_HEADER)
+        writer.writerows(
+            tuple('' if value is None else round(value, 4) if isinstance(value, float) else value for value in row)
+            for row in report
+        )
+    with open(os.path.join(out_path, day + '.json'), 'w') as report_json__file:
+        json.dump(dict(report_totals(report), dia=day, dia_anterior=last_day), report_json__file, indent=1)
+    return csv_path
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog, description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('data_path', nargs='?', default=default_data_path())
+    parser.add_argument('--out', help='reports directory (default DATA_PATH/reports/)')
+    parser.add_argument('--all', action='store_true', help='report every pair of consecutive days')
+    args = parser.parse_args(argv)
+    csv_paths = snapshot_paths(args.data_path)
+    pairs = list(zip(csv_paths, csv_paths[1:]))
+    for last_csv_path, csv_path in pairs if args.all else pairs[-1:]:
+        last_rows, rows = list(read_meds_csv(last_csv_path)), list(read_meds_csv(csv_path))
+        start = time.perf_counter()
+        report = diff_rows(last_rows, rows)
+        seconds = time.perf_counter() - start
+        write_report(report, args.out or os.path.join(args.data_path, 'reports/'), snapshot_date(csv_path),
+                     snapshot_date(last_csv_path))
+        print(snapshot_date(csv_path), report_totals(report), f'{seconds:.3f} s', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from typing import List, Optional
+
+
+class DrugsCache:
+    """Drugs table ([IFA, Cantidad, Unidad] rows) of each generic label, kept on disk between runs.
+
+    Entries expire after `ttl_days` and, past `max_entries`, the least recently used ones are evicted.
+    """
+
+    def __init__(self, path, ttl_days=30, max_entries=100000):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl_days * 24 * 60 * 60
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.m = threading.Lock()
+        # Autocommit, so a hit (which updates last_used) never keeps the write lock that other processes
+        # (`work` workers) need; evict() runs its statements in one explicit transaction
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS drugs ('
+            'label TEXT PRIMARY KEY, drugs TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)'
+        )
+
+    def get(self, label) -> Optional[List[List[str]]]:
+        now = time.time()
+        with self.m:
+            row = self.connection.execute(
+                'SELECT drugs FROM drugs WHERE label = ? AND created >= ?', (label, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.connection.execute('UPDATE drugs SET last_used = ? WHERE label = ?', (now, label))
+        return json.loads(row[0])
+
+    def set(self, label, drugs_table: List[List[str]]):
+        now = time.time()
+        with self.m:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO drugs (label, drugs, created, last_used) VALUES (?, ?, ?, ?)',
+                (label, json.dumps(drugs_table), now, now)
+            )
+
+    def evict(self):
+        with self.m:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                self.connection.execute('DELETE FROM drugs WHERE created < ?', (time.time() - self.ttl,))
+                self.connection.execute(
+                    'DELETE FROM drugs WHERE label NOT IN (SELECT label FROM drugs ORDER BY last_used DESC LIMIT ?)',
+                    (self.max_entries,)
+                )
+                self.connection.execute('COMMIT')
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+
+    def stats(self) -> str:
+        return 'DRUGS CACHE {} HITS / {} MISSES'.format(self.hits, self.misses)
+
+    def close(self):
+        self.evict()
+        self.connection.close()
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import random
+import threading
+
+from collections import Counter
+
+import requests
+
+from scraper import RequestsDebugger
+
+
+def request_key(method, url, data=None) -> str:
+    url = url.split(';jsessionid=')[0]
+    params = sorted((name, value) for name, value in (data or {}).items() if name != 'dtid')
+    return json.dumps([method, url, params], ensure_ascii=False)
+
+
+def next_context(context, method, data=None) -> str:
+    if method == 'GET':
+        return ''
+    for name, value in (data or {}).items():
+        if name.startswith('cmd_') and value == 'onSelect':
+            return data['data_' + name[len('cmd_'):]]
+    return context
+
+
+class RecordedResponse:
+    def __init__(self, text, status_code=200, cookies=None):
+        self.text = text
+        self.status_code = status_code
+        self.cookies = cookies or {}
+
+    def __repr__(self):
+        return f'<RecordedResponse [{self.status_code}]>'
+
+
+LABS_PER_SELECTOR_PAGE = 10
+
+
+def cell(value=None, hidden=False):
+    return "['zul.wgt.Label','zk_v',{" + ('visible:false,' if hidden else '') + \
+        '$$0onSwipe:true,$$0onAfterSize:true' + (f",value:'{value}'" if value is not None else '') + '},[]],'
+
+
+class SyntheticZKSession:
+    """Answers the navigation commands like the vademecum would, for a made up catalog (of `labs` labs with `pages`
+    meds pages of `rows` rows each)."""
+
+    def __init__(self, labs, pages, rows):
+        self.labs = labs
+        self.pages = pages
+        self.rows = rows
+        self.selected_lab = None
+
+    def get(self, url, **kwargs):
+        return RecordedResponse("zk.Desktop dt:'z_synthetic'", cookies={'JSESSIONID': 'SYNTHETIC'})
+
+    def post(self, url, data=None, **kwargs):
+        command, uuid = data['cmd_0'], data['uuid_0']
+        if command == 'onOpen':
+            return RecordedResponse(self.labs_selector_page(0))
+        if command == 'onPaging' and uuid == 'zk_comp_61':
+            return RecordedResponse(self.labs_selector_page(int(json.loads(data['data_0'])[''])))
+        if command == 'onSelect':
+            self.selected_lab = int(json.loads(data['data_0'])['items'][0][len('zk_item_'):])
+            return RecordedResponse('{"rs":[]}')
+        if command == 'onAnchorPos':
+            return RecordedResponse(self.meds_page(0))
+        if command == 'onPaging' and uuid == 'zk_comp_99':
+            return RecordedResponse(self.meds_page(int(json.loads(data['data_0'])[''])))
+        if command == 'onClick' and uuid.startswith('zk_drugs_'):
+            return RecordedResponse(''.join(
+                "['zul.wnd.Window','zk_w',{}," + cell(f'IFA {data[name]}') + cell('10') + cell('MG')
+                for name in sorted(data) if name.startswith('uuid_')
+            ))
+        return RecordedResponse('{"rs":[]}')
+
+    def labs_selector_page(self, page):
+        items = []
+        for lab_num in range(page * LABS_PER_SELECTOR_PAGE, min(self.labs, (page + 1) * LABS_PER_SELECTOR_PAGE)):
+            items.append(
+                f"['zul.sel.Listitem','zk_item_{lab_num}',{{$$0onSwipe:true,$$0onAfterSize:true,_loaded:true,_index:"
+                f"{lab_num}}},[['zul.sel.Listcell','zk_c',{{label:'30{lab_num:09d}'}},[]],"
+                f"['zul.sel.Listcell','zk_c',{{label:'779{lab_num:010d}'}},[]],"
+                f"['zul.sel.Listcell','zk_c',{{label:'LAB {lab_num} S.A.'}},[]]]],"
+            )
+        selector_pages = -(-self.labs // LABS_PER_SELECTOR_PAGE)
+        return ''.join(items) + f'"pageCount",{selector_pages}],"totalSize",{self.labs}]'
+
+    def meds_page(self, page):
+        rows = []
+        for row in range(self.rows):
+            med = f'{self.selected_lab}_{page}_{row}'
+            rows.append(
+                ''.join(cell(value) for value in (
+                    f'{self.selected_lab:04d}{page:04d}{row:04d}', f'LAB {self.selected_lab} S.A.', f'MED {med}',
+                    'COMPRIMIDO', '1 BLISTER por 10', '$86.30'
+                )) + ''.join(cell(hidden=True) for _ in range(7)) + cell(f'0779{row:09d}') +
+                f"['zul.wgt.Label','zk_drugs_{med}',{{$$0onSwipe:true,$onClick:true,$$0onAfterSize:true,"
+                f"style:'cursor:pointer',value:'IFA {med} 10 MG'}},[]]]],"
+            )
+        return ''.join(rows) + f'"pageCount",{self.pages}],"totalSize",{self.pages * self.rows}]'
+
+
+class Recording:
+    """Appends every request/response pair of its sessions to a json lines file, closed by close() or on leaving
+    a with block."""
+
+    def __init__(self, path):
+        self.recording__file = open(path, 'a')
+        self.m = threading.Lock()
+
+    def save(self, context, key, response):
+        line = json.dumps({
+            'context': context,
+            'key': key,
+            'status_code': response.status_code,
+            'cookies': dict(response.cookies),
+            'text': response.text
+        }, ensure_ascii=False)
+        with self.m:
+            self.recording__file.write(line + '\n')
+            self.recording__file.flush()
+
+    def session(self, session=None) -> 'RecordingSession':
+        return RecordingSession(self, session)
+
+    def close(self):
+        with self.m:
+            self.recording__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class RecordingSession(RequestsDebugger):
+    """RequestsDebugger that saves each response in its recording instead of printing it."""
+
+    def __init__(self, recording: Recording, session=None):
+        super().__init__(session)
+        self.recording = recording
+        self.context = ''
+
+    def check_response(self, response, method=None, url=None, data=None):
+        self.recording.save(self.context, request_key(method, url, data), response)
+        self.context = next_context(self.context, method, data)
+
+
+class Replay:
+    """Serves a recording back, with optional latency and injected errors, to any number of sessions.
+
+    The answer to a request depends on the lab selected in its session (the context), if there is no answer recorded
+    for that context (e.g. labs selector pages recorded by another session) the last one of any context is used.
+    """
+
+    ERROR_TEXT = "zAu.cmd0.alert('Error',{title:'Error'})"
+
+    def __init__(self, path, latency=0., error_rate=0., seed=None):
+        self.responses = {}
+        with open(path) as recording__file:
+            for line in recording__file:
+                recorded = json.loads(line)
+                self.responses[(recorded['context'], recorded['key'])] = recorded
+                self.responses[(None, recorded['key'])] = recorded
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = Counter()  # by (method, cmd_0, uuid_0)
+        self.m = threading.Lock()
+
+    def response(self, context, key, kind) -> RecordedResponse:
+        with self.m:
+            self.requests[kind] += 1
+            error = self.random.random() < self.error_rate
+            connection_error = error and self.random.random() < .5
+        if self.latency:
+            time.sleep(self.latency)
+        if connection_error:
+            raise requests.exceptions.ConnectionError('Injected connection error')
+        if error:
+            return RecordedResponse(self.ERROR_TEXT)
+        recorded = self.responses.get((context, key)) or self.responses.get((None, key))
+        if recorded is None:
+            raise LookupError(f'Request not recorded: {key}')
+        return RecordedResponse(recorded['text'], recorded['status_code'], recorded['cookies'])
+
+    def session(self) -> 'ReplaySession':
+        return ReplaySession(self)
+
+
+class ReplaySession:
+    def __init__(self, replay: Replay):
+        self.replay = replay
+        self.context = ''
+
+    def request(self, method, url, data=None):
+        kind = (method, (data or {}).get('cmd_0'), (data or {}).get('uuid_0'))
+        response = self.replay.response(self.context, request_key(method, url, data), kind)
+        self.context = next_context(self.context, method, data)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+LabUnit = namedtuple('LabUnit', ('lab_num', 'lab_values', 'last_signature'))
+PENDING, LEASED, DONE, FAILED = 'pending', 'leased', 'done', 'failed'
+
+
+class LabsQueue:
+    """Labs of a day's crawl as work units that the coordinator and the workers (processes or hosts) share.
+
+    A worker leases the first pending unit for `lease_seconds` (renewing it while it scrapes) and returns the lab
+    rows; a unit whose lease expired is leased again, after `max_attempts` leases it is marked as failed.
+    """
+
+    def __init__(self, path, lease_seconds=300, max_attempts=5):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.m = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(
+            'CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);'
+            'CREATE TABLE IF NOT EXISTS units (lab_num INTEGER PRIMARY KEY, lab TEXT NOT NULL, last_signature TEXT,'
+            ' state TEXT NOT NULL, worker TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0);'
+            'CREATE INDEX IF NOT EXISTS units_state ON units (state, lab_num);'
+            'CREATE TABLE IF NOT EXISTS results (lab_num INTEGER PRIMARY KEY, worker TEXT NOT NULL, signature TEXT,'
+            ' meds TEXT);'
+        )
+
+    def _transaction(self, statements: Iterable[Tuple[str, Sequence]]):
+        """Runs the statements in one write transaction, locking the queue for the other processes meanwhile."""
+        with self.m:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                for statement, params in statements:
+                    self.connection.execute(statement, params)
+                self.connection.execute('COMMIT')
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+
+    def _query(self, statement, params: Sequence = ()) -> list:
+        with self.m:
+            return self.connection.execute(statement, params).fetchall()
+
+    def day(self) -> Optional[str]:
+        rows = self._query("SELECT value FROM meta WHERE name = 'day'")
+        return rows[0][0] if rows else None
+
+    def start(self, day, units: Iterable[Tuple[Sequence, Optional[str]]]):
+        """Replaces the queue content with the day's (lab values, last signature) units."""
+        self._transaction(
+            [('DELETE FROM units', ()), ('DELETE FROM results', ()), ('DELETE FROM meta', ()),
+             ("INSERT INTO meta VALUES ('day', ?)", (day,))] +
+            [(
+                'INSERT INTO units (lab_num, lab, last_signature, state) VALUES (?, ?, ?, ?)',
+                (lab_num, json.dumps(list(lab_values)), last_signature, PENDING)
+            ) for lab_num, (lab_values, last_signature) in enumerate(units)]
+        )
+
+    def labs(self) -> List[list]:
+        return [json.loads(lab) for lab, in self._query('SELECT lab FROM units ORDER BY lab_num')]
+
+    def lease(self, worker) -> Optional[LabUnit]:
+        """Leases the first pending (or expired) unit to the worker, None if there is none."""
+        with self.m:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                self.connection.execute(
+                    'UPDATE units SET state = ? WHERE state = ? AND lease_until < ? AND attempts >= ?',
+                    (FAILED, LEASED, now, self.max_attempts)
+                )
+                row = self.connection.execute(
+                    'SELECT lab_num, lab, last_signature FROM units WHERE state = ? OR state = ? AND lease_until < ?'
+                    ' ORDER BY lab_num LIMIT 1', (PENDING, LEASED, now)
+                ).fetchone()
+                if row is not None:
+                    self.connection.execute(
+                        'UPDATE units SET state = ?, worker = ?, lease_until = ?, attempts = attempts + 1'
+                        ' WHERE lab_num = ?', (LEASED, worker, now + self.lease_seconds, row[0])
+                    )
+                self.connection.execute('COMMIT')
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+        return None if row is None else LabUnit(row[0], json.loads(row[1]), row[2])
+
+    def renew(self, lab_num, worker):
+        self._transaction([(
+            'UPDATE units SET lease_until = ? WHERE lab_num = ? AND state = ? AND worker = ?',
+            (time.time() + self.lease_seconds, lab_num, LEASED, worker)
+        )])
+
+    @contextmanager
+    def keep_leased(self, lab_num, worker):
+        """Renews the lease from another thread every third of `lease_seconds` while the worker scrapes the unit, so
+        slow requests and their retries do not let it expire."""
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(self.lease_seconds / 3):
+                self.renew(lab_num, worker)
+
+        renewer = threading.Thread(target=renew, daemon=True)
+        renewer.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            renewer.join()
+
+    def release(self, lab_num, worker):
+        """Gives the unit back (the worker failed), so another worker leases it without waiting for the lease."""
+        self._transaction([(
+            'UPDATE units SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, worker = NULL, lease_until = NULL'
+            ' WHERE lab_num = ? AND state = ? AND worker = ?',
+            (self.max_attempts, FAILED, PENDING, lab_num, LEASED, worker)
+        )])
+
+    def complete(self, lab_num, worker, signature, meds: Optional[List[Sequence[str]]]):
+        """Saves the lab rows (None to reuse the last snapshot ones), the first worker to finish a unit wins."""
+        self._transaction([
+            ('INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?)', (
+                lab_num, worker, signature, None if meds is None else json.dumps(meds, ensure_ascii=False)
+            )),
+            ('UPDATE units SET state = ?, lease_until = NULL WHERE lab_num = ?', (DONE, lab_num)),
+        ])
+
+    def result(self, lab_num) -> Optional[Tuple[Optional[str], Optional[List[List[str]]]]]:
+        """(signature, rows) of a done unit."""
+        rows = self._query('SELECT signature, meds FROM results WHERE lab_num = ?', (lab_num,))
+        if not rows:
+            return None
+        signature, meds = rows[0]
+        return signature, None if meds is None else json.loads(meds)
+
+    def failed_units(self) -> List[int]:
+        return [lab_num for lab_num, in self._query('SELECT lab_num FROM units WHERE state = ?', (FAILED,))]
+
+    def counts(self) -> Dict[str, int]:
+        return dict(self._query('SELECT state, COUNT(*) FROM units GROUP BY state'))
+
+    def size(self) -> int:
+        return self._query('SELECT COUNT(*) FROM units')[0][0]
+
+    def finished(self) -> bool:
+        """The coordinator merged every unit, or there is nothing left to lease (every unit is done or failed)."""
+        if self._query("SELECT value FROM meta WHERE name = 'finished'"):
+            return True
+        counts = self.counts()
+        return bool(counts) and not counts.get(PENDING) and not counts.get(LEASED)
+
+    def finish(self):
+        """Drops the merged rows and tells the workers the day is over."""
+        self._transaction([
+            ('DELETE FROM results', ()), ("INSERT OR REPLACE INTO meta VALUES ('finished', '1')", ())
+        ])
+
+    def close(self):
+        self.connection.close()
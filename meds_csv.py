@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import csv
+import glob
+import time
+
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Sequence, Tuple, Union
+
+
+CSV_DELIMITER = '|'
+MEDS_HEADER = (
+    'N° Certificado', 'Laboratorio', 'Nombre Comercial', 'Forma Farmacéutica', 'Presentación',
+    'Precio Venta al Público',
+    ' (uso exclusivamente hospitalario - muestra médica - no venta al público)',
+    ' (muestra médica - no venta al público)', ' (uso exclusivamente hospitalario - muestra médica)',
+    ' (uso exclusivamente hospitalario - no venta al público)', ' (uso exclusivamente hospitalario)',
+    ' (muestra médica)', ' (no venta al público)', 'GTIN', 'Genérico', 'Genérico[IFA,Cantidad,Unidad]'
+)
+LAB_COLUMN = MEDS_HEADER.index('Laboratorio')
+INGREDIENTS_COLUMN = MEDS_HEADER.index('Genérico[IFA,Cantidad,Unidad]')
+# Cells repeated across many rows (lab, product and form names, flags, ingredients), kept once in memory
+INTERNED_COLUMNS = tuple(
+    MEDS_HEADER.index(name) for name in MEDS_HEADER if name not in ('N° Certificado', 'Precio Venta al Público', 'GTIN')
+)
+
+
+class MedRow(NamedTuple):
+    """Row of the meds csv, with the ingredients as (IFA, Cantidad, Unidad) triples."""
+    certificado: str
+    laboratorio: str
+    nombre_comercial: str
+    forma_farmaceutica: str
+    presentacion: str
+    precio: str
+    hospitalario_muestra_no_venta: str
+    muestra_no_venta: str
+    hospitalario_muestra: str
+    hospitalario_no_venta: str
+    hospitalario: str
+    muestra: str
+    no_venta: str
+    gtin: str
+    generico: str
+    ingredientes: Tuple[Tuple[str, str, str], ...]
+
+
+COLUMN_NAMES = MedRow._fields
+# Ingredient triples of the generic labels seen in the run, each one kept once like the interned strings
+_interned_ingredients = {}  # type: Dict[Tuple[Tuple[str, str, str], ...], Tuple[Tuple[str, str, str], ...]]
+
+
+def med_row(cells: Sequence[str], generic_label, drugs_table: Iterable[Sequence[str]]) -> MedRow:
+    """Row of the 14 cells of a meds page, the generic label and its drugs table, with the repeated cells interned."""
+    ingredients = tuple(tuple(sys.intern(value) for value in drug) for drug in drugs_table)
+    return MedRow(
+        *(sys.intern(cell) if column in INTERNED_COLUMNS else cell for column, cell in enumerate(cells)),
+        sys.intern(generic_label), _interned_ingredients.setdefault(ingredients, ingredients)
+    )
+
+
+def compact_row(row: Sequence[str]) -> Tuple[str, ...]:
+    """Csv row as a tuple with the repeated cells interned (the ingredients stay as the csv text)."""
+    return tuple(sys.intern(cell) if column in INTERNED_COLUMNS else cell for column, cell in enumerate(row))
+
+
+def csv_row(row: Sequence[Union[str, Sequence[Sequence[str]]]]) -> Sequence[str]:
+    """Cells of a row to write, with ingredient triples as the csv keeps them: "[['IBUPROFENO', '400', 'MG']]"."""
+    if len(row) <= INGREDIENTS_COLUMN or isinstance(row[INGREDIENTS_COLUMN], str):
+        return row
+    return tuple(row[:INGREDIENTS_COLUMN]) + (str([list(drug) for drug in row[INGREDIENTS_COLUMN]]),)
+
+
+def snapshot_paths(data_path) -> List[str]:
+    return sorted(glob.glob(os.path.join(data_path, '[0-9]' * 8 + '.csv')))
+
+
+def snapshot_date(path) -> str:
+    return os.path.basename(path)[:-len('.csv')]
+
+
+def read_meds_csv(path) -> Iterator[List[str]]:
+    """Rows of a daily snapshot, written by the scraper ('|' separated) or by the old exports (',' separated).
+
+    The scraper used to write the cells as they are, so those files are read without quoting (a presentation can start
+    with an inch mark); MedsCSVWriter quotes the cells that need it and marks its files with a fully quoted header.
+    """
+    with open(path, newline='') as csv_meds__file:
+        header = csv_meds__file.readline()
+        if CSV_DELIMITER not in header:
+            reader = csv.reader(csv_meds__file)
+        elif header.startswith('"'):
+            reader = csv.reader(csv_meds__file, delimiter=CSV_DELIMITER)
+        else:
+            reader = csv.reader(csv_meds__file, delimiter=CSV_DELIMITER, quoting=csv.QUOTE_NONE)
+        for row in reader:
+            if row:
+                yield row
+
+
+class MedsCSVWriter:
+    """Keeps today's csv open for the whole run, flushing by size (the buffer) or time and fsyncing after each lab."""
+
+    def __init__(self, path, append=False, flush_bytes=1024 * 1024, flush_seconds=30):
+        self.csv_meds__file = open(path, 'a' if append else 'w', newline='', buffering=flush_bytes)
+        self.writer = csv.writer(self.csv_meds__file, delimiter=CSV_DELIMITER, lineterminator='\n')
+        self.flush_seconds = flush_seconds
+        self.last_flush = time.monotonic()
+        if not append:
+            # The quoted header tells read_meds_csv that the cells are quoted
+            header_writer = csv.writer(
+                self.csv_meds__file, delimiter=CSV_DELIMITER, lineterminator='\n', quoting=csv.QUOTE_ALL
+            )
+            header_writer.writerow(MEDS_HEADER)
+
+    def write_rows(self, rows: Iterable[Sequence[str]]) -> int:
+        written_rows = 0
+        for row in rows:
+            self.writer.writerow(csv_row(row))
+            written_rows += 1
+            if time.monotonic() - self.last_flush >= self.flush_seconds:
+                self.flush()
+        return written_rows
+
+    def flush(self):
+        self.csv_meds__file.flush()
+        self.last_flush = time.monotonic()
+
+    def end_lab(self):
+        self.flush()
+        os.fsync(self.csv_meds__file.fileno())
+
+    def tell(self) -> int:
+        return self.csv_meds__file.tell()
+
+    def close(self):
+        self.end_lab()
+        self.csv_meds__file.close()
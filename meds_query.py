@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""Indexed queries over the daily meds snapshots.
+
+    python meds_query.py gtin GTIN [--day DAY]
+    python meds_query.py certificado NUMBER [--day DAY]
+    python meds_query.py lab CUIT [--day DAY]
+    python meds_query.py ifa IFA [--day DAY]
+    python meds_query.py price GTIN
+    python meds_query.py lab-changes CUIT FIRST_DAY LAST_DAY
+
+Before each query the index (.cache/meds_index.sqlite3) adds the snapshots of the crawl data (in the data branch
+worktree or else data/, csvs or snapshot store days) that are new or changed since the last one. Without --day the last
+indexed day is used.
+"""
+import os
+import csv
+import sys
+import glob
+import json
+import sqlite3
+import hashlib
+import argparse
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from columnar_export import parse_ingredients
+from data_publisher import REPO_PATH, default_data_path
+from meds_csv import COLUMN_NAMES, INGREDIENTS_COLUMN, MEDS_HEADER, read_meds_csv, snapshot_date, snapshot_paths
+from snapshot_store import SnapshotStore, meds_delta
+
+
+COLUMNS = ', '.join(COLUMN_NAMES)
+
+
+def row_hash(row: Sequence[str]) -> str:
+    return hashlib.sha1(json.dumps(row, ensure_ascii=False).encode()).hexdigest()
+
+
+def read_labs_csv(path) -> Iterable[Tuple[str, str, str]]:
+    """(CUIT, GLN, RAZON_SOCIAL) of a labs history file, whose razón social is not quoted."""
+    with open(path, newline='') as labs_csv__file:
+        for row in list(csv.reader(labs_csv__file))[1:]:
+            if len(row) >= 5:
+                yield row[0], row[1], ','.join(row[2:-2])
+
+
+class MedsIndex:
+    """Distinct meds rows (indexed by GTIN, certificado, laboratorio and IFA) and the rows of each day.
+
+    A row repeated every day is stored once, the days only keep (day, pos, row_id).
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(
+            'CREATE TABLE IF NOT EXISTS days (day TEXT PRIMARY KEY, source TEXT NOT NULL, mtime REAL NOT NULL);'
+            f'CREATE TABLE IF NOT EXISTS meds (id INTEGER PRIMARY KEY, hash TEXT NOT NULL UNIQUE, {COLUMNS});'
+            'CREATE INDEX IF NOT EXISTS meds_gtin ON meds (gtin);'
+            'CREATE INDEX IF NOT EXISTS meds_certificado ON meds (certificado);'
+            'CREATE INDEX IF NOT EXISTS meds_laboratorio ON meds (laboratorio);'
+            'CREATE TABLE IF NOT EXISTS ingredients (med_id INTEGER NOT NULL, ifa TEXT NOT NULL);'
+            'CREATE INDEX IF NOT EXISTS ingredients_ifa ON ingredients (ifa, med_id);'
+            'CREATE TABLE IF NOT EXISTS snapshot_meds (day TEXT NOT NULL, pos INTEGER NOT NULL, med_id INTEGER NOT NULL,'
+            ' PRIMARY KEY (day, pos)) WITHOUT ROWID;'
+            'CREATE INDEX IF NOT EXISTS snapshot_meds_med ON snapshot_meds (med_id, day);'
+            'CREATE TABLE IF NOT EXISTS labs (cuit TEXT NOT NULL, razon_social TEXT NOT NULL, gln TEXT NOT NULL,'
+            ' PRIMARY KEY (cuit, razon_social));'
+        )
+        self.connection.commit()
+
+    def sources(self, data_path) -> Dict[str, str]:
+        """Snapshot source of each day: its csv, or its snapshot store file if there is no csv."""
+        sources = {snapshot_date(path): path for path in snapshot_paths(data_path)}
+        store = SnapshotStore(os.path.join(data_path, 'store/'))
+        for day in store.days():
+            if day not in sources:
+                delta_path = os.path.join(store.deltas_path, day + '.jsonl')
+                sources[day] = delta_path if os.path.exists(delta_path) else store.base_path()
+        return sources
+
+    def update(self, data_path) -> List[str]:
+        """Indexes the days new or changed since the last update, returns them."""
+        indexed = {day: (source, mtime) for day, source, mtime in self.connection.execute('SELECT * FROM days')}
+        sources = self.sources(data_path)
+        store = SnapshotStore(os.path.join(data_path, 'store/'))
+        med_ids = None
+        updated_days = []
+        for day, source in sorted(sources.items()):
+            mtime = os.path.getmtime(source)
+            if indexed.get(day) == (source, mtime):
+                continue
+            if med_ids is None:
+                med_ids = dict(self.connection.execute('SELECT hash, id FROM meds'))
+            rows = read_meds_csv(source) if source.endswith(day + '.csv') else store.rows(day)
+            self.index_day(day, rows, med_ids)
+            self.connection.execute('INSERT OR REPLACE INTO days VALUES (?, ?, ?)', (day, source, mtime))
+            self.connection.commit()
+            updated_days.append(day)
+        for labs_path in sorted(glob.glob(os.path.join(data_path, 'labs', '[0-9]' * 8 + '.csv'))):
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO labs (cuit, gln, razon_social) VALUES (?, ?, ?)', read_labs_csv(labs_path)
+            )
+        self.connection.commit()
+        return updated_days
+
+    def index_day(self, day, rows: Iterable[Sequence[str]], med_ids: Dict[str, int]):
+        self.connection.execute('DELETE FROM snapshot_meds WHERE day = ?', (day,))
+        snapshot_meds = []
+        for pos, row in enumerate(rows):
+            if len(row) != len(MEDS_HEADER):
+                continue
+            med_hash = row_hash(row)
+            med_id = med_ids.get(med_hash)
+            if med_id is None:
+                med_id = self.connection.execute(
+                    f'INSERT INTO meds (hash, {COLUMNS}) VALUES (?{", ?" * len(COLUMN_NAMES)})', [med_hash] + row
+                ).lastrowid
+                med_ids[med_hash] = med_id
+                self.connection.executemany('INSERT INTO ingredients VALUES (?, ?)', {
+                    (med_id, ifa) for ifa, _, _ in parse_ingredients(row[INGREDIENTS_COLUMN])
+                })
+            snapshot_meds.append((day, pos, med_id))
+        self.connection.executemany('INSERT INTO snapshot_meds VALUES (?, ?, ?)', snapshot_meds)
+
+    def last_day(self) -> Optional[str]:
+        return self.connection.execute('SELECT MAX(day) FROM days').fetchone()[0]
+
+    def meds(self, where, params: Sequence, day=None) -> List[Tuple[str, ...]]:
+        """Rows of the day (the last one by default) matching a condition over the meds table."""
+        return self.connection.execute(
+            f'SELECT {COLUMNS} FROM meds CROSS JOIN snapshot_meds ON snapshot_meds.med_id = meds.id '
+            f'WHERE {where} AND snapshot_meds.day = ? ORDER BY snapshot_meds.pos',
+            tuple(params) + (day or self.last_day(),)
+        ).fetchall()
+
+    def by_gtin(self, gtin, day=None) -> List[Tuple[str, ...]]:
+        return self.meds('meds.gtin = ?', (gtin,), day)
+
+    def by_certificado(self, certificado, day=None) -> List[Tuple[str, ...]]:
+        return self.meds('meds.certificado = ?', (certificado,), day)
+
+    def by_lab_cuit(self, cuit, day=None) -> List[Tuple[str, ...]]:
+        return self.meds('meds.laboratorio IN (SELECT razon_social FROM labs WHERE cuit = ?)', (cuit,), day)
+
+    def by_ifa(self, ifa, day=None) -> List[Tuple[str, ...]]:
+        return self.meds('meds.id IN (SELECT med_id FROM ingredients WHERE ifa = ?)', (ifa,), day)
+
+    def price_history(self, gtin) -> List[Tuple[str, str, str]]:
+        """(day, presentación, precio) of the GTIN in every indexed day."""
+        return self.connection.execute(
+            'SELECT snapshot_meds.day, meds.presentacion, meds.precio FROM meds '
+            'JOIN snapshot_meds ON snapshot_meds.med_id = meds.id WHERE meds.gtin = ? ORDER BY snapshot_meds.day',
+            (gtin,)
+        ).fetchall()
+
+    def lab_changes(self, cuit, first_day, last_day) -> List[list]:
+        """Snapshot store delta (removed keys, changed cells and added rows) of the lab meds between the two days."""
+        return meds_delta(
+            [list(row) for row in self.by_lab_cuit(cuit, first_day)],
+            [list(row) for row in self.by_lab_cuit(cuit, last_day)]
+        )
+
+    def close(self):
+        self.connection.close()
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog, description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--data', default=default_data_path(), help='snapshots directory (default the crawl data)')
+    parser.add_argument('--index', default=REPO_PATH + '.cache/meds_index.sqlite3',
+                        help='index database (default the repo .cache/meds_index.sqlite3)')
+    parser.add_argument('--no-update', action='store_true', help='query the index without adding new snapshots')
+    subparsers = parser.add_subparsers(dest='query', required=True)
+    for query, value_name in (('gtin', 'gtin'), ('certificado', 'number'), ('lab', 'cuit'), ('ifa', 'ifa')):
+        query_parser = subparsers.add_parser(query)
+        query_parser.add_argument('value', metavar=value_name.upper())
+        query_parser.add_argument('--day', help='YYYYMMDD (default the last indexed day)')
+    subparsers.add_parser('price').add_argument('value', metavar='GTIN')
+    lab_changes_parser = subparsers.add_parser('lab-changes')
+    lab_changes_parser.add_argument('value', metavar='CUIT')
+    lab_changes_parser.add_argument('first_day')
+    lab_changes_parser.add_argument('last_day')
+    args = parser.parse_args(argv)
+    meds_index = MedsIndex(args.index)
+    if not args.no_update:
+        for day in meds_index.update(args.data):
+            print('indexed', day, file=sys.stderr)
+    writer = csv.writer(sys.stdout, delimiter='|', lineterminator='\n')
+    if args.query == 'price':
+        writer.writerows(meds_index.price_history(args.value))
+    elif args.query == 'lab-changes':
+        for operation in meds_index.lab_changes(args.value, args.first_day, args.last_day):
+            print(json.dumps(operation, ensure_ascii=False))
+    else:
+        query = {
+            'gtin': meds_index.by_gtin, 'certificado': meds_index.by_certificado, 'lab': meds_index.by_lab_cuit,
+            'ifa': meds_index.by_ifa
+        }[args.query]
+        writer.writerows(query(args.value.upper() if args.query == 'ifa' else args.value, args.day))
+    meds_index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import threading
+
+from bisect import bisect_left
+from typing import Dict, List, Optional
+
+
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, float('inf'))
+
+
+class CallMetrics:
+    """Totals of one navigation call type (or parser): latency histogram, response size, parse time and retries."""
+
+    def __init__(self):
+        self.calls = 0
+        self.requests = 0
+        self.seconds = 0.
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS_MS)
+        self.max_seconds = 0.
+        self.response_chars = 0
+        self.parses = 0
+        self.parse_seconds = 0.
+        self.retries = 0
+        self.errors = 0
+
+    def latency_percentile_ms(self, percentile) -> Optional[float]:
+        """Upper bound of the latency bucket holding the percentile."""
+        if not self.requests:
+            return None
+        rank = percentile / 100 * self.requests
+        count = 0
+        for upper_bound, bucket_count in zip(LATENCY_BUCKETS_MS, self.latency_buckets):
+            count += bucket_count
+            if count >= rank:
+                return min(upper_bound, self.max_seconds * 1000)
+        return self.max_seconds * 1000
+
+    def as_dict(self) -> dict:
+        totals = {name: value for name, value in vars(self).items() if name != 'latency_buckets'}
+        return dict(totals, latency_buckets_ms=dict(zip(map(str, LATENCY_BUCKETS_MS), self.latency_buckets)))
+
+
+class Metrics:
+    """Request, navigation call and parse timings of a run, by call type, optionally logged to a json lines file.
+
+    The navigations of all the workers share one instance.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.metrics__file = open(path, 'a') if path else None
+        self.by_name = {}  # type: Dict[str, CallMetrics]
+        self.start = time.perf_counter()
+        self.m = threading.Lock()
+
+    def _log(self, record: dict):
+        if self.metrics__file:
+            self.metrics__file.write(json.dumps(record) + '\n')
+
+    def _call_metrics(self, name) -> CallMetrics:
+        if name not in self.by_name:
+            self.by_name[name] = CallMetrics()
+        return self.by_name[name]
+
+    def record_request(self, name, seconds, response_chars):
+        with self.m:
+            call_metrics = self._call_metrics(name)
+            call_metrics.requests += 1
+            call_metrics.seconds += seconds
+            call_metrics.latency_buckets[bisect_left(LATENCY_BUCKETS_MS, seconds * 1000)] += 1
+            call_metrics.max_seconds = max(call_metrics.max_seconds, seconds)
+            call_metrics.response_chars += response_chars
+            self._log({'kind': 'request', 'name': name, 'seconds': seconds, 'response_chars': response_chars})
+
+    def record_call(self, name, seconds, attempts, errors):
+        with self.m:
+            call_metrics = self._call_metrics(name)
+            call_metrics.calls += 1
+            call_metrics.retries += attempts - 1
+            call_metrics.errors += errors
+            self._log({'kind': 'call', 'name': name, 'seconds': seconds, 'attempts': attempts, 'errors': errors})
+
+    def record_parse(self, name, seconds, chars):
+        with self.m:
+            call_metrics = self._call_metrics(name)
+            call_metrics.parses += 1
+            call_metrics.parse_seconds += seconds
+            self._log({'kind': 'parse', 'name': name, 'seconds': seconds, 'chars': chars})
+
+    def parse(self, parser: callable, text):
+        """parser(text), timing it under the parser name."""
+        start = time.perf_counter()
+        parsed = parser(text)
+        self.record_parse(parser.__name__, time.perf_counter() - start, len(text))
+        return parsed
+
+    def summary_lines(self) -> List[str]:
+        lines = ['{:<32} {:>7} {:>8} {:>7} {:>7} {:>8} {:>8} {:>9} {:>10} {:>8} {:>9}'.format(
+            'call', 'calls', 'requests', 'retries', 'errors', 'p50 ms', 'p95 ms', 'max ms', 'total s', 'MB',
+            'parse ms'
+        )]
+        with self.m:
+            by_name = sorted(self.by_name.items(), key=lambda item: -item[1].seconds - item[1].parse_seconds)
+            for name, call_metrics in by_name:
+                p50, p95 = call_metrics.latency_percentile_ms(50), call_metrics.latency_percentile_ms(95)
+                lines.append('{:<32} {:>7} {:>8} {:>7} {:>7} {:>8} {:>8} {:>9.0f} {:>10.2f} {:>8.2f} {:>9.1f}'.format(
+                    name, call_metrics.calls, call_metrics.requests, call_metrics.retries, call_metrics.errors,
+                    '-' if p50 is None else round(p50), '-' if p95 is None else round(p95),
+                    call_metrics.max_seconds * 1000, call_metrics.seconds, call_metrics.response_chars / 1e6,
+                    call_metrics.parse_seconds * 1000
+                ))
+        return lines
+
+    def close(self, **run_stats):
+        """Logs the totals of each call type and the run stats (e.g. the navigation recovery ones)."""
+        with self.m:
+            self._log({
+                'kind': 'summary', 'seconds': time.perf_counter() - self.start,
+                'by_name': {name: call_metrics.as_dict() for name, call_metrics in self.by_name.items()},
+                **run_stats
+            })
+            if self.metrics__file:
+                self.metrics__file.close()
+                self.metrics__file = None
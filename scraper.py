@@ -1,15 +1,39 @@
 # -*- coding: utf-8 -*-
 import re
 import os
+import sys
 import glob
+import json
 import time
+import hashlib
+import queue
+import shutil
+import socket
+import threading
 
 import requests
 
-from typing import Iterable, List
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
 from datetime import datetime
 
-from utils.utils import dir_abs_path_of_file, PrintControl
+from columnar_export import export_snapshot, pyarrow_installed
+from data_publisher import DataPublisher
+from data_quality import QualityReport, QualityThresholds, validate_snapshot, write_quality_report
+from diff_report import diff_rows, report_totals, write_report
+from drugs_cache import DrugsCache
+from labs_queue import LabsQueue
+from metrics import Metrics
+from meds_csv import (
+    CSV_DELIMITER, LAB_COLUMN, MEDS_HEADER, MedsCSVWriter, compact_row, csv_row, med_row, read_meds_csv,
+    snapshot_date, snapshot_paths
+)
+from snapshot_store import SnapshotStore
+from zk_parser import (
+    LabsSelectorPage, MedsPage, parse_drugs_table, parse_dt_id, parse_labs_selector_page, parse_meds_page
+)
+from utils.utils import (
+    AdaptiveRateLimiter, backoff_delay, dir_abs_path_of_file, prefetched, PrintControl, RateLimiter
+)
 
 
 SHOW_PROGRESS = True
@@ -17,41 +41,56 @@ SHOW_NAVIGATION = False
 SHOW_REQUESTS = False
 SHOW_PARSED_DATA = False
 
+WORKERS = 1
+MAX_REQUESTS_PER_SECOND = None
+ADAPTIVE_RATE = False
+INITIAL_REQUESTS_PER_SECOND = 2
+DRUGS_POPUPS_PER_REQUEST = 10
+INCREMENTAL = True
+DRUGS_CACHE = True
+DRUGS_CACHE_TTL_DAYS = 30
+NAVIGATION_MAX_RETRIES = 8
+NAVIGATION_BACKOFF_SECONDS = 1.  # delay before the first retry, doubled in each one
+CSV_FLUSH_BYTES = 1024 * 1024
+CSV_FLUSH_SECONDS = 30
+SNAPSHOT_STORE = True
+COLUMNAR_EXPORT = True
+DIFF_REPORT = True
+QUALITY_GATE = True
+METRICS = True
+PREFETCH_MEDS_PAGES = 2
+LABS_QUEUE_LEASE_SECONDS = 300
+LABS_QUEUE_POLL_SECONDS = 1
+
 
 def add_time(string):
     return f'{datetime.now().strftime("%H:%M:%S")} {string}'
 
 
-def checkout_master_at_end(do: callable):
-    def decorator(*args, **kwargs):
-        try:
-            do(*args, **kwargs)
-        finally:
-            os.system(f'git checkout master')
-    return decorator
-
-
 class RequestsDebugger:
-    def __init__(self):
-        self.session = requests.Session()
+    """Session that passes each response, with its request, to check_response (which prints it)."""
 
-    @staticmethod
-    def check_response(response):
+    def __init__(self, session=None):
+        self.session = session or requests.Session()
+
+    def check_response(self, response, method=None, url=None, data=None):
         print(response)
         print(response.text)
 
-    def get(self, *args, **kwargs):
-        response = self.session.get(*args, **kwargs)
-        self.check_response(response)
+    def get(self, url, **kwargs):
+        response = self.session.get(url, **kwargs)
+        self.check_response(response, 'GET', url)
         return response
 
-    def post(self, *args, **kwargs):
-        response = self.session.post(*args, **kwargs)
-        self.check_response(response)
+    def post(self, url, data=None, **kwargs):
+        response = self.session.post(url, data=data, **kwargs)
+        self.check_response(response, 'POST', url, data)
         return response
 
 
 class ANMATLab:
+    __slots__ = ('cuit', 'gln', 'razon_social', 'page', 'page_pos')
+
     @classmethod
     def header(cls) -> tuple:
         return 'CUIT', 'GLN', 'RAZON_SOCIAL', 'PAGE', 'PAGE_POS'
@@ -65,69 +104,131 @@ class ANMATLab:
         csv__str = cls.csv_header() + '\n' if header else ''
         return csv__str + '\n'.join(lab.csv_values() for lab in anmat_labs)
 
+    @classmethod
+    def from_values(cls, values: Iterable[str]) -> 'ANMATLab':
+        """Lab of its values_sorted_by_header()."""
+        cuit, gln, razon_social, page, page_pos = values
+        return cls(cuit=cuit, gln=gln, razon_social=razon_social, page=int(page), page_list_pos=int(page_pos))
+
     def __init__(self, cuit, gln, razon_social, page, page_list_pos):
         self.cuit = cuit
         self.gln = gln
-        self.razon_social = razon_social
+        self.razon_social = sys.intern(razon_social)
         self.page = page
         self.page_pos = page_list_pos
 
     def values_sorted_by_header(self) -> tuple:
-        return tuple(str(getattr(self, value_name.lower())) for value_name in self.header())
+        return self.cuit, self.gln, self.razon_social, str(self.page), str(self.page_pos)
 
     def csv_values(self) -> str:
         return ','.join(self.values_sorted_by_header())
 
 
+class ZKRequest(NamedTuple):
+    method: str
+    url: str
+    data: Optional[dict] = None
+
+
 class ANMATVademecumNavigation:
 
     MAIN_URL = 'https://servicios.pami.org.ar/vademecum'
     URL = f'{MAIN_URL}/views/consultaPublica/listado.zul'
     URL_SKU = f'{MAIN_URL}/zkau'
+    MED_DRUGS_POPUP_RE = re.compile(r"\['zul\.wnd\.Window',")
+    # Navigation calls that build the ZK desktop state, in the order they have to be replayed
+    STATE_METHODS = (
+        'page__open_and_load_session_ids', 'labs_selector__open_page', 'labs_selector__close',
+        'select_lab_on_selector', 'search', 'select_meds_list_page'
+    )
+    # Errors retried by the navigation calls: a connection error retries the request, any other one (like a ZK error
+    # response) also recovers the ZK desktop state in a new session first
+    CONNECTION_ERRORS = (requests.exceptions.ConnectionError,)
+    RETRIED_ERRORS = (requests.exceptions.RequestException,)
 
     class Control:
         @classmethod
         def navigation(cls, capture_navigation=True):
             def request_exception_error_handler(method: callable):
                 def handler(self: 'ANMATVademecumNavigation', *args, **kwargs):
-                    def recursive_call():
-                        nonlocal capture_navigation, method, self, args, kwargs
-                        real_capture_navigation = capture_navigation
-                        capture_navigation = False
-                        return cls.navigation(real_capture_navigation)(method)(self, *args, **kwargs)
-                    try:
-                        response = method(self, *args, **kwargs)
-                        if response and "title:'Error'" in response.text:
-                            raise requests.exceptions.RequestException
-                        return response
-                    except requests.exceptions.ConnectionError as e:
-                        time.sleep(10)
-                        self.print.show(f'[NAVIGATION] --- {e.response} ---', color=PrintControl.RED)
-                        self.print.show('[NAVIGATION] --- waiting 10 seconds... ---', color=PrintControl.RED)
-                        return recursive_call()
-                    except requests.exceptions.RequestException:
-                        self.reset_connection_and_recover_last_state()
-                        return recursive_call()
-                    finally:
-                        if capture_navigation:
-                            self.capture_navigation(method, args, kwargs)
+                    needs_recovery = False
+                    start = time.perf_counter()
+                    errors = 0
+                    for attempt in range(self.max_retries + 1):
+                        try:
+                            if needs_recovery:
+                                self.reset_connection_and_recover_last_state()
+                            self.current_call = method.__name__
+                            response = method(self, *args, **kwargs)
+                            self.check_response(response)
+                            break
+                        except self.RETRIED_ERRORS as e:
+                            errors += 1
+                            needs_recovery = self.on_request_error(e) or needs_recovery
+                            if attempt == self.max_retries:
+                                raise
+                        time.sleep(self.retry_delay(attempt))
+                    self.metrics.record_call(method.__name__, time.perf_counter() - start, attempt + 1, errors)
+                    if capture_navigation:
+                        self.capture_navigation(method, args, kwargs)
+                    return response
                 return handler
             return request_exception_error_handler
 
-    def __init__(self):
+    def __init__(
+            self, rate_limiter: RateLimiter = None, max_retries=NAVIGATION_MAX_RETRIES, session_factory=None,
+            metrics: Metrics = None
+    ):
         self.session = None
+        self.session_factory = session_factory
         self.new_session()
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.metrics = metrics or Metrics()
+        self.current_call = None
+        self.recovery_stats = {
+            'errors': 0, 'connection_errors': 0, 'recoveries': 0, 'replayed_calls': 0,
+            'backoff_seconds': 0., 'recovery_seconds': 0.
+        }
         self.dt_id = None
         self.session_id = None
         self.lab_item_name_in_selector = None
+        self.labs_selector_page = None  # type: LabsSelectorPage
+        self.labs_selector_page_num = None
         self.capture_navigation_off = False
         self.print = PrintControl(flush=True, on=SHOW_NAVIGATION, color=PrintControl.GREEN, formatter_function=add_time)
         self.history_methods = []
         self.history_params = []
 
     def new_session(self):
+        self.labs_selector_page_num = None
+        if self.session_factory:
+            self.session = self.session_factory()
+            return
         self.session = requests.Session() if not SHOW_REQUESTS else RequestsDebugger()
 
+    def get(self, *args, **kwargs):
+        if self.rate_limiter:
+            self.rate_limiter.wait()
+        start = time.perf_counter()
+        response = self.session.get(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        self.metrics.record_request(self.current_call, seconds, len(response.text))
+        if self.rate_limiter:
+            self.rate_limiter.on_response(seconds)
+        return response
+
+    def post(self, *args, **kwargs):
+        if self.rate_limiter:
+            self.rate_limiter.wait()
+        start = time.perf_counter()
+        response = self.session.post(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        self.metrics.record_request(self.current_call, seconds, len(response.text))
+        if self.rate_limiter:
+            self.rate_limiter.on_response(seconds)
+        return response
+
     def capture_navigation(self, method, args, kwargs):
         if self.capture_navigation_off:
             return
@@ -138,169 +239,328 @@ class ANMATVademecumNavigation:
         self.history_methods.append(method)
         self.history_params.append((args, kwargs))
 
-    def reset_connection_and_recover_last_state(self):
+    @staticmethod
+    def check_response(response):
+        if response and "title:'Error'" in response.text:
+            raise requests.exceptions.RequestException('ZK error response')
+
+    def on_request_error(self, e: Exception) -> bool:
+        """Counts a failed request, True if the ZK desktop state has to be recovered before retrying it."""
+        if self.rate_limiter:
+            self.rate_limiter.on_error()
+        if isinstance(e, self.CONNECTION_ERRORS):
+            self.recovery_stats['connection_errors'] += 1
+            self.print.show(f'[NAVIGATION] --- {e} ---', color=PrintControl.RED)
+            return False
+        self.recovery_stats['errors'] += 1
+        return True
+
+    def retry_delay(self, attempt) -> float:
+        delay = backoff_delay(attempt, NAVIGATION_BACKOFF_SECONDS)
+        self.print.show('[NAVIGATION] --- waiting {:.1f} seconds... ---'.format(delay), color=PrintControl.RED)
+        self.recovery_stats['backoff_seconds'] += delay
+        return delay
+
+    def recovery_plan(self) -> list:
+        """Last call of each state method in the history: the shortest way back to the current state."""
+        last_calls = {}
+        for method, params in zip(self.history_methods, self.history_params):
+            last_calls[method.__name__] = (method, params)
+        if 'select_lab_on_selector' in last_calls:
+            last_calls.pop('labs_selector__close', None)
+        return [last_calls[method_name] for method_name in self.STATE_METHODS if method_name in last_calls]
+
+    def start_recovery(self) -> float:
         self.print.show('[NAVIGATION] --- CONNECTION RESET BY PEER OR RECEIVED ERROR ---', color=PrintControl.RED)
         self.print.show('[NAVIGATION] --- RE CONNECTING AND STATE RECOVERING ---', color=PrintControl.RED)
+        self.recovery_stats['recoveries'] += 1
+        self.current_call = 'recovery'
         self.capture_navigation_off = True
-        self.new_session()
-        for method, params in zip(self.history_methods, self.history_params):
-            args, kwargs = params
-            method(self, *args, **kwargs)
+        return time.monotonic()
+
+    def end_recovery(self, start):
         self.capture_navigation_off = False
+        self.recovery_stats['recovery_seconds'] += time.monotonic() - start
+
+    def reset_connection_and_recover_last_state(self):
+        start = self.start_recovery()
+        try:
+            # The recovery has its own retries, so its errors do not use up the attempts of the interrupted call
+            for attempt in range(self.max_retries + 1):
+                try:
+                    self.new_session()
+                    for method, params in self.recovery_plan():
+                        self.replay_call(method, *params)
+                    return
+                except self.RETRIED_ERRORS as e:
+                    self.on_request_error(e)
+                    if attempt == self.max_retries:
+                        raise
+                time.sleep(self.retry_delay(attempt))
+        finally:
+            self.end_recovery(start)
+
+    def replay_call(self, method, args, kwargs):
+        """Replays a state method of the recovery plan, retrying it on connection errors (a ZK error response needs
+        a new session, so it is raised)."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.recovery_stats['replayed_calls'] += 1
+                self.check_response(method(self, *args, **kwargs))
+                return
+            except self.CONNECTION_ERRORS as e:
+                self.on_request_error(e)
+                if attempt == self.max_retries:
+                    raise
+            time.sleep(self.retry_delay(attempt))
+
+    # zkau requests of the navigation calls, also sent by the async navigation
+    def main_page_request(self) -> ZKRequest:
+        return ZKRequest('GET', self.URL)
+
+    def labs_selector_open_request(self) -> ZKRequest:
+        return ZKRequest('POST', f'{self.URL_SKU};jsessionid={self.session_id}', {
+            'dtid': self.dt_id,
+            'cmd_0': 'onOpen',
+            'uuid_0': 'zk_comp_40',
+            'data_0': '{"open":true,"value":""}'
+        })
+
+    def labs_selector_page_request(self, page) -> ZKRequest:
+        return ZKRequest('POST', self.URL_SKU, {
+            'dtid': self.dt_id,
+            'cmd_0': 'onPaging',
+            'uuid_0': 'zk_comp_61',
+            'data_0': '{"":1}'.replace('1', str(page))
+        })
+
+    def labs_selector_close_request(self) -> ZKRequest:
+        return ZKRequest('POST', self.URL_SKU, {
+            'dtid': self.dt_id,
+            'cmd_0': 'onClick',
+            'uuid_0': 'zk_comp_55',
+            'data_0': '{"pageX":506,"pageY":26,"which":1,"x":5,"y":9}'
+        })
+
+    def select_lab_request(self, lab_pos_in_sel) -> ZKRequest:
+        data_0 = '{"items":["{}"],"reference":"{}","clearFirst":false,' \
+                 '"selectAll":false,"pageX":480,"pageY":147,"which":1,"x":242,"y":48}'
+        return ZKRequest('POST', self.URL_SKU, {
+            'dtid': self.dt_id,
+            'cmd_0': 'onSelect',
+            'uuid_0': 'zk_comp_56',
+            'data_0': data_0.replace('{}', self.lab_item_name_in_selector[lab_pos_in_sel])
+        })
+
+    def search_request(self) -> ZKRequest:
+        return ZKRequest('POST', self.URL_SKU, {
+            'dtid': self.dt_id,
+            'cmd_0': 'onAnchorPos',
+            'uuid_0': 'zk_comp_56',
+            'data_0': '{"top":-1,"left":-1}',
+            'cmd_1': 'onClick',
+            'uuid_1': 'zk_comp_80',
+            'data_1': '{"pageX":271,"pageY":289,"which":1,"x":40,"y":23}'
+        })
+
+    def meds_list_page_request(self, page) -> ZKRequest:
+        return ZKRequest('POST', f'{self.URL_SKU};jsessionid={self.session_id}', {
+            'dtid': self.dt_id,
+            'cmd_0': 'onPaging',
+            'uuid_0': 'zk_comp_99',
+            'data_0': '{"":1}'.replace('1', str(page))
+        })
+
+    def meds_drugs_request(self, item_names) -> ZKRequest:
+        """Clicks on the drugs label of each item, in one request."""
+        data = {'dtid': self.dt_id}
+        for cmd_num, item_name in enumerate(item_names):
+            data[f'cmd_{cmd_num}'] = 'onClick'
+            data[f'uuid_{cmd_num}'] = item_name
+            data[f'data_{cmd_num}'] = '{"pageX":1078,"pageY":391,"which":1,"x":53,"y":32}'
+        return ZKRequest('POST', self.URL_SKU, data)
+
+    def send(self, request: ZKRequest):
+        if request.method == 'GET':
+            return self.get(request.url)
+        return self.post(request.url, data=request.data)
+
+    def load_session_ids(self, main_response):
+        self.dt_id = self.metrics.parse(parse_dt_id, main_response.text)
+        self.session_id = main_response.cookies.get('JSESSIONID')
+
+    def load_labs_pos_and_item_names_in_selector(self, labs_selector_response, page=None):
+        self.labs_selector_page = self.metrics.parse(parse_labs_selector_page, labs_selector_response.text)
+        self.lab_item_name_in_selector = self.labs_selector_page.item_names
+        # The selected page stays loaded in the session, also after closing the selector or selecting a lab
+        self.labs_selector_page_num = page or 0
 
     @Control.navigation()
     def page__open_and_load_session_ids(self):
         self.print.show('[NAVIGATION] --- LOAD MAIN ---')
-        main_response = self.session.get(self.URL)
-        self.dt_id = re.findall(r'dt:\'([a-z0-9_]+)\'', main_response.text)[0]
-        self.session_id = main_response.cookies.get('JSESSIONID')
-
-    def load_labs_pos_and_item_names_in_selector(self, labs_selector_response):
-        self.lab_item_name_in_selector = re.findall(
-            r"\['zul.sel.Listitem','([^\']+)',{\$\$0onSwipe:true,\$\$0onAfterSize:true,_loaded:true,_index:",
-            labs_selector_response.text
-        )
+        self.load_session_ids(self.send(self.main_page_request()))
 
     @Control.navigation()
     def labs_selector__open_page(self, page=None):
-        def labs_selector__open():
-            self.print.show('[NAVIGATION] --- OPEN LABS SELECTOR ---')
-            return self.session.post(
-                f'{self.URL_SKU};jsessionid={self.session_id}',
-                data={
-                  'dtid': self.dt_id,
-                  'cmd_0': 'onOpen',
-                  'uuid_0': 'zk_comp_40',
-                  'data_0': '{"open":true,"value":""}'
-                }
-            )
-        response = labs_selector__open()
+        self.print.show('[NAVIGATION] --- OPEN LABS SELECTOR ---')
+        response = self.send(self.labs_selector_open_request())
         if page:
             self.print.show('[NAVIGATION] --- LABS SELECTOR, SELECT PAGE: {} ---'.format(page))
-            response = self.session.post(
-                self.URL_SKU,
-                data={
-                    'dtid': self.dt_id,
-                    'cmd_0': 'onPaging',
-                    'uuid_0': 'zk_comp_61',
-                    'data_0': '{"":1}'.replace('1', str(page))
-                }
-            )
-        self.load_labs_pos_and_item_names_in_selector(response)
+            response = self.send(self.labs_selector_page_request(page))
+        self.load_labs_pos_and_item_names_in_selector(response, page)
         return response
 
     @Control.navigation()
     def labs_selector__close(self):
         self.print.show('[NAVIGATION] --- CLOSE LABS SELECTOR ---')
-        self.session.post(
-            'https://servicios.pami.org.ar/vademecum/zkau',
-            data={
-                'dtid': self.dt_id,
-                'cmd_0': 'onClick',
-                'uuid_0': 'zk_comp_55',
-                'data_0': '{"pageX":506,"pageY":26,"which":1,"x":5,"y":9}'
-            }
-        )
+        self.send(self.labs_selector_close_request())
 
     @Control.navigation()
     def select_lab_on_selector(self, lab_pos_in_sel):
         self.print.show('[NAVIGATION] --- SELECT LAB {} ON SELECTOR ---'.format(lab_pos_in_sel))
-        data_0 = '{"items":["{}"],"reference":"{}","clearFirst":false,' \
-                 '"selectAll":false,"pageX":480,"pageY":147,"which":1,"x":242,"y":48}'
-        self.session.post(
-            'https://servicios.pami.org.ar/vademecum/zkau',
-            data={
-                'dtid': self.dt_id,
-                'cmd_0': 'onSelect',
-                'uuid_0': 'zk_comp_56',
-                'data_0': data_0.replace('{}', self.lab_item_name_in_selector[lab_pos_in_sel])
-            }
-        )
+        self.send(self.select_lab_request(lab_pos_in_sel))
 
     @Control.navigation()
     def search(self):
         self.print.show('[NAVIGATION] --- PRESS SEARCH BUTTON ---')
-        data = {
-            'dtid': self.dt_id,
-            'cmd_0': 'onAnchorPos',
-            'uuid_0': 'zk_comp_56',
-            'data_0': '{"top":-1,"left":-1}',
-            'cmd_1': 'onClick',
-            'uuid_1': 'zk_comp_80',
-            'data_1': '{"pageX":271,"pageY":289,"which":1,"x":40,"y":23}'
-        }
-        return self.session.post('https://servicios.pami.org.ar/vademecum/zkau', data=data)
+        return self.send(self.search_request())
 
     @Control.navigation()
     def select_meds_list_page(self, page):
-        data = {
-            'dtid': self.dt_id,
-            'cmd_0': 'onPaging',
-            'uuid_0': 'zk_comp_99',
-            'data_0': '{"":1}'.replace('1', str(page))
-        }
-        return self.session.post(
-            'https://servicios.pami.org.ar/vademecum/zkau;jsessionid={}'.format(self.session_id),
-            data=data
-        )
+        return self.send(self.meds_list_page_request(page))
 
     @Control.navigation(capture_navigation=False)
     def open_med_drugs(self, item_name):
-        data = {
-            'dtid': self.dt_id,
-            'cmd_0': 'onClick',
-            'uuid_0': item_name,
-            'data_0': '{"pageX":1078,"pageY":391,"which":1,"x":53,"y":32}'
-        }
-        return self.session.post(
-            'https://servicios.pami.org.ar/vademecum/zkau',
-            data=data
-        )
+        return self.send(self.meds_drugs_request([item_name]))
+
+    @Control.navigation(capture_navigation=False)
+    def open_meds_drugs_in_one_request(self, item_names):
+        return self.send(self.meds_drugs_request(item_names))
+
+    def open_meds_drugs(self, item_names, popups_per_request=DRUGS_POPUPS_PER_REQUEST) -> List[str]:
+        """Response text of the drugs popup of each item, packing several clicks in each zkau request."""
+        popups = []
+        for ini_pos in range(0, len(item_names), popups_per_request):
+            batch = item_names[ini_pos:ini_pos + popups_per_request]
+            if len(batch) > 1:
+                response = self.open_meds_drugs_in_one_request(batch)
+                batch_popups = self.MED_DRUGS_POPUP_RE.split(response.text)[1:]
+                if len(batch_popups) == len(batch):
+                    popups.extend(batch_popups)
+                    continue
+            # Unknown response layout, one request per popup is always safe
+            popups.extend(self.open_med_drugs(item_name).text for item_name in batch)
+        return popups
 
 
 class ANMATScraper:
 
     URL = 'https://servicios.pami.org.ar/vademecum/views/consultaPublica/listado.zul'
-    DATA_BRANCH = 'data'
+    CSV_DELIMITER = CSV_DELIMITER
+    MEDS_HEADER = MEDS_HEADER
 
-    def __init__(self):
-        self.nav = ANMATVademecumNavigation()
+    def __init__(
+            self, workers=WORKERS, max_requests_per_second=MAX_REQUESTS_PER_SECOND, adaptive_rate=ADAPTIVE_RATE,
+            incremental=INCREMENTAL,
+            drugs_cache=DRUGS_CACHE, snapshot_store=SNAPSHOT_STORE, columnar_export=COLUMNAR_EXPORT,
+            diff_report=DIFF_REPORT, quality_gate=QUALITY_GATE, quality_thresholds=QualityThresholds(),
+            prefetch_pages=PREFETCH_MEDS_PAGES, data_path=None, cache_path=None, session_factory=None, metrics_path=None
+    ):
+        self.workers = workers
+        self.prefetch_pages = prefetch_pages
+        self.incremental = incremental
+        if adaptive_rate:
+            self.rate_limiter = AdaptiveRateLimiter(
+                initial_per_second=min(INITIAL_REQUESTS_PER_SECOND, max_requests_per_second or float('inf')),
+                max_per_second=max_requests_per_second
+            )
+        else:
+            self.rate_limiter = RateLimiter(max_requests_per_second)
+        self.session_factory = session_factory
         self.repo_path = dir_abs_path_of_file(__file__)
-        self.data_path = self.repo_path + 'data/'
+        self.data_path = data_path or self.repo_path + 'data/'
         self.labs_path = self.data_path + 'labs/'
+        self.cache_path = cache_path or self.repo_path + '.cache/'
+        self.now = datetime.now()
         os.makedirs(self.labs_path, exist_ok=True)
+        if METRICS and not metrics_path:
+            os.makedirs(self.cache_path + 'metrics/', exist_ok=True)
+            metrics_path = self.cache_path + 'metrics/' + self.now.strftime('%Y%m%d_%H%M%S') + '.jsonl'
+        self.metrics = Metrics(metrics_path)
+        self.nav = self.new_navigation()
+        self.navs = [self.nav]
+        self.drugs_cache = \
+            DrugsCache(self.cache_path + 'drugs.sqlite3', ttl_days=DRUGS_CACHE_TTL_DAYS) if drugs_cache else None
         self.labs_amount = None
         self.labs = []  # type: List[ANMATLab]
-        self.now = datetime.now()
+        self.labs_selector_pages = {}  # type: Dict[int, LabsSelectorPage]
+        self.csv_meds_path = self.data_path + self.now.strftime('%Y%m%d') + '.csv'
+        self.csv_meds_writer = None  # type: MedsCSVWriter
+        self.snapshot_store = SnapshotStore(self.data_path + 'store/') if snapshot_store else None
+        self.columnar_export = columnar_export
+        self.parquet_path = self.data_path + 'parquet/'
+        self.diff_report = diff_report
+        self.reports_path = self.data_path + 'reports/'
+        self.quality_gate = quality_gate
+        self.quality_thresholds = quality_thresholds
+        self.quality_path = self.reports_path + 'quality/'
+        self.quality_report = None  # type: QualityReport
+        self.blocked_path = self.cache_path + 'blocked/'
+        self.labs_signatures_path = self.labs_path + 'signatures.json'
+        self.checkpoint_path = self.cache_path + 'checkpoint.json'
+        self.labs_signatures = {}
+        self.last_labs_signatures = {}
+        self.last_meds_by_lab = {}
+        self.reused_labs = 0
+        self.crawled_labs = 0
+        self.stats_lock = threading.Lock()
         self.progress = PrintControl(flush=True, on=SHOW_PROGRESS, formatter_function=add_time)
         self.parsed_data = \
             PrintControl(flush=True, on=SHOW_PARSED_DATA, color=PrintControl.BLUE, formatter_function=add_time)
 
+    def new_navigation(self) -> ANMATVademecumNavigation:
+        return ANMATVademecumNavigation(
+            rate_limiter=self.rate_limiter, session_factory=self.session_factory, metrics=self.metrics
+        )
+
     def get_how_many_pages_are_in_labs_selector(self):
-        labs_selector_response = self.nav.labs_selector__open_page()
-        num_pages_labs_sel = int(re.findall(r'"pageCount",([0-9]+)]', labs_selector_response.text)[0])
-        self.labs_amount = int(re.findall(r'"totalSize",([0-9]+)]', labs_selector_response.text)[0])
-        self.nav.labs_selector__close()
-        return num_pages_labs_sel
+        labs_selector_page = self.load_labs_selector_page(0)
+        self.labs_amount = labs_selector_page.total_size
+        return labs_selector_page.page_count
+
+    def load_labs_selector_page(self, page) -> LabsSelectorPage:
+        """Labs selector page, fetched and parsed only the first time in the run."""
+        if page not in self.labs_selector_pages:
+            self.nav.labs_selector__open_page(page)
+            self.labs_selector_pages[page] = self.nav.labs_selector_page
+            self.nav.labs_selector__close()
+        return self.labs_selector_pages[page]
 
     def get_how_many_labs_are_in_labs_sel_page(self, page):
-        self.nav.labs_selector__open_page(page)
-        num_labs_current_page = len(self.nav.lab_item_name_in_selector)
-        self.nav.labs_selector__close()
-        return num_labs_current_page
+        return len(self.load_labs_selector_page(page).item_names)
 
     def get_next_lab(self, page):
-        response = self.nav.labs_selector__open_page(page)
         item_page_list_pos = 0
         if self.labs and self.labs[-1].page == page:
             item_page_list_pos = self.labs[-1].page_pos + 1
-        number_of_values_for_a_lab = 3
-        relative_ini_pos = item_page_list_pos * number_of_values_for_a_lab
-        relative_end_pos = relative_ini_pos + number_of_values_for_a_lab
-        cuit, gln, razon_social = re.findall(r'label:\'([^\']+)\'', response.text)[relative_ini_pos:relative_end_pos]
-        self.labs.append(
-            ANMATLab(cuit=cuit, gln=gln, razon_social=razon_social, page=page, page_list_pos=item_page_list_pos)
-        )
+        self.labs.append(self.get_labs_in_labs_sel_page(page)[item_page_list_pos])
+
+    def get_labs_in_labs_sel_page(self, page) -> List[ANMATLab]:
+        labs_selector_page = self.load_labs_selector_page(page)
+        labs = []
+        for item_page_list_pos in range(len(labs_selector_page.item_names)):
+            cuit, gln, razon_social = labs_selector_page.lab_values(item_page_list_pos)
+            labs.append(
+                ANMATLab(cuit=cuit, gln=gln, razon_social=razon_social, page=page, page_list_pos=item_page_list_pos)
+            )
+        return labs
+
+    @staticmethod
+    def select_lab(nav: ANMATVademecumNavigation, lab: 'ANMATLab'):
+        """Selects the lab, opening its labs selector page only if it is not the one loaded in the session."""
+        if nav.labs_selector_page_num != lab.page:
+            nav.labs_selector__open_page(lab.page)
+        nav.select_lab_on_selector(lab.page_pos)
 
     def update_labs_history_file(self):
         csv_path_names = glob.glob(self.labs_path + "*.csv")
@@ -316,105 +576,470 @@ class ANMATScraper:
         with open(self.labs_path + self.now.strftime('%Y%m%d') + '.csv', 'w') as labs_csv__file:
             labs_csv__file.write(labs_csv__str)
 
-    def load_meds_of_the_selected_lab(self):
-        def parse_meds_data():
-            nonlocal meds_data
-            nonlocal lab_meds_re
-            meds_cells = re.findall(
-                r"',{(visible:false,)?\$\$0onSwipe:true,\$\$0onAfterSize:true(?:(?:,value:')([^\']+)')?}",
-                lab_meds_re.text
-            )
-            new_meds_data = [meds_cells[pos:pos + 14] for pos in range(0, len(meds_cells), 14)]
-            meds_drugs_cell = re.findall(
-                r"\['zul.wgt.Label','([^']+)',{\$\$0onSwipe:true,\$onClick:true,\$\$0onAfterSize:true,"
-                r"style:'cursor:pointer',value:'([^']+)'},\[]]]],",
-                lab_meds_re.text
-            )
-            for pos in range(len(new_meds_data)):
-                if pos >= len(meds_drugs_cell):
-                    new_meds_data[pos].append(('', ''))
-                    new_meds_data[pos].append(('', '[]'))
-                    continue
-                new_meds_data[pos].append(('', meds_drugs_cell[pos][1]))
-                drugs_response = self.nav.open_med_drugs(meds_drugs_cell[pos][0])
-                drugs_cells = re.findall(
-                    r"',{\$\$0onSwipe:true,\$\$0onAfterSize:true,value:'([^']+)",
-                    drugs_response.text
-                )
-                drugs_table = [drugs_cells[pos:pos+3] for pos in range(0, len(drugs_cells), 3)]
-                new_meds_data[pos].append(('', str(drugs_table)))
-            for med_data in new_meds_data:
-                meds_data.append(
-                    tuple(
-                        tuple_data[1] if tuple_data[0] == ''
-                        else str(1 if tuple_data[0] == 'visible:true,'
-                                 else 0)
-                        for tuple_data in med_data
+    def update_meds_history_store(self):
+        if not self.snapshot_store:
+            return
+        if self.snapshot_store.add_csv(self.csv_meds_path):
+            self.progress.show('::: MEDS CHANGES SAVED IN THE SNAPSHOT STORE :::')
+        else:
+            self.progress.show('::: NO MEDS CHANGES SINCE THE LAST SNAPSHOT :::')
+
+    def export_meds_to_parquet(self):
+        if not self.columnar_export:
+            return
+        if not pyarrow_installed():
+            self.progress.show('::: PARQUET EXPORT SKIPPED: pyarrow IS NOT INSTALLED :::')
+            return
+        self.progress.show('::: MEDS EXPORTED TO {} :::'.format(export_snapshot(self.csv_meds_path, self.parquet_path)))
+
+    def last_snapshot(self) -> tuple:
+        """Day and rows of the last snapshot before today (from the snapshot store or the daily csvs)."""
+        today = self.now.strftime('%Y%m%d')
+        store_days = [day for day in self.snapshot_store.days() if day < today] if self.snapshot_store else []
+        last_csv_path_names = [path for path in snapshot_paths(self.data_path) if path < self.csv_meds_path]
+        if store_days and (not last_csv_path_names or store_days[-1] >= snapshot_date(max(last_csv_path_names))):
+            return store_days[-1], self.snapshot_store.rows(today, before=True)
+        if last_csv_path_names:
+            return snapshot_date(max(last_csv_path_names)), list(read_meds_csv(max(last_csv_path_names)))
+        return None, None
+
+    def load_last_snapshot(self):
+        last_day, last_meds = self.last_snapshot()
+        # Only the signatures of that same snapshot tell which of its labs did not change (after another crawl of the
+        # day the newest ones are today's, not the last snapshot ones)
+        self.last_labs_signatures = self.saved_labs_signatures().get(last_day, {})
+        if last_meds is None or not self.last_labs_signatures:
+            return
+        for med in last_meds:
+            if len(med) == len(self.MEDS_HEADER):
+                self.last_meds_by_lab.setdefault(med[LAB_COLUMN], []).append(compact_row(med))
+
+    def expected_meds_by_lab(self) -> Dict[str, int]:
+        """Rows each lab should have in today's csv: the totalSize of its catalog."""
+        expected_meds_by_lab = {}
+        for lab in self.labs:
+            total_size = self.signature_total_size(self.labs_signatures.get(lab.razon_social))
+            if total_size is not None:
+                expected_meds_by_lab[lab.razon_social] = expected_meds_by_lab.get(lab.razon_social, 0) + total_size
+        return expected_meds_by_lab
+
+    def check_data_quality(self, last_day, last_meds) -> bool:
+        """Validates today's csv in one pass, returns whether it can become the last snapshot and be published."""
+        if not self.quality_gate:
+            return True
+        self.quality_report = validate_snapshot(
+            read_meds_csv(self.csv_meds_path), self.expected_meds_by_lab(), last_meds, self.quality_thresholds
+        )
+        write_quality_report(self.quality_report, self.quality_path, self.now.strftime('%Y%m%d'), last_day)
+        self.progress.show('::: DATA QUALITY {}: {} :::'.format(
+            'PASSED' if self.quality_report.passed else 'BLOCKED', self.quality_report.summary()
+        ))
+        return self.quality_report.passed
+
+    def set_aside_blocked_snapshot(self):
+        """Moves today's csv out of the data path, so it is neither published nor the last snapshot of the next run."""
+        os.makedirs(self.blocked_path, exist_ok=True)
+        blocked_csv_meds_path = self.blocked_path + os.path.basename(self.csv_meds_path)
+        shutil.move(self.csv_meds_path, blocked_csv_meds_path)
+        self.progress.show('::: BLOCKED SNAPSHOT MOVED TO {} :::'.format(blocked_csv_meds_path))
+
+    def write_diff_report(self, last_day, last_meds):
+        if not self.diff_report or last_meds is None:
+            return
+        report = diff_rows(last_meds, list(read_meds_csv(self.csv_meds_path)))
+        write_report(report, self.reports_path, self.now.strftime('%Y%m%d'), last_day)
+        self.progress.show('::: CHANGES SINCE {}: {} :::'.format(last_day, ', '.join(
+            '{} {}'.format(total_name.upper(), value) for total_name, value in report_totals(report).items()
+        )))
+
+    def saved_labs_signatures(self) -> Dict[str, Dict[str, str]]:
+        """Signatures of the labs (by razón social) of each saved snapshot day."""
+        if not os.path.exists(self.labs_signatures_path):
+            return {}
+        with open(self.labs_signatures_path) as labs_signatures__file:
+            signatures_by_day = json.load(labs_signatures__file)
+        # The files without the snapshot day (signatures by CUIT) are not used
+        return {
+            day: labs_signatures for day, labs_signatures in signatures_by_day.items()
+            if re.fullmatch('[0-9]{8}', day) and isinstance(labs_signatures, dict)
+        }
+
+    def save_labs_signatures(self):
+        """Today's signatures, keeping the ones of the last day before for another crawl of the day."""
+        today = self.now.strftime('%Y%m%d')
+        signatures_by_day = self.saved_labs_signatures()
+        last_days = [day for day in signatures_by_day if day < today]
+        signatures_by_day = {day: signatures_by_day[day] for day in last_days[-1:]}
+        signatures_by_day[today] = self.labs_signatures
+        with open(self.labs_signatures_path + '.tmp', 'w') as labs_signatures__file:
+            json.dump(signatures_by_day, labs_signatures__file, indent=0, sort_keys=True)
+        os.replace(self.labs_signatures_path + '.tmp', self.labs_signatures_path)
+
+    @staticmethod
+    def lab_signature(meds_page: MedsPage) -> str:
+        """Cheap fingerprint of a lab catalog: its size and the content of the first page."""
+        first_page_hash = hashlib.sha1(str(meds_page.rows).encode()).hexdigest()
+        return '{}:{}:{}'.format(
+            meds_page.total_size if meds_page.total_size is not None else '', meds_page.page_count, first_page_hash
+        )
+
+    @staticmethod
+    def signature_total_size(signature) -> Optional[int]:
+        """totalSize of the lab catalog in its signature, None if it is unknown."""
+        total_size = signature.split(':', 1)[0] if signature else ''
+        return int(total_size) if total_size else None
+
+    def load_meds_of_the_selected_lab(self, nav: ANMATVademecumNavigation = None, lab: ANMATLab = None, lab_num=None):
+        return list(self.iter_meds_of_the_selected_lab(nav, lab, lab_num))
+
+    def iter_meds_of_the_selected_lab(self, nav: ANMATVademecumNavigation = None, lab: ANMATLab = None, lab_num=None):
+        """Meds rows of the lab, yielded page by page so only one page is kept in memory."""
+        nav = nav or self.nav
+        lab = lab or self.labs[-1]
+        lab_num = lab_num or len(self.labs)
+
+        def fetch_meds_data(meds_page: MedsPage) -> tuple:
+            """The page with the drugs table of each row, cached or parsed from its drugs popup (session requests)."""
+            drugs_tables = {}
+            popups_pos = []
+            for pos, (_, drugs_label) in enumerate(meds_page.drugs_labels[:len(meds_page.rows)]):
+                drugs_table = self.drugs_cache.get(drugs_label) if self.drugs_cache else None
+                if drugs_table is None:
+                    popups_pos.append(pos)
+                else:
+                    drugs_tables[pos] = drugs_table
+            drugs_popups = nav.open_meds_drugs([meds_page.drugs_labels[pos][0] for pos in popups_pos])
+            for pos, drugs_popup in zip(popups_pos, drugs_popups):
+                drugs_tables[pos] = nav.metrics.parse(parse_drugs_table, drugs_popup)
+                if self.drugs_cache and drugs_tables[pos]:
+                    self.drugs_cache.set(meds_page.drugs_labels[pos][1], drugs_tables[pos])
+            return meds_page, drugs_tables
+
+        def fetch_pages_meds_data(first_meds_page: MedsPage) -> Iterator[tuple]:
+            yield fetch_meds_data(first_meds_page)
+            for page in range(1, num_pages):
+                self.progress.show(
+                    '::: LAB ({}/{}) {} PAGE {}/{} :::'.format(
+                        lab_num, self.labs_amount, lab.razon_social, page + 1, num_pages
                     )
                 )
-        lab_meds_re = self.nav.search()
-        pages_re = re.findall(r'"pageCount",([0-9]+)]', lab_meds_re.text)
-        if not pages_re or 'La búsqueda no ha devuelto resultados' in lab_meds_re.text:
-            return []
-        num_pages = int(pages_re[0])
+                yield fetch_meds_data(nav.metrics.parse(parse_meds_page, nav.select_meds_list_page(page).text))
+
+        def parse_meds_data(meds_page: MedsPage, drugs_tables):
+            meds_data = []
+            new_meds_data = meds_page.rows
+            meds_drugs_cell = meds_page.drugs_labels
+            for pos, med_data in enumerate(new_meds_data):
+                if pos >= len(meds_drugs_cell):
+                    meds_data.append(med_row(med_data, '', ()))
+                else:
+                    meds_data.append(med_row(med_data, meds_drugs_cell[pos][1], drugs_tables[pos]))
+            return meds_data
+        meds_page = nav.metrics.parse(parse_meds_page, nav.search().text)
+        if meds_page.page_count is None or meds_page.no_results:
+            return
+        num_pages = meds_page.page_count
+        signature = self.lab_signature(meds_page)
+        with self.stats_lock:
+            self.labs_signatures[lab.razon_social] = signature
+        if self.incremental and self.last_labs_signatures.get(lab.razon_social) == signature \
+                and lab.razon_social in self.last_meds_by_lab:
+            with self.stats_lock:
+                self.reused_labs += 1
+            self.progress.show('::: LAB ({}/{}) {} UNCHANGED :::'.format(lab_num, self.labs_amount, lab.razon_social))
+            yield from self.last_meds_by_lab[lab.razon_social]
+            return
+        with self.stats_lock:
+            self.crawled_labs += 1
         self.progress.show(
             '::: LAB ({}/{}) {} PAGE 1/{} :::'.format(
-                len(self.labs), self.labs_amount, self.labs[-1].razon_social, num_pages
+                lab_num, self.labs_amount, lab.razon_social, num_pages
             )
         )
-        meds_data = []
-        parse_meds_data()
-        for page in range(1, num_pages):
+        pages_meds_data = fetch_pages_meds_data(meds_page)
+        if self.prefetch_pages and num_pages > 1:
+            # The next pages are fetched while this one is written; only the producer thread uses the session and
+            # the drugs cache, so the ZK requests keep their order and no drugs popup is opened twice
+            pages_meds_data = prefetched(pages_meds_data, self.prefetch_pages)
+        for meds_data in pages_meds_data:
+            yield from parse_meds_data(*meds_data)
+
+    def scrape_lab(self, nav: ANMATVademecumNavigation, lab: ANMATLab, lab_num):
+        self.select_lab(nav, lab)
+        return self.load_meds_of_the_selected_lab(nav, lab, lab_num)
+
+    def show_parsed_meds(self, meds: Iterable[tuple]) -> Iterable[tuple]:
+        for med in meds:
+            self.parsed_data.show(self.CSV_DELIMITER.join(csv_row(med)))
+            yield med
+
+    def write_meds(self, lab: ANMATLab, lab_num, meds: Iterable[tuple]):
+        if self.parsed_data.is_on:
+            meds = self.show_parsed_meds(meds)
+        meds_amount = self.csv_meds_writer.write_rows(meds)
+        self.csv_meds_writer.end_lab()
+        if meds_amount:
             self.progress.show(
-                '::: LAB ({}/{}) {} PAGE {}/{} :::'.format(
-                    len(self.labs), self.labs_amount, self.labs[-1].razon_social, page + 1, num_pages
+                '::: LAB ({}/{}) {} ENDED WITH {} MEDS PARSED{} :::'.format(
+                    lab_num, self.labs_amount, lab.razon_social, meds_amount,
+                    ' - ' + self.drugs_cache.stats() if self.drugs_cache else ''
                 )
             )
-            lab_meds_re = self.nav.select_meds_list_page(page)
-            parse_meds_data()
-        return meds_data
-
-    def upload_data_to_github(self):
-        os.system(f'git add {self.data_path}')
-        os.system('git commit -m "Automatic upload data files"')
-        os.system('git push origin HEAD:data')
-
-    @checkout_master_at_end
-    def run(self):
-        os.system(f'cd {self.repo_path}')
-        os.system(f'git fetch')
-        os.system(f'git checkout origin/{self.DATA_BRANCH}')
-        self.nav.page__open_and_load_session_ids()
-        labs_sel__num_pages = self.get_how_many_pages_are_in_labs_selector()
-        csv_delimiter = '|'
-        meds_header__str = csv_delimiter.join([
-            'N° Certificado', 'Laboratorio', 'Nombre Comercial', 'Forma Farmacéutica', 'Presentación',
-            'Precio Venta al Público',
-            ' (uso exclusivamente hospitalario - muestra médica - no venta al público)',
-            ' (muestra médica - no venta al público)', ' (uso exclusivamente hospitalario - muestra médica)',
-            ' (uso exclusivamente hospitalario - no venta al público)', ' (uso exclusivamente hospitalario)',
-            ' (muestra médica)', ' (no venta al público)', 'GTIN', 'Genérico', 'Genérico[IFA,Cantidad,Unidad]'
-        ])
-        with open(self.data_path + self.now.strftime('%Y%m%d') + '.csv', 'w') as csv_meds__file:
-            csv_meds__file.write(meds_header__str + '\n')
+        self.save_checkpoint(lab_num)
+
+    def save_checkpoint(self, done_labs):
+        # The scraping threads keep adding signatures while the checkpoint is saved
+        with self.stats_lock:
+            labs_signatures = dict(self.labs_signatures)
+        checkpoint = {
+            'csv_meds_path': self.csv_meds_path,
+            'csv_meds_offset': self.csv_meds_writer.tell(),
+            'labs': [lab.values_sorted_by_header() for lab in self.labs[:done_labs]],
+            'labs_signatures': labs_signatures,
+        }
+        os.makedirs(os.path.dirname(self.checkpoint_path), exist_ok=True)
+        with open(self.checkpoint_path + '.tmp', 'w') as checkpoint__file:
+            json.dump(checkpoint, checkpoint__file)
+        os.replace(self.checkpoint_path + '.tmp', self.checkpoint_path)
+
+    def load_checkpoint(self) -> bool:
+        """Recover the labs already written to today's csv, dropping any row after the last completed lab."""
+        if not os.path.exists(self.checkpoint_path):
+            return False
+        with open(self.checkpoint_path) as checkpoint__file:
+            checkpoint = json.load(checkpoint__file)
+        if checkpoint['csv_meds_path'] != self.csv_meds_path or not os.path.exists(self.csv_meds_path):
+            return False
+        with open(self.csv_meds_path, 'r+') as csv_meds__file:
+            csv_meds__file.truncate(checkpoint['csv_meds_offset'])
+        self.labs = [ANMATLab.from_values(lab_values) for lab_values in checkpoint['labs']]
+        self.labs_signatures.update(checkpoint['labs_signatures'])
+        self.progress.show('::: RESUMING AFTER {} LABS :::'.format(len(self.labs)))
+        return True
+
+    def remove_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def lab_worker(self, labs_queue: queue.Queue, results: queue.Queue):
+        try:
+            nav = self.new_navigation()
+            self.navs.append(nav)
+            nav.page__open_and_load_session_ids()
+            while True:
+                try:
+                    lab_num, lab = labs_queue.get_nowait()
+                except queue.Empty:
+                    return
+                results.put((lab_num, self.scrape_lab(nav, lab, lab_num + 1)))
+        except BaseException as e:
+            results.put((None, e))
+
+    def scrape_labs_in_parallel(self, labs_sel__num_pages):
+        done_labs = len(self.labs)
+        self.labs = []
         for labs_sel_pag_num in range(labs_sel__num_pages):
             self.progress.show('::: PAGE {}/{} :::'.format(labs_sel_pag_num + 1, labs_sel__num_pages))
-            labs_sel_pag__num_labs = self.get_how_many_labs_are_in_labs_sel_page(labs_sel_pag_num)
-            for labs_sel_pos in range(labs_sel_pag__num_labs):
-                self.get_next_lab(labs_sel_pag_num)
-                self.nav.select_lab_on_selector(labs_sel_pos)
-                meds = self.load_meds_of_the_selected_lab()
-                if not meds:
-                    continue
-                self.progress.show(
-                    '::: LAB ({}/{}) {} ENDED WITH {} MEDS PARSED :::'.format(
-                        len(self.labs), self.labs_amount, self.labs[-1].razon_social, len(meds)
-                    )
-                )
-                meds_rows = [csv_delimiter.join(med) for med in meds]
-                csv_meds__str = '\n'.join(meds_rows) + '\n'
-                self.parsed_data.show(csv_meds__str)
-                with open(self.data_path + self.now.strftime('%Y%m%d') + '.csv', 'a') as csv_meds__file:
-                    csv_meds__file.write(csv_meds__str)
-        self.update_labs_history_file()
-        self.upload_data_to_github()
+            self.labs.extend(self.get_labs_in_labs_sel_page(labs_sel_pag_num))
+        labs_queue = queue.Queue()
+        for lab_num in range(done_labs, len(self.labs)):
+            labs_queue.put((lab_num, self.labs[lab_num]))
+        results = queue.Queue()
+        for _ in range(min(self.workers, labs_queue.qsize())):
+            threading.Thread(target=self.lab_worker, args=(labs_queue, results), daemon=True).start()
+        # Workers finish in any order, rows are written in labs selector order
+        pending_meds = {}
+        next_lab_num = done_labs
+        while next_lab_num < len(self.labs):
+            lab_num, meds = results.get()
+            if isinstance(meds, BaseException):
+                raise meds
+            pending_meds[lab_num] = meds
+            while next_lab_num in pending_meds:
+                self.write_meds(self.labs[next_lab_num], next_lab_num + 1, pending_meds.pop(next_lab_num))
+                next_lab_num += 1
+
+    def scrape_labs(self, labs_sel__num_pages):
+        first_page, first_pos = (self.labs[-1].page, self.labs[-1].page_pos + 1) if self.labs else (0, 0)
+        for labs_sel_pag_num in range(first_page, labs_sel__num_pages):
+            self.progress.show('::: PAGE {}/{} :::'.format(labs_sel_pag_num + 1, labs_sel__num_pages))
+            labs_sel_pag__labs = self.get_labs_in_labs_sel_page(labs_sel_pag_num)
+            for lab in labs_sel_pag__labs[first_pos if labs_sel_pag_num == first_page else 0:]:
+                self.labs.append(lab)
+                self.select_lab(self.nav, lab)
+                self.write_meds(lab, len(self.labs), self.iter_meds_of_the_selected_lab())
+
+    def reusable_signature(self, lab: ANMATLab):
+        """Last signature of the lab if its rows can be reused from the last snapshot."""
+        if self.incremental and lab.razon_social in self.last_meds_by_lab:
+            return self.last_labs_signatures.get(lab.razon_social)
+        return None
+
+    def coordinate_labs(self, labs_queue: LabsQueue, labs_sel__num_pages, resumed):
+        """Queues today's labs for the workers sharing the queue and writes their rows in labs selector order."""
+        done_labs = len(self.labs)
+        day = self.now.strftime('%Y%m%d')
+        if resumed and labs_queue.day() == day and labs_queue.size():
+            self.labs = [ANMATLab.from_values(lab_values) for lab_values in labs_queue.labs()]
+        else:
+            self.labs = []
+            for labs_sel_pag_num in range(labs_sel__num_pages):
+                self.progress.show('::: PAGE {}/{} :::'.format(labs_sel_pag_num + 1, labs_sel__num_pages))
+                self.labs.extend(self.get_labs_in_labs_sel_page(labs_sel_pag_num))
+            labs_queue.start(day, [(lab.values_sorted_by_header(), self.reusable_signature(lab)) for lab in self.labs])
+        self.progress.show('::: {} LABS QUEUED IN {} :::'.format(len(self.labs), labs_queue.path))
+        errors = queue.Queue()
+        for _ in range(self.workers):
+            threading.Thread(target=self.lab_queue_worker, args=(labs_queue, errors), daemon=True).start()
+        reused_labs = crawled_labs = 0
+        next_lab_num = done_labs
+        while next_lab_num < len(self.labs):
+            if not errors.empty():
+                raise errors.get()
+            result = labs_queue.result(next_lab_num)
+            if result is None:
+                if labs_queue.failed_units():
+                    raise RuntimeError('Labs {} failed in every lease'.format(labs_queue.failed_units()))
+                time.sleep(LABS_QUEUE_POLL_SECONDS)
+                continue
+            lab = self.labs[next_lab_num]
+            signature, meds = result
+            if signature:
+                with self.stats_lock:
+                    self.labs_signatures[lab.razon_social] = signature
+            if meds is None:
+                meds = self.last_meds_by_lab[lab.razon_social]
+                reused_labs += 1
+            else:
+                crawled_labs += 1
+            self.write_meds(lab, next_lab_num + 1, meds)
+            next_lab_num += 1
+        labs_queue.finish()
+        # Also counts the labs of the workers in other processes
+        self.reused_labs, self.crawled_labs = reused_labs, crawled_labs
+
+    def lab_queue_worker(self, labs_queue: LabsQueue, errors: queue.Queue):
+        try:
+            self.work(labs_queue)
+        except BaseException as e:
+            errors.put(e)
+
+    def work(self, labs_queue: LabsQueue, worker_name=None):
+        """Scrapes the labs leased from the queue, with its own navigation session, until today's crawl is done."""
+        worker_name = worker_name or '{}:{}:{}'.format(socket.gethostname(), os.getpid(), threading.get_ident())
+        day = self.now.strftime('%Y%m%d')
+        nav = None
+        while True:
+            unit = labs_queue.lease(worker_name) if labs_queue.day() == day else None
+            if unit is None:
+                if labs_queue.day() == day and labs_queue.finished():
+                    return
+                time.sleep(LABS_QUEUE_POLL_SECONDS)
+                continue
+            if nav is None:
+                nav = self.new_navigation()
+                self.navs.append(nav)
+                nav.page__open_and_load_session_ids()
+                self.labs_amount = self.labs_amount or labs_queue.size()
+            lab = ANMATLab.from_values(unit.lab_values)
+            if unit.last_signature:
+                # Without the last snapshot the worker only tells the coordinator to reuse the lab rows
+                self.last_labs_signatures.setdefault(lab.razon_social, unit.last_signature)
+                self.last_meds_by_lab.setdefault(lab.razon_social, [])
+            try:
+                with labs_queue.keep_leased(unit.lab_num, worker_name):
+                    self.select_lab(nav, lab)
+                    meds = list(self.iter_meds_of_the_selected_lab(nav, lab, unit.lab_num + 1))
+            except BaseException:
+                labs_queue.release(unit.lab_num, worker_name)
+                raise
+            signature = self.labs_signatures.get(lab.razon_social)
+            reused = self.incremental and unit.last_signature is not None and signature == unit.last_signature
+            labs_queue.complete(unit.lab_num, worker_name, signature, None if reused else meds)
+
+    def recovery_stats(self) -> dict:
+        stats = {}
+        for nav in self.navs:
+            for stat_name, value in nav.recovery_stats.items():
+                stats[stat_name] = stats.get(stat_name, 0) + value
+        return stats
+
+    def publish_paths(self) -> List[str]:
+        if self.snapshot_store:
+            paths = (self.labs_path, self.snapshot_store.path, self.reports_path)
+            return [path for path in paths if os.path.exists(path)]
+        return [self.data_path]
+
+    def run(self, resume=False, labs_queue: LabsQueue = None, publisher: DataPublisher = None):
+        """Crawls and, with a publisher (whose worktree data path the scraper has to use), starts publishing it."""
+        self.crawl(resume, labs_queue)
+        if publisher and self.quality_report and not self.quality_report.passed:
+            publisher.set_status('blocked', anomalies=self.quality_report.summary(), report=self.quality_path)
+            self.progress.show('::: DATA NOT PUBLISHED, IT CROSSES THE DATA QUALITY THRESHOLDS :::')
+        elif publisher:
+            publisher.publish(self.publish_paths(), 'Automatic upload data files')
+            self.progress.show('::: PUBLISHING TO THE {} BRANCH IN THE BACKGROUND :::'.format(publisher.branch))
+
+    def crawl(self, resume=False, labs_queue: LabsQueue = None):
+        """Today's snapshot, scraping the labs here or, with a labs queue, coordinating the workers that share it."""
+        self.nav.page__open_and_load_session_ids()
+        labs_sel__num_pages = self.get_how_many_pages_are_in_labs_selector()
+        if self.incremental:
+            self.load_last_snapshot()
+        resumed = resume and self.load_checkpoint()
+        self.csv_meds_writer = MedsCSVWriter(
+            self.csv_meds_path, append=resumed, flush_bytes=CSV_FLUSH_BYTES, flush_seconds=CSV_FLUSH_SECONDS
+        )
+        try:
+            if labs_queue:
+                self.coordinate_labs(labs_queue, labs_sel__num_pages, resumed)
+            elif self.workers > 1:
+                self.scrape_labs_in_parallel(labs_sel__num_pages)
+            else:
+                self.scrape_labs(labs_sel__num_pages)
+        finally:
+            self.csv_meds_writer.close()
+        last_day, last_meds = self.last_snapshot() if self.quality_gate or self.diff_report else (None, None)
+        if self.check_data_quality(last_day, last_meds):
+            self.update_labs_history_file()
+            self.write_diff_report(last_day, last_meds)
+            self.update_meds_history_store()
+            try:
+                self.export_meds_to_parquet()
+            except Exception as e:
+                # The parquet is a copy of the csv, the snapshot is published without it
+                self.progress.show('::: PARQUET EXPORT FAILED: {!r} :::'.format(e))
+            self.save_labs_signatures()
+        else:
+            self.set_aside_blocked_snapshot()
+        self.remove_checkpoint()
+        self.progress.show('::: {} LABS REUSED FROM THE LAST SNAPSHOT, {} LABS CRAWLED :::'.format(
+            self.reused_labs, self.crawled_labs
+        ))
+        self.show_run_stats()
+
+    def run_worker(self, labs_queue: LabsQueue):
+        """Worker of the labs queue for today's crawl (see crawl)."""
+        self.progress.show('::: WORKING ON THE LABS OF {} :::'.format(labs_queue.path))
+        self.work(labs_queue)
+        self.progress.show('::: {} LABS CRAWLED, {} UNCHANGED :::'.format(self.crawled_labs, self.reused_labs))
+        self.show_run_stats()
+
+    def show_run_stats(self):
+        if self.drugs_cache:
+            self.progress.show('::: {} :::'.format(self.drugs_cache.stats()))
+            self.drugs_cache.close()
+        self.progress.show('::: NAVIGATION RECOVERY: {} :::'.format(', '.join(
+            '{} {}'.format(stat_name.upper(), round(value, 1)) for stat_name, value in self.recovery_stats().items()
+        )))
+        rate_stats = self.rate_limiter.stats()
+        if rate_stats:
+            self.progress.show('::: REQUESTS PER SECOND: {} :::'.format(', '.join(
+                '{} {}'.format(stat_name.upper(), round(value, 2)) for stat_name, value in rate_stats.items()
+            )))
+        for line in self.metrics.summary_lines():
+            self.progress.show(line, transformation=str)
+        self.metrics.close(
+            recovery_stats=self.recovery_stats(), rate_stats=rate_stats, reused_labs=self.reused_labs,
+            crawled_labs=self.crawled_labs
+        )
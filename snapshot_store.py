@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""Daily meds snapshots stored as one base csv plus the changes of each day.
+
+    python snapshot_store.py import [DATA_PATH]
+    python snapshot_store.py rebuild DAY CSV_PATH [DATA_PATH]
+
+`import` adds the daily csvs of DATA_PATH (default the crawl data, in the data branch worktree or else data/) not yet in
+the store, `rebuild` writes the full csv of a day.
+"""
+import os
+import sys
+import glob
+import json
+import argparse
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from data_publisher import default_data_path
+from meds_csv import MEDS_HEADER, MedsCSVWriter, read_meds_csv, snapshot_date, snapshot_paths
+
+
+KEY_COLUMNS = (MEDS_HEADER.index('N° Certificado'), MEDS_HEADER.index('GTIN'), MEDS_HEADER.index('Presentación'))
+
+
+def meds_keys(rows: Sequence[Sequence[str]]) -> List[Tuple[str, ...]]:
+    """(N° Certificado, GTIN, Presentación, occurrence) of each row, the occurrence tells apart repeated ones."""
+    occurrences = {}  # type: Dict[Tuple[str, ...], int]
+    keys = []
+    for row in rows:
+        key = tuple(row[column] if column < len(row) else '' for column in KEY_COLUMNS)
+        occurrence = occurrences.get(key, 0)
+        occurrences[key] = occurrence + 1
+        keys.append(key + (str(occurrence),))
+    return keys
+
+
+def order_runs(positions: Sequence[int]) -> List[List[int]]:
+    """[start, length] runs of consecutive positions."""
+    runs = []
+    for position in positions:
+        if runs and runs[-1][0] + runs[-1][1] == position:
+            runs[-1][1] += 1
+        else:
+            runs.append([position, 1])
+    return runs
+
+
+def meds_delta(last_rows: Sequence[Sequence[str]], rows: Sequence[Sequence[str]]) -> List[list]:
+    """Operations that turn last_rows into rows: removals, changed cells, order of the kept rows and additions."""
+    last_keys, keys = meds_keys(last_rows), meds_keys(rows)
+    last_pos_by_key = {key: pos for pos, key in enumerate(last_keys)}
+    key_set = set(keys)
+    delta = [['-', list(key)] for key in last_keys if key not in key_set]
+    kept_last_positions = []
+    for pos, (key, row) in enumerate(zip(keys, rows)):
+        last_pos = last_pos_by_key.get(key)
+        if last_pos is None:
+            delta.append(['+', pos, list(row)])
+            continue
+        kept_last_positions.append(last_pos)
+        last_row = last_rows[last_pos]
+        if len(row) != len(last_row):
+            delta.append(['~', list(key), list(row)])
+        elif row != last_row:
+            delta.append(['~', list(key), {
+                str(column): value for column, (value, last_value) in enumerate(zip(row, last_row))
+                if value != last_value
+            }])
+    if kept_last_positions != sorted(kept_last_positions):
+        delta.append(['order', order_runs(kept_last_positions)])
+    return delta
+
+
+def apply_meds_delta(last_rows: Sequence[Sequence[str]], delta: Iterable[list]) -> List[List[str]]:
+    last_keys = meds_keys(last_rows)
+    rows_by_key = {key: list(row) for key, row in zip(last_keys, last_rows)}
+    additions, order = [], None
+    for operation in delta:
+        if operation[0] == '-':
+            del rows_by_key[tuple(operation[1])]
+        elif operation[0] == '~':
+            key, change = tuple(operation[1]), operation[2]
+            if isinstance(change, dict):
+                for column, value in change.items():
+                    rows_by_key[key][int(column)] = value
+            else:
+                rows_by_key[key] = change
+        elif operation[0] == '+':
+            additions.append((operation[1], operation[2]))
+        elif operation[0] == 'order':
+            order = operation[1]
+    if order is None:
+        rows = [rows_by_key[key] for key in last_keys if key in rows_by_key]
+    else:
+        rows = [rows_by_key[last_keys[pos]] for start, length in order for pos in range(start, start + length)]
+    for pos, row in sorted(additions, key=lambda addition: addition[0]):
+        rows.insert(pos, row)
+    return rows
+
+
+class SnapshotStore:
+    """Base snapshot (<day>.base.csv) and one json lines delta per later day (deltas/<day>.jsonl).
+
+    Days without changes are not saved, they rebuild as the last saved day before them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.deltas_path = os.path.join(path, 'deltas/')
+        self.last_day = None  # type: Optional[str]
+        self.last_rows = None  # type: Optional[List[List[str]]]
+
+    def base_path(self) -> Optional[str]:
+        base_paths = glob.glob(os.path.join(self.path, '[0-9]' * 8 + '.base.csv'))
+        return min(base_paths) if base_paths else None
+
+    def days(self) -> List[str]:
+        base_path = self.base_path()
+        if base_path is None:
+            return []
+        delta_paths = glob.glob(os.path.join(self.deltas_path, '[0-9]' * 8 + '.jsonl'))
+        return [os.path.basename(base_path)[:8]] + sorted(os.path.basename(path)[:8] for path in delta_paths)
+
+    def rows(self, day, before=False) -> List[List[str]]:
+        """Full snapshot of the day (or of the last day saved before it), before=True skips the day itself."""
+        days = [saved_day for saved_day in self.days() if saved_day < day or saved_day == day and not before]
+        if not days:
+            raise KeyError(f'No snapshot saved before {day}')
+        if self.last_day == days[-1]:
+            return [list(row) for row in self.last_rows]
+        rows = list(read_meds_csv(self.base_path()))
+        for delta_day in days[1:]:
+            with open(os.path.join(self.deltas_path, delta_day + '.jsonl')) as delta__file:
+                rows = apply_meds_delta(rows, (json.loads(line) for line in delta__file))
+        self.last_day, self.last_rows = days[-1], rows
+        return [list(row) for row in rows]
+
+    def add(self, day, rows: Iterable[Sequence[str]]) -> bool:
+        """Saves the day as a delta against the last saved one (replacing it if it is the same day).
+
+        Returns False if nothing changed.
+        """
+        rows = [list(row) for row in rows]
+        days = self.days()
+        if days and day < days[-1]:
+            raise ValueError(f'{day} is before the last saved day ({days[-1]})')
+        if days and day == days[-1]:
+            if os.path.exists(os.path.join(self.deltas_path, day + '.jsonl')):
+                os.remove(os.path.join(self.deltas_path, day + '.jsonl'))
+            else:
+                os.remove(self.base_path())
+            days.pop()
+            self.last_day = self.last_rows = None
+        if not days:
+            os.makedirs(self.path, exist_ok=True)
+            csv_writer = MedsCSVWriter(os.path.join(self.path, day + '.base.csv'))
+            csv_writer.write_rows(rows)
+            csv_writer.close()
+            self.last_day, self.last_rows = day, rows
+            return True
+        delta = meds_delta(self.rows(days[-1]), rows)
+        # Not save if not changed
+        if not delta:
+            return False
+        os.makedirs(self.deltas_path, exist_ok=True)
+        delta_path = os.path.join(self.deltas_path, day + '.jsonl')
+        with open(delta_path + '.tmp', 'w') as delta__file:
+            for operation in delta:
+                delta__file.write(json.dumps(operation, ensure_ascii=False) + '\n')
+        os.replace(delta_path + '.tmp', delta_path)
+        self.last_day, self.last_rows = day, rows
+        return True
+
+    def add_csv(self, csv_path) -> bool:
+        return self.add(snapshot_date(csv_path), read_meds_csv(csv_path))
+
+    def rebuild(self, day, csv_path):
+        csv_writer = MedsCSVWriter(csv_path)
+        csv_writer.write_rows(self.rows(day))
+        csv_writer.close()
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog, description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    import_parser = subparsers.add_parser('import')
+    import_parser.add_argument('data_path', nargs='?', default=default_data_path())
+    rebuild_parser = subparsers.add_parser('rebuild')
+    rebuild_parser.add_argument('day')
+    rebuild_parser.add_argument('csv_path')
+    rebuild_parser.add_argument('data_path', nargs='?', default=default_data_path())
+    args = parser.parse_args(argv)
+    store = SnapshotStore(os.path.join(args.data_path, 'store/'))
+    if args.command == 'rebuild':
+        store.rebuild(args.day, args.csv_path)
+        return
+    days = store.days()
+    for csv_path in snapshot_paths(args.data_path):
+        if days and snapshot_date(csv_path) <= days[-1]:
+            continue
+        saved = store.add_csv(csv_path)
+        print(snapshot_date(csv_path), 'saved' if saved else 'unchanged', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
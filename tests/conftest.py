@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scraper  # noqa: E402
+from http_fixtures import Recording, SyntheticZKSession  # noqa: E402
+
+
+def crawl_into(path, session_factory, day=None, resume=False, **options) -> scraper.ANMATScraper:
+    """Crawl of the session_factory catalog into path/data/ (with path/cache/), on day (YYYYMMDD) if given. The options
+    are ANMATScraper ones; the rate is fixed and the crawl is not incremental nor uses the drugs cache by default."""
+    anmat_scraper = scraper.ANMATScraper(**dict(dict(
+        adaptive_rate=False, incremental=False, drugs_cache=False, data_path=os.path.join(str(path), 'data', ''),
+        cache_path=os.path.join(str(path), 'cache', ''), session_factory=session_factory
+    ), **options))
+    anmat_scraper.progress.off()
+    if day:
+        anmat_scraper.now = datetime.strptime(day, '%Y%m%d')
+        anmat_scraper.csv_meds_path = anmat_scraper.data_path + day + '.csv'
+    anmat_scraper.crawl(resume)
+    return anmat_scraper
+
+
+@pytest.fixture
+def crawl(tmp_path):
+    """crawl_into the `name` directory of tmp_path (tmp_path itself by default)."""
+    def crawl(session_factory, day=None, name='', resume=False, **options) -> scraper.ANMATScraper:
+        return crawl_into(tmp_path / name, session_factory, day, resume, **options)
+    return crawl
+
+
+@pytest.fixture(scope='session')
+def recording(tmp_path_factory):
+    """Path of a recording of the crawl of a synthetic catalog of 23 labs, and the csv of that crawl."""
+    path = tmp_path_factory.mktemp('recording')
+    with Recording(str(path / 'recording.jsonl')) as recording:
+        recorded = crawl_into(path, lambda: recording.session(SyntheticZKSession(23, 3, 7)))
+    with open(recorded.csv_meds_path, 'rb') as csv_meds__file:
+        return str(path / 'recording.jsonl'), csv_meds__file.read()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp import web  # noqa: E402
+
+import scraper  # noqa: E402
+from async_navigation import AsyncANMATVademecumNavigation  # noqa: E402
+from http_fixtures import RecordedResponse, Replay, SyntheticZKSession  # noqa: E402
+from zk_parser import parse_meds_page  # noqa: E402
+
+
+async def synthetic_server(zk_session: SyntheticZKSession) -> web.AppRunner:
+    async def handle(request):
+        if request.method == 'GET':
+            response = zk_session.get(str(request.url))
+        else:
+            response = zk_session.post(str(request.url), data=dict(await request.post()))
+        web_response = web.Response(text=response.text)
+        for name, value in response.cookies.items():
+            web_response.set_cookie(name, value)
+        return web_response
+    app = web.Application()
+    app.router.add_route('*', '/{tail:.*}', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    return runner
+
+
+def serve(navigation: AsyncANMATVademecumNavigation, runner: web.AppRunner):
+    host, port = runner.addresses[0][:2]
+    navigation.URL = navigation.URL_SKU = f'http://{host}:{port}/'
+
+
+def test_navigation_created_outside_the_event_loop():
+    async def open_labs_selector(navigation):
+        runner = await synthetic_server(SyntheticZKSession(3, 1, 1))
+        serve(navigation, runner)
+        try:
+            assert navigation.session is None
+            await navigation.page__open_and_load_session_ids()
+            await navigation.labs_selector__open_page()
+            return navigation.dt_id, navigation.session_id, len(navigation.lab_item_name_in_selector)
+        finally:
+            await navigation.close()
+            await runner.cleanup()
+
+    navigation = AsyncANMATVademecumNavigation()
+    assert asyncio.run(open_labs_selector(navigation)) == ('z_synthetic', 'SYNTHETIC', 3)
+    assert navigation.session.closed
+    assert navigation.connector is None
+
+
+def test_async_with_closes_the_session_but_not_a_shared_connector():
+    async def open_main_page():
+        runner = await synthetic_server(SyntheticZKSession(1, 1, 1))
+        connector = aiohttp.TCPConnector()
+        try:
+            navigation = AsyncANMATVademecumNavigation(connector)
+            serve(navigation, runner)
+            async with navigation:
+                await navigation.page__open_and_load_session_ids()
+                await navigation.new_session()
+                await navigation.page__open_and_load_session_ids()
+            return navigation.session.closed, connector.closed
+        finally:
+            await connector.close()
+            await runner.cleanup()
+
+    assert asyncio.run(open_main_page()) == (True, False)
+
+
+class ErrorOnceZKSession(SyntheticZKSession):
+    """Synthetic catalog that answers the first search with a ZK error."""
+
+    searched = False
+
+    def post(self, url, data=None, **kwargs):
+        if data['cmd_0'] == 'onAnchorPos' and not self.searched:
+            self.searched = True
+            return RecordedResponse(Replay.ERROR_TEXT)
+        return super().post(url, data, **kwargs)
+
+
+def test_zk_error_is_recovered_like_in_the_sync_navigation(monkeypatch):
+    monkeypatch.setattr(scraper, 'NAVIGATION_BACKOFF_SECONDS', 0.)
+
+    async def search_lab():
+        runner = await synthetic_server(ErrorOnceZKSession(3, 2, 2))
+        try:
+            async with AsyncANMATVademecumNavigation() as navigation:
+                serve(navigation, runner)
+                await navigation.page__open_and_load_session_ids()
+                await navigation.labs_selector__open_page()
+                await navigation.select_lab_on_selector(1)
+                response = await navigation.search()
+                return navigation.recovery_stats, [method.__name__ for method in navigation.history_methods], \
+                    parse_meds_page(response.text).rows
+        finally:
+            await runner.cleanup()
+
+    recovery_stats, history, rows = asyncio.run(search_lab())
+    assert (recovery_stats['errors'], recovery_stats['recoveries'], recovery_stats['replayed_calls']) == (1, 1, 3)
+    assert history == ['page__open_and_load_session_ids', 'labs_selector__open_page', 'select_lab_on_selector',
+                       'search']
+    assert [row[1] for row in rows] == ['LAB 1 S.A.', 'LAB 1 S.A.']
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from http_fixtures import Replay, ReplaySession
+
+
+class Interrupted(Exception):
+    pass
+
+
+class InterruptedReplaySession(ReplaySession):
+    """Replay session that stops the crawl at the request number `interrupt_at` of all its sessions."""
+
+    requests = 0
+    interrupt_at = None
+
+    def request(self, method, url, data=None):
+        InterruptedReplaySession.requests += 1
+        if InterruptedReplaySession.requests == self.interrupt_at:
+            raise Interrupted()
+        return super().request(method, url, data)
+
+
+@pytest.mark.parametrize('workers, interrupt_at', [(1, 45), (1, 120), (4, 45), (4, 120)])
+def test_interrupted_crawl_is_resumed(tmp_path, crawl, recording, monkeypatch, workers, interrupt_at):
+    recording_path, recorded_csv = recording
+    replay = Replay(recording_path)
+    monkeypatch.setattr(InterruptedReplaySession, 'requests', 0)
+    monkeypatch.setattr(InterruptedReplaySession, 'interrupt_at', interrupt_at)
+    with pytest.raises(Interrupted):
+        crawl(lambda: InterruptedReplaySession(replay), workers=workers)
+    assert os.path.exists(tmp_path / 'cache' / 'checkpoint.json')
+    anmat_scraper = crawl(replay.session, resume=True, workers=workers)
+    assert 0 < anmat_scraper.crawled_labs < 23
+    with open(anmat_scraper.csv_meds_path, 'rb') as csv_meds__file:
+        assert csv_meds__file.read() == recorded_csv
+    assert not os.path.exists(anmat_scraper.checkpoint_path)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+import columnar_export
+import scraper
+from http_fixtures import SyntheticZKSession
+from meds_csv import MEDS_HEADER, INGREDIENTS_COLUMN
+
+
+@pytest.mark.parametrize('text, ingredients', [
+    ('', []),
+    ("[['IBUPROFENO', '400', 'MG']]", [('IBUPROFENO', 400.0, 'MG')]),
+    ("[['IBUPROFENO', '', 'MG']]", [('IBUPROFENO', None, 'MG')]),
+    ("[['LIDOCAINA', '1,5', 'G'], ['AGUA', 'c.s.p.', '']]", [('LIDOCAINA', None, '1,5 G'), ('AGUA', None, 'c.s.p.')]),
+    ("[['IBUPROFENO', '400']]", [("[['IBUPROFENO', '400']]", None, None)]),
+    ("[['IBUPROFENO', 400, 'MG']]", [("[['IBUPROFENO', 400, 'MG']]", None, None)]),
+    ('IBUPROFENO 400 MG', [('IBUPROFENO 400 MG', None, None)]),
+])
+def test_parse_ingredients(text, ingredients):
+    assert columnar_export.parse_ingredients(text) == ingredients
+
+
+def test_meds_table_with_unusual_ingredients():
+    pytest.importorskip('pyarrow')
+    row = [''] * len(MEDS_HEADER)
+    rows = []
+    for ingredients in ("[['LIDOCAINA', '1,5', 'G']]", "[['IBUPROFENO'", "[['IBUPROFENO', '400', 'MG']]"):
+        row[INGREDIENTS_COLUMN] = ingredients
+        rows.append(list(row))
+    table = columnar_export.meds_table('20201029', rows)
+    assert table.column('ingredientes').to_pylist() == [
+        [{'ifa': 'LIDOCAINA', 'cantidad': None, 'unidad': '1,5 G'}],
+        [{'ifa': "[['IBUPROFENO'", 'cantidad': None, 'unidad': None}],
+        [{'ifa': 'IBUPROFENO', 'cantidad': 400.0, 'unidad': 'MG'}],
+    ]
+
+
+def test_failed_export_does_not_fail_the_crawl(crawl, monkeypatch):
+    def export_snapshot(csv_path, out_path):
+        raise ValueError('unexpected cell')
+    monkeypatch.setattr(scraper, 'pyarrow_installed', lambda: True)
+    monkeypatch.setattr(scraper, 'export_snapshot', export_snapshot)
+    anmat_scraper = crawl(lambda: SyntheticZKSession(3, 1, 2))
+    assert os.path.exists(anmat_scraper.csv_meds_path)
+    assert list(anmat_scraper.saved_labs_signatures()) == [anmat_scraper.now.strftime('%Y%m%d')]
+    assert not os.path.exists(anmat_scraper.checkpoint_path)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+
+import pytest
+
+from data_publisher import DataPublisher, default_data_path, git
+
+
+@pytest.fixture(autouse=True)
+def git_identity(monkeypatch):
+    for variable in ('GIT_AUTHOR_NAME', 'GIT_COMMITTER_NAME'):
+        monkeypatch.setenv(variable, 'scraper')
+    for variable in ('GIT_AUTHOR_EMAIL', 'GIT_COMMITTER_EMAIL'):
+        monkeypatch.setenv(variable, 'scraper@localhost')
+
+
+@pytest.fixture
+def remote(tmp_path):
+    """Bare remote with a data branch."""
+    remote_path = str(tmp_path / 'remote.git')
+    seed_path = str(tmp_path / 'seed')
+    git('init', '--quiet', '--bare', remote_path, cwd=str(tmp_path))
+    git('init', '--quiet', seed_path, cwd=str(tmp_path))
+    git('checkout', '--quiet', '-b', 'data', cwd=seed_path)
+    os.makedirs(os.path.join(seed_path, 'data'))
+    write(os.path.join(seed_path, 'data', 'README'), 'data')
+    git('add', '.', cwd=seed_path)
+    git('commit', '--quiet', '-m', 'data', cwd=seed_path)
+    git('push', '--quiet', remote_path, 'data', cwd=seed_path)
+    return remote_path
+
+
+def clone(tmp_path, remote_path, name) -> DataPublisher:
+    repo_path = str(tmp_path / name)
+    git('init', '--quiet', repo_path, cwd=str(tmp_path))
+    git('commit', '--quiet', '--allow-empty', '-m', 'code', cwd=repo_path)
+    git('remote', 'add', 'origin', remote_path, cwd=repo_path)
+    return DataPublisher(repo_path, max_retries=0)
+
+
+def write(path, text):
+    with open(path, 'w') as text__file:
+        text__file.write(text)
+
+
+def remote_file(remote_path, path) -> str:
+    return git('show', f'data:{path}', cwd=remote_path)
+
+
+def test_publish(tmp_path, remote):
+    publisher = clone(tmp_path, remote, 'repo')
+    assert publisher.prepare()
+    write(publisher.data_path + '20201029.csv', 'rows')
+    publisher.publish([publisher.data_path], 'Automatic upload data files')
+    assert publisher.wait()['state'] == 'pushed'
+    assert remote_file(remote, 'data/20201029.csv') == 'rows'
+    assert publisher.pending_commits() == 0
+
+
+def test_conflicting_unpushed_commit_is_kept_on_a_backup_ref(tmp_path, remote):
+    publisher, other_publisher = clone(tmp_path, remote, 'repo'), clone(tmp_path, remote, 'other_repo')
+    assert publisher.prepare() and other_publisher.prepare()
+    write(other_publisher.data_path + '20201029.csv', 'other rows')
+    other_publisher.commit_and_push([other_publisher.data_path], 'other')
+    write(publisher.data_path + '20201029.csv', 'rows')
+    publisher.commit_and_push([publisher.data_path], 'ours')
+    assert publisher.status['state'] == 'failed' and publisher.pending_commits() == 1
+    unpushed_commit = git('rev-parse', 'HEAD', cwd=publisher.worktree_path)
+    # A rebase interrupted by hand is aborted too
+    assert subprocess.run(
+        ('git', 'rebase', publisher.upstream), cwd=publisher.worktree_path, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    ).returncode
+    assert publisher.prepare()
+    assert publisher.status['state'] == 'reset'
+    assert git('rev-parse', publisher.backup_ref, cwd=publisher.repo_path) == unpushed_commit
+    assert publisher.pending_commits() == 0
+    assert git('status', '--porcelain', cwd=publisher.worktree_path) == ''
+    # The next run publishes again
+    write(publisher.data_path + '20201030.csv', 'next rows')
+    publisher.commit_and_push([publisher.data_path], 'next')
+    assert publisher.status['state'] == 'pushed'
+    assert remote_file(remote, 'data/20201029.csv') == 'other rows'
+    assert publisher.prepare() and publisher.status['state'] == 'pushed'
+
+
+def test_first_run_without_the_remote(tmp_path, remote):
+    publisher = clone(tmp_path, str(tmp_path / 'unreachable.git'), 'repo')
+    assert not publisher.prepare()
+    assert publisher.fetch_error and publisher.status['state'] == 'failed'
+    # With a local data branch the crawl goes on from it
+    git('fetch', '--quiet', remote, 'data:data', cwd=publisher.repo_path)
+    assert publisher.prepare()
+    assert os.path.exists(publisher.data_path + 'README')
+
+
+def test_default_data_path_is_the_worktree_one_once_it_exists(tmp_path):
+    assert default_data_path(str(tmp_path)) == os.path.join(str(tmp_path), 'data', '')
+    publisher = DataPublisher(str(tmp_path))
+    os.makedirs(publisher.data_path)
+    assert default_data_path(str(tmp_path)) == publisher.data_path
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import re
+
+from collections import Counter
+
+import pytest
+
+from drugs_cache import DrugsCache
+from http_fixtures import SyntheticZKSession
+
+
+def test_hit_does_not_lock_the_cache_for_other_processes(tmp_path):
+    cache = DrugsCache(str(tmp_path / 'drugs.sqlite3'))
+    cache.set('IBUPROFENO 400 MG', [['IBUPROFENO', '400', 'MG']])
+    assert cache.get('IBUPROFENO 400 MG') == [['IBUPROFENO', '400', 'MG']]
+    other_cache = DrugsCache(str(tmp_path / 'drugs.sqlite3'))
+    other_cache.connection.execute('PRAGMA busy_timeout = 100')
+    other_cache.set('PARACETAMOL 500 MG', [['PARACETAMOL', '500', 'MG']])
+    assert cache.get('PARACETAMOL 500 MG') == [['PARACETAMOL', '500', 'MG']]
+    other_cache.close()
+    cache.close()
+
+
+def test_evict_keeps_the_most_recently_used(tmp_path):
+    cache = DrugsCache(str(tmp_path / 'drugs.sqlite3'), max_entries=1)
+    cache.set('A', [['A', '1', 'MG']])
+    cache.set('B', [['B', '1', 'MG']])
+    cache.connection.execute("UPDATE drugs SET last_used = last_used + 10 WHERE label = 'A'")
+    cache.evict()
+    assert cache.get('A') is not None and cache.get('B') is None
+    cache.close()
+
+
+class SharedLabelsZKSession(SyntheticZKSession):
+    """Synthetic catalog whose rows have the same generic label on every meds page, counting the drugs popups."""
+
+    opened_popups = Counter()
+
+    def post(self, url, data=None, **kwargs):
+        if data['cmd_0'] == 'onClick' and data['uuid_0'].startswith('zk_drugs_'):
+            self.opened_popups.update(data[name] for name in data if name.startswith('uuid_'))
+        return super().post(url, data, **kwargs)
+
+    def meds_page(self, page):
+        return re.sub(r"value:'IFA \d+_\d+_(\d+) 10 MG'", r"value:'IFA ROW \1 10 MG'", super().meds_page(page))
+
+
+@pytest.mark.parametrize('prefetch_pages', [0, 2])
+def test_drugs_popup_of_a_label_is_opened_once(crawl, monkeypatch, prefetch_pages):
+    monkeypatch.setattr(SharedLabelsZKSession, 'opened_popups', Counter())
+    anmat_scraper = crawl(lambda: SharedLabelsZKSession(2, 4, 3), drugs_cache=True, prefetch_pages=prefetch_pages)
+    # Only the rows of the first meds page of the first lab open their popup
+    assert sorted(SharedLabelsZKSession.opened_popups) == ['zk_drugs_0_0_0', 'zk_drugs_0_0_1', 'zk_drugs_0_0_2']
+    assert anmat_scraper.drugs_cache.hits == 2 * 4 * 3 - 3
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import pytest
+import requests
+
+import scraper
+from http_fixtures import Recording, Replay, SyntheticZKSession
+from meds_csv import read_meds_csv
+from zk_parser import parse_dt_id
+
+
+def test_replay_of_a_recorded_crawl(tmp_path, crawl):
+    recording_path = str(tmp_path / 'recording.jsonl')
+    with Recording(recording_path) as recording:
+        recorded = crawl(lambda: recording.session(SyntheticZKSession(3, 2, 2)), name='record')
+    assert recording.recording__file.closed
+    replay = Replay(recording_path)
+    replayed = crawl(replay.session, name='replay')
+    assert sorted(read_meds_csv(replayed.csv_meds_path)) == sorted(read_meds_csv(recorded.csv_meds_path))
+    assert sum(replay.requests.values()) == sum(1 for _ in open(recording_path))
+
+
+def test_replay_with_injected_errors_is_crawled_to_the_end(crawl, recording, monkeypatch):
+    monkeypatch.setattr(scraper, 'NAVIGATION_BACKOFF_SECONDS', 0.)
+    recording_path, recorded_csv = recording
+    for workers, seed in ((1, 0), (4, 1)):
+        replayed = crawl(Replay(recording_path, error_rate=.2, seed=seed).session, name=f'replay_{workers}',
+                         workers=workers)
+        with open(replayed.csv_meds_path, 'rb') as csv_meds__file:
+            assert csv_meds__file.read() == recorded_csv
+        recovery_stats = replayed.recovery_stats()
+        assert recovery_stats['errors'] and recovery_stats['connection_errors'] and recovery_stats['recoveries']
+
+
+def test_main_page_without_desktop_id_is_retried():
+    with pytest.raises(requests.exceptions.RequestException):
+        parse_dt_id('<html>Service Unavailable</html>')
+    assert parse_dt_id("zk.Desktop dt:'z_synthetic'") == 'z_synthetic'
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import json
+
+from http_fixtures import SyntheticZKSession
+from meds_csv import read_meds_csv
+
+
+class ChangedLabZKSession(SyntheticZKSession):
+    """Synthetic catalog where the products of one lab were renamed."""
+
+    def __init__(self, labs, pages, rows, changed_lab=None):
+        super().__init__(labs, pages, rows)
+        self.changed_lab = changed_lab
+
+    def meds_page(self, page):
+        text = super().meds_page(page)
+        return text.replace("value:'MED ", "value:'NEW MED ") if self.selected_lab == self.changed_lab else text
+
+
+def catalog(changed_lab=None):
+    return lambda: ChangedLabZKSession(6, 2, 3, changed_lab)
+
+
+def test_another_crawl_of_the_day_does_not_reuse_changed_labs(crawl):
+    crawl(catalog(), '20201028', incremental=True)
+    first_crawl = crawl(catalog(3), '20201029', incremental=True)
+    assert (first_crawl.reused_labs, first_crawl.crawled_labs) == (5, 1)
+    second_crawl = crawl(catalog(3), '20201029', incremental=True)
+    assert (second_crawl.reused_labs, second_crawl.crawled_labs) == (5, 1)
+    rows = list(read_meds_csv(second_crawl.csv_meds_path))
+    assert [row[2] for row in rows if row[1] == 'LAB 3 S.A.'] == ['NEW MED 3_0_0', 'NEW MED 3_0_1', 'NEW MED 3_0_2',
+                                                                   'NEW MED 3_1_0', 'NEW MED 3_1_1', 'NEW MED 3_1_2']
+    with open(second_crawl.labs_signatures_path) as labs_signatures__file:
+        signatures_by_day = json.load(labs_signatures__file)
+    assert sorted(signatures_by_day) == ['20201028', '20201029']
+    assert set(signatures_by_day['20201029']) == {f'LAB {lab_num} S.A.' for lab_num in range(6)}
+
+
+def test_signatures_without_their_day_are_not_used(crawl):
+    crawl(catalog(), '20201028', incremental=True)
+    anmat_scraper = crawl(catalog(), '20201029')
+    labs_signatures = anmat_scraper.saved_labs_signatures()['20201029']
+    with open(anmat_scraper.labs_signatures_path, 'w') as labs_signatures__file:
+        json.dump(labs_signatures, labs_signatures__file)
+    assert crawl(catalog(), '20201030', incremental=True).reused_labs == 0
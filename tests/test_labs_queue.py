@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+
+from labs_queue import DONE, FAILED, LEASED, PENDING, LabsQueue
+
+
+LABS = [(['30000000001', '7790000000001', 'LAB 0 S.A.'], None), (['30000000002', '7790000000002', 'LAB 1 S.A.'], 's1')]
+
+
+@pytest.fixture
+def labs_queue(tmp_path):
+    labs_queue = LabsQueue(str(tmp_path / 'queue.sqlite3'), lease_seconds=.2, max_attempts=2)
+    labs_queue.start('20201029', LABS)
+    yield labs_queue
+    labs_queue.close()
+
+
+def other_process_queue(labs_queue: LabsQueue) -> LabsQueue:
+    return LabsQueue(labs_queue.path, lease_seconds=labs_queue.lease_seconds, max_attempts=labs_queue.max_attempts)
+
+
+def test_units_are_leased_in_order_once(labs_queue):
+    first_unit, second_unit = labs_queue.lease('w1'), other_process_queue(labs_queue).lease('w2')
+    assert (first_unit.lab_num, first_unit.lab_values, first_unit.last_signature) == (0, LABS[0][0], None)
+    assert (second_unit.lab_num, second_unit.last_signature) == (1, 's1')
+    assert labs_queue.lease('w3') is None
+    assert labs_queue.counts() == {LEASED: 2}
+
+
+def test_expired_lease_is_leased_again(labs_queue):
+    assert labs_queue.lease('w1').lab_num == 0
+    assert labs_queue.lease('w2').lab_num == 1
+    time.sleep(labs_queue.lease_seconds * 1.5)
+    assert labs_queue.lease('w2').lab_num == 0
+
+
+def test_renewed_lease_does_not_expire(labs_queue):
+    labs_queue.lease('w1')
+    labs_queue.lease('w2')
+    with labs_queue.keep_leased(0, 'w1'):
+        time.sleep(labs_queue.lease_seconds * 2)
+        assert other_process_queue(labs_queue).lease('w3').lab_num == 1
+    assert labs_queue.counts() == {LEASED: 2}
+
+
+def test_unit_fails_after_max_attempts(labs_queue):
+    for attempt in range(labs_queue.max_attempts):
+        assert labs_queue.lease('w1').lab_num == 0
+        labs_queue.release(0, 'w1')
+    assert labs_queue.failed_units() == [0]
+    assert labs_queue.lease('w1').lab_num == 1
+    assert labs_queue.counts() == {FAILED: 1, LEASED: 1}
+
+
+def test_expired_leases_count_as_attempts(labs_queue):
+    labs_queue.complete(1, 'w0', 's1', None)
+    for attempt in range(labs_queue.max_attempts):
+        assert labs_queue.lease('w1').lab_num == 0
+        time.sleep(labs_queue.lease_seconds * 1.5)
+    assert labs_queue.lease('w1') is None
+    assert labs_queue.failed_units() == [0]
+    assert labs_queue.finished()
+
+
+def test_first_worker_to_complete_wins(labs_queue):
+    labs_queue.lease('w1')
+    time.sleep(labs_queue.lease_seconds * 1.5)
+    assert labs_queue.lease('w2').lab_num == 0
+    labs_queue.complete(0, 'w2', 'signature', [['row', 'of', 'w2']])
+    labs_queue.complete(0, 'w1', 'late signature', [['row', 'of', 'w1']])
+    assert labs_queue.result(0) == ('signature', [['row', 'of', 'w2']])
+    assert labs_queue.counts() == {DONE: 1, PENDING: 1}
+
+
+def test_reused_lab_has_no_rows(labs_queue):
+    labs_queue.complete(1, 'w1', 's1', None)
+    assert labs_queue.result(1) == ('s1', None)
+    assert labs_queue.result(0) is None
+    assert not labs_queue.finished()
+    labs_queue.complete(0, 'w1', 's0', [])
+    assert labs_queue.finished()
+    labs_queue.finish()
+    assert labs_queue.result(0) is None and labs_queue.finished()
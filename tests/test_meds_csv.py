@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from meds_csv import MEDS_HEADER, MedsCSVWriter, med_row, read_meds_csv
+
+
+ROW = (
+    '34765', 'ABBOTT LABORATORIES ARGENTINA S.A.', 'COFRON JARABE', 'JARABE', '1 FRASCO por 100 ML ', '$86.30', '', '',
+    '', '', '', '', '', '07790440470923', 'CLOFEDIANOL 250 MG / 100 ML ', "[['CLOFEDIANOL', '250', 'MG / 100 ML']]"
+)
+
+
+def write_lines(path, lines):
+    with open(path, 'w') as csv__file:
+        csv__file.write('\n'.join(lines) + '\n')
+
+
+def test_unquoted_scraper_files_keep_quotes_in_cells(tmp_path):
+    row = ROW[:4] + ('"3/4 PULGADA" por 1', 'x"y') + ROW[6:]
+    write_lines(tmp_path / '20201029.csv', ['|'.join(MEDS_HEADER), '|'.join(row), '|'.join(ROW)])
+    assert list(read_meds_csv(str(tmp_path / '20201029.csv'))) == [list(row), list(ROW)]
+
+
+def test_old_exports(tmp_path):
+    write_lines(tmp_path / '20200916.csv', [
+        ','.join(f'"{cell}"' for cell in MEDS_HEADER), ','.join(f'"{cell}"' for cell in ROW), '"","","[]"'
+    ])
+    assert list(read_meds_csv(str(tmp_path / '20200916.csv'))) == [list(ROW), ['', '', '[]']]
+
+
+def test_written_rows_are_read_back(tmp_path):
+    rows = [
+        ROW,
+        ROW[:2] + ('NOMBRE | CON BARRA', '"3/4 PULGADA"', 'x"y') + ROW[5:],
+        med_row(ROW[:14], 'IBUPROFENO 400 MG', [['IBUPROFENO', '400', 'MG']]),
+    ]
+    csv_writer = MedsCSVWriter(str(tmp_path / '20201029.csv'))
+    csv_writer.write_rows(rows[:2])
+    csv_writer.close()
+    csv_writer = MedsCSVWriter(str(tmp_path / '20201029.csv'), append=True)
+    csv_writer.write_rows(rows[2:])
+    csv_writer.close()
+    assert list(read_meds_csv(str(tmp_path / '20201029.csv'))) == [
+        list(ROW), list(rows[1]), list(ROW[:14]) + ['IBUPROFENO 400 MG', "[['IBUPROFENO', '400', 'MG']]"]
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+
+import data_publisher
+import meds_query
+from data_publisher import DataPublisher
+from meds_csv import read_meds_csv, snapshot_paths
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_default_paths_are_the_crawl_data_and_the_repo_cache(tmp_path, monkeypatch, capsys):
+    repo_path = tmp_path / 'repo'
+    data_path = DataPublisher(str(repo_path)).data_path
+    os.makedirs(data_path)
+    csv_path = snapshot_paths(os.path.join(REPO_PATH, 'data'))[0]
+    shutil.copy(csv_path, data_path)
+    row = next(row for row in read_meds_csv(csv_path) if row[meds_query.MEDS_HEADER.index('GTIN')])
+    gtin = row[meds_query.MEDS_HEADER.index('GTIN')]
+    monkeypatch.setattr(data_publisher, 'REPO_PATH', str(repo_path) + '/')
+    monkeypatch.setattr(meds_query, 'REPO_PATH', str(repo_path) + '/')
+    (tmp_path / 'elsewhere').mkdir()
+    monkeypatch.chdir(tmp_path / 'elsewhere')
+    meds_query.main(['gtin', gtin])
+    assert gtin in capsys.readouterr().out
+    assert os.path.exists(repo_path / '.cache' / 'meds_index.sqlite3')
+    assert os.listdir(tmp_path / 'elsewhere') == []
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+import os
+
+from http_fixtures import SyntheticZKSession
+
+
+def test_blocked_snapshot_leaves_the_data_path_as_it_was(tmp_path, crawl):
+    crawl(lambda: SyntheticZKSession(6, 2, 3), '20201028')
+    data_files = sorted(os.listdir(tmp_path / 'data' / 'labs'))
+    anmat_scraper = crawl(lambda: SyntheticZKSession(2, 2, 3), '20201029')
+    assert not anmat_scraper.quality_report.passed
+    assert os.path.exists(anmat_scraper.blocked_path + '20201029.csv')
+    assert not os.path.exists(anmat_scraper.csv_meds_path)
+    assert sorted(os.listdir(tmp_path / 'data' / 'labs')) == data_files
+    assert list(anmat_scraper.saved_labs_signatures()) == ['20201028']
+
+
+def test_passed_snapshot_updates_the_labs_history(tmp_path, crawl):
+    crawl(lambda: SyntheticZKSession(6, 2, 3), '20201028')
+    anmat_scraper = crawl(lambda: SyntheticZKSession(7, 2, 3), '20201029')
+    assert anmat_scraper.quality_report.passed
+    assert '20201029.csv' in os.listdir(tmp_path / 'data' / 'labs')
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import sys
+import shutil
+import subprocess
+
+import pytest
+
+from meds_csv import read_meds_csv, snapshot_date, snapshot_paths
+from snapshot_store import SnapshotStore, apply_meds_delta, meds_delta, meds_keys
+
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+CSV_PATHS = snapshot_paths(DATA_PATH)
+
+
+def row(certificado, gtin='', presentacion='1 BLISTER por 10', price='$10.00', name='MED'):
+    return [certificado, 'LAB S.A.', name, 'COMPRIMIDO', presentacion, price] + [''] * 7 + [gtin, '', '[]']
+
+
+def round_trip(last_rows, rows) -> list:
+    """Rows rebuilt from last_rows and their delta, serialized as the store saves it."""
+    delta = [json.loads(json.dumps(operation, ensure_ascii=False)) for operation in meds_delta(last_rows, rows)]
+    return apply_meds_delta(last_rows, delta)
+
+
+@pytest.mark.parametrize('last_csv_path, csv_path', list(zip(CSV_PATHS, CSV_PATHS[1:])),
+                         ids=[snapshot_date(csv_path) for csv_path in CSV_PATHS[1:]])
+def test_round_trip_of_consecutive_days(last_csv_path, csv_path):
+    last_rows, rows = list(read_meds_csv(last_csv_path)), list(read_meds_csv(csv_path))
+    assert round_trip(last_rows, rows) == rows
+
+
+def test_history_has_repeated_keys():
+    rows = list(read_meds_csv(CSV_PATHS[-1]))
+    assert any(key[-1] != '0' for key in meds_keys(rows))
+
+
+def test_no_changes():
+    rows = [row('1'), row('2')]
+    assert meds_delta(rows, [list(med) for med in rows]) == []
+
+
+@pytest.mark.parametrize('rows', [
+    # Removed, changed and added rows
+    [row('1', price='$11.00'), row('3', name='MED 3'), row('4')],
+    # Reordered
+    [row('3'), row('1'), row('2')],
+    # Reordered, with removals and additions in between
+    [row('5'), row('3'), row('4'), row('1')],
+    # A row with another column count
+    [row('1')[:3], row('2'), row('3')],
+    # Repeated keys: one of them removed, changed or moved
+    [row('1'), row('7', gtin='0779'), row('7', gtin='0779', price='$2.00'), row('2'), row('3')],
+    [row('7', gtin='0779', price='$3.00'), row('1'), row('2'), row('3'), row('7', gtin='0779', price='$1.00')],
+    [row('7', gtin='0779', price='$1.00')] * 3 + [row('1')],
+    [],
+])
+def test_round_trip(rows):
+    last_rows = [
+        row('1'), row('7', gtin='0779', price='$1.00'), row('2'), row('7', gtin='0779', price='$2.00'), row('3'),
+        row('7', gtin='0779', price='$3.00'),
+    ]
+    assert round_trip(last_rows, rows) == rows
+    assert round_trip(rows, last_rows) == last_rows
+
+
+def test_store_rebuilds_every_day(tmp_path):
+    csv_paths = CSV_PATHS[-4:]
+    store = SnapshotStore(str(tmp_path / 'store'))
+    for csv_path in csv_paths:
+        store.add_csv(csv_path)
+    for csv_path in csv_paths:
+        # Without the rows of the last saved day in memory, from the base and the deltas
+        assert SnapshotStore(str(tmp_path / 'store')).rows(snapshot_date(csv_path)) == list(read_meds_csv(csv_path))
+    store.rebuild(snapshot_date(csv_paths[-2]), str(tmp_path / 'rebuilt.csv'))
+    assert list(read_meds_csv(str(tmp_path / 'rebuilt.csv'))) == list(read_meds_csv(csv_paths[-2]))
+
+
+def test_snapshot_command(tmp_path):
+    for csv_path in CSV_PATHS[-2:]:
+        shutil.copy(csv_path, tmp_path)
+    repo_path = os.path.dirname(DATA_PATH)
+    imported = subprocess.run([sys.executable, repo_path, 'snapshot', 'import', str(tmp_path)], capture_output=True,
+                              text=True, check=True)
+    assert imported.stderr.split() == [snapshot_date(CSV_PATHS[-2]), 'saved', snapshot_date(CSV_PATHS[-1]), 'saved']
+    subprocess.run([sys.executable, repo_path, 'snapshot', 'rebuild', snapshot_date(CSV_PATHS[-2]),
+                    str(tmp_path / 'rebuilt.csv'), str(tmp_path)], check=True)
+    assert list(read_meds_csv(str(tmp_path / 'rebuilt.csv'))) == list(read_meds_csv(CSV_PATHS[-2]))
+    usage = subprocess.run([sys.executable, repo_path, 'snapshot', '-h'], capture_output=True, text=True, check=True)
+    assert usage.stdout.startswith('usage: python . snapshot')
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+from utils.utils import prefetched
+
+
+def test_prefetched_items_keep_their_order():
+    assert list(prefetched(iter(range(10)), 3)) == list(range(10))
+    assert list(prefetched(iter([]))) == []
+
+
+def test_producer_error_is_raised_to_the_consumer():
+    def items():
+        yield 1
+        yield 2
+        raise ValueError('page 3')
+
+    consumed = []
+    with pytest.raises(ValueError, match='page 3'):
+        for item in prefetched(items(), 2):
+            consumed.append(item)
+    assert consumed == [1, 2]
+
+
+def test_producer_stops_when_the_consumer_stops():
+    produced = []
+
+    def items():
+        for item in range(100):
+            produced.append(item)
+            yield item
+
+    threads = threading.active_count()
+    consumer = prefetched(items(), 2)
+    assert next(consumer) == 0
+    consumer.close()
+    # close() waits for the producer thread, which only got as far as the item it could not queue
+    assert threading.active_count() == threads
+    assert len(produced) <= 4
@@ -1,20 +1,29 @@
 import os
 import sys
+import time
+import queue
+import random
 import threading
 
+from typing import Dict, Iterator
+
 
 class OnOffMethods:
+    """The methods named in ON_OFF_METHODS do nothing while off; `_init` runs the first time it is turned on.
+
+    ON_OFF_METHODS maps each of them to the method it runs while on, so on() and off() only rebind those.
+    """
+    ON_OFF_METHODS = {}  # type: Dict[str, str]
+
     def __init__(self, on=False, *argv, **kwargs):
-        self.attr_dict = {}
         self.initialized = False
+        self.init_argv = argv
+        self.init_kwargs = kwargs
+        self.is_on = False
         if on:
-            self.is_on = True
-            self._do_init(argv, kwargs)
+            self.on()
         else:
-            self.init_argv = argv
-            self.init_kwargs = kwargs
             self.off()
-            self.is_on = False
 
     def _do_init(self, argv, kwargs):
         self._init(*argv, **kwargs)
@@ -28,35 +37,18 @@ class OnOffMethods:
         """Off method."""
         pass
 
-    def save_attr(self):
-        for attr_name in dir(self):
-            attr = getattr(self, attr_name)
-            self.attr_dict[attr_name] = attr
-
     def on(self):
         if self.is_on:
             return
-        for attr_name in self.attr_dict:
-            if attr_name.startswith('__') and attr_name.endswith('__'):
-                continue
-            setattr(self, attr_name, self.attr_dict[attr_name])
         if not self.initialized:
             self._do_init(self.init_argv, self.init_kwargs)
-            return
+        for method_name, on_method_name in self.ON_OFF_METHODS.items():
+            setattr(self, method_name, getattr(self, on_method_name))
         self.is_on = True
 
     def off(self):
-        self.save_attr()
-        for attr_name in dir(self):
-            if attr_name.startswith('__') and attr_name.endswith('__'):
-                continue
-            if attr_name in ('on', 'attr_dict', 'init_argv', 'init_kwargs', '_init', '_do_init'):
-                continue
-            attr = getattr(self, attr_name)
-            if callable(attr):
-                setattr(self, attr_name, self.pass_)
-            else:
-                setattr(self, attr_name, None)
+        for method_name in self.ON_OFF_METHODS:
+            setattr(self, method_name, self.pass_)
         self.is_on = False
 
 
@@ -76,6 +68,7 @@ class PrintControl(OnOffMethods):
     GREEN = 'green'
     RED = 'red'
     WITHE = 'withe'
+    ON_OFF_METHODS = {'show': '_print', 'add': '_concatenate'}
 
     @classmethod
     def print_color(cls, string, color=None, *args, **kwargs):
@@ -101,10 +94,8 @@ class PrintControl(OnOffMethods):
         self.flush = kwargs['flush']
         self.color = kwargs['color']
         self.formatter_function = kwargs['formatter_function']
-        self.show = self._print
         self._len_last_print = 0
         self.to_print_ = ''
-        self.add = self._concatenate
         self.m = threading.Lock()
 
     def _print(self, string=None, new_line=True, clean_line=False, color=None, transformation=None):
@@ -145,6 +136,171 @@ class PrintControl(OnOffMethods):
         self.to_print_ += string
 
 
+class RateLimiter:
+    def __init__(self, max_per_second=None):
+        self.min_interval = 1 / max_per_second if max_per_second else 0
+        self._next_time = 0
+        self.m = threading.Lock()
+
+    def wait(self):
+        if not self.min_interval:
+            return
+        with self.m:
+            now = time.monotonic()
+            wait_until = max(now, self._next_time)
+            self._next_time = wait_until + self.min_interval
+        if wait_until > now:
+            time.sleep(wait_until - now)
+
+    def on_response(self, seconds):
+        """Feedback of a response that took that many seconds (ignored by the fixed rate)."""
+        pass
+
+    def on_error(self):
+        """Feedback of a server error or connection reset (ignored by the fixed rate)."""
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """AIMD request rate shared by many sessions.
+
+    While the responses are as fast as usual the rate grows `additive_increase` requests per second each second, a
+    server error or connection reset multiplies it by `multiplicative_decrease` and responses slower than
+    `latency_factor` times the usual ones by its square root (at most once every `cooldown_seconds`).
+    """
+
+    def __init__(
+            self, initial_per_second=2., min_per_second=.2, max_per_second=None, additive_increase=.5,
+            multiplicative_decrease=.5, latency_factor=3., cooldown_seconds=2.
+    ):
+        super().__init__(initial_per_second)
+        self.rate = initial_per_second
+        self.min_rate = min_per_second
+        self.max_rate = max_per_second or float('inf')
+        self.additive_increase = additive_increase
+        self.multiplicative_decrease = multiplicative_decrease
+        self.latency_factor = latency_factor
+        self.cooldown_seconds = cooldown_seconds
+        self.throttled = False
+        self.last_request = None
+        self.interval_ewma = None
+        self.latency_ewma = None
+        self.base_latency = None
+        self.last_decrease = float('-inf')
+        self.start = self.last_change = time.monotonic()
+        self.rate_seconds = 0.
+        self.lowest_rate = self.highest_rate = self.rate
+        self.increases = 0
+        self.decreases = 0
+        self._set_rate(initial_per_second, self.start)
+
+    def wait(self):
+        with self.m:
+            now = time.monotonic()
+            if self.last_request is not None:
+                interval = now - self.last_request
+                self.interval_ewma = interval if self.interval_ewma is None else .8 * self.interval_ewma + .2 * interval
+            self.last_request = now
+            wait_until = max(now, self._next_time)
+            self.throttled = wait_until > now
+            self._next_time = wait_until + self.min_interval
+        if wait_until > now:
+            time.sleep(wait_until - now)
+
+    def _set_rate(self, rate, now):
+        self.rate_seconds += self.rate * (now - self.last_change)
+        self.last_change = now
+        self.rate = min(self.max_rate, max(self.min_rate, rate))
+        self.min_interval = 1 / self.rate
+        self.lowest_rate = min(self.lowest_rate, self.rate)
+        self.highest_rate = max(self.highest_rate, self.rate)
+
+    def _decrease(self, factor):
+        now = time.monotonic()
+        if now - self.last_decrease < self.cooldown_seconds:
+            return
+        self.last_decrease = now
+        self.decreases += 1
+        # Back off from the rate really reached, the allowed one can be far above it
+        measured_rate = 1 / self.interval_ewma if self.interval_ewma else self.rate
+        self._set_rate(min(self.rate, measured_rate) * factor, now)
+
+    def on_response(self, seconds):
+        with self.m:
+            self.latency_ewma = seconds if self.latency_ewma is None else .8 * self.latency_ewma + .2 * seconds
+            # The usual latency is the lowest one seen, slowly forgotten
+            self.base_latency = seconds if self.base_latency is None else min(seconds, self.base_latency * 1.001)
+            if self.latency_ewma > self.latency_factor * self.base_latency:
+                self._decrease(self.multiplicative_decrease ** .5)
+            elif self.throttled and self.rate < self.max_rate:
+                self.increases += 1
+                self._set_rate(self.rate + self.additive_increase / self.rate, time.monotonic())
+
+    def on_error(self):
+        with self.m:
+            self._decrease(self.multiplicative_decrease)
+
+    def stats(self) -> dict:
+        with self.m:
+            now = time.monotonic()
+            mean_rate = (self.rate_seconds + self.rate * (now - self.last_change)) / max(now - self.start, 1e-9)
+            return {
+                'rate': self.rate, 'mean_rate': mean_rate, 'lowest_rate': self.lowest_rate,
+                'highest_rate': self.highest_rate, 'increases': self.increases, 'decreases': self.decreases
+            }
+
+
+def prefetched(items: Iterator, max_ahead=1) -> Iterator:
+    """The items of an iterator, produced by another thread up to max_ahead items ahead of the consumer.
+
+    Its exceptions are raised to the consumer and, if the consumer stops, the thread stops after its current item.
+    """
+    produced = queue.Queue(max_ahead)
+    stop = threading.Event()
+    end = object()
+
+    def put(item, error=None) -> bool:
+        while not stop.is_set():
+            try:
+                produced.put((item, error), timeout=.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+            put(end)
+        except BaseException as e:
+            put(None, e)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = produced.get()
+            if error is not None:
+                raise error
+            if item is end:
+                return
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+
+def backoff_delay(attempt, base=1., cap=120.):
+    """Exponential backoff with jitter: half of the delay is fixed and half is random."""
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
 def file_abs_path(file):
     return os.path.abspath(file)
 
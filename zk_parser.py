@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import re
+
+from typing import List, NamedTuple, Optional, Tuple
+
+import requests
+
+
+MEDS_ROW_CELLS = 14
+DRUGS_ROW_CELLS = 3
+NO_RESULTS_TEXT = 'La búsqueda no ha devuelto resultados'
+
+PAGE_COUNT_RE = re.compile(r'"pageCount",([0-9]+)]')
+TOTAL_SIZE_RE = re.compile(r'"totalSize",([0-9]+)]')
+MEDS_CELL_RE = re.compile(
+    r"',{(visible:false,)?\$\$0onSwipe:true,\$\$0onAfterSize:true(?:,value:'([^']+)')?}"
+)
+MEDS_DRUGS_LABEL_RE = re.compile(
+    r"\['zul\.wgt\.Label','([^']+)',{\$\$0onSwipe:true,\$onClick:true,\$\$0onAfterSize:true,"
+    r"style:'cursor:pointer',value:'([^']+)'},\[]]]],"
+)
+LABS_SELECTOR_ITEM_RE = re.compile(
+    r"\['zul\.sel\.Listitem','([^']+)',{\$\$0onSwipe:true,\$\$0onAfterSize:true,_loaded:true,_index:"
+)
+LABEL_RE = re.compile(r"label:'([^']+)'")
+DRUGS_CELL_RE = re.compile(r"',{\$\$0onSwipe:true,\$\$0onAfterSize:true,value:'([^']+)")
+DT_ID_RE = re.compile(r"dt:'([a-z0-9_]+)'")
+
+
+class ZKParseError(requests.exceptions.RequestException):
+    """Response without the component the navigation needs, like an error page, so the call is retried."""
+
+
+class MedsPage(NamedTuple):
+    page_count: Optional[int]
+    total_size: Optional[int]
+    no_results: bool
+    rows: List[Tuple[str, ...]]
+    drugs_labels: List[Tuple[str, str]]
+
+
+class LabsSelectorPage(NamedTuple):
+    page_count: Optional[int]
+    total_size: Optional[int]
+    item_names: List[str]
+    labels: List[str]
+
+    def lab_values(self, page_list_pos) -> List[str]:
+        """CUIT, GLN and razón social of the lab in that position of the page."""
+        return self.labels[page_list_pos * 3:page_list_pos * 3 + 3]
+
+
+def _search_int(pattern, text) -> Optional[int]:
+    match = pattern.search(text)
+    return int(match.group(1)) if match else None
+
+
+def parse_meds_page(text) -> MedsPage:
+    cells = ['0' if hidden else value for hidden, value in MEDS_CELL_RE.findall(text)]
+    return MedsPage(
+        page_count=_search_int(PAGE_COUNT_RE, text),
+        total_size=_search_int(TOTAL_SIZE_RE, text),
+        no_results=NO_RESULTS_TEXT in text,
+        rows=[tuple(cells[pos:pos + MEDS_ROW_CELLS]) for pos in range(0, len(cells), MEDS_ROW_CELLS)],
+        drugs_labels=MEDS_DRUGS_LABEL_RE.findall(text)
+    )
+
+
+def parse_labs_selector_page(text) -> LabsSelectorPage:
+    return LabsSelectorPage(
+        page_count=_search_int(PAGE_COUNT_RE, text),
+        total_size=_search_int(TOTAL_SIZE_RE, text),
+        item_names=LABS_SELECTOR_ITEM_RE.findall(text),
+        labels=LABEL_RE.findall(text)
+    )
+
+
+def parse_drugs_table(text) -> List[List[str]]:
+    drugs_cells = DRUGS_CELL_RE.findall(text)
+    return [drugs_cells[pos:pos + DRUGS_ROW_CELLS] for pos in range(0, len(drugs_cells), DRUGS_ROW_CELLS)]
+
+
+def parse_dt_id(text) -> str:
+    match = DT_ID_RE.search(text)
+    if not match:
+        raise ZKParseError('No ZK desktop id in the main page')
+    return match.group(1)